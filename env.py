@@ -9,22 +9,56 @@ here we do that by:
 this also allows migration to another mechanism than environnment variable, such as a configuration file for example, without having to change the code related to experiments.
 '''
 
-import shared.catalog
+import shared.cache, shared.catalog, shared.hparams, shared.packfile
 import os, pathlib     
 
 
-def default_catalog(HPARAMS: shared.hparams.HPARAMS, write=False) -> shared.catalog.Catalog:
-    """utility to standardize a catalog for a given HPARAMS type."""
+# storage engines: (read only, writable) Catalog classes
+CATALOG_ENGINES = {
+    "files": (shared.catalog.ROCatalog, shared.catalog.Catalog),            # one file per item
+    "pack" : (shared.packfile.ROPackCatalog, shared.packfile.PackCatalog),  # append-only segments + index
+}
+
+# one read cache (see shared.cache) shared by all the catalogs, CATALOG_CACHE_BYTES=<budget> enables it
+CATALOG_CACHE = shared.cache.ReadCache(int(os.environ["CATALOG_CACHE_BYTES"])) if os.environ.get("CATALOG_CACHE_BYTES") else None
+
+def default_catalog(HPARAMS: shared.hparams.HPARAMS, write=False, engine=None) -> shared.catalog.Catalog:
+    """utility to standardize a catalog for a given HPARAMS type.
+
+    *engine*: see CATALOG_ENGINES, defaults to the CATALOG_ENGINE environment variable (else "files")
+
+    CATALOG_INDEX=1 enables the sqlite index of catalogs (see shared.catalog_index)
+    CATALOG_SHARD_DEPTH=<n> stores items in n levels of hash prefixed directories (see Catalog.reshard)
+    CATALOG_DURABILITY=<policy> none (default), close, batch(n, ms) or always (see shared.durability)
+    CATALOG_HASH_SCHEME=<scheme> legacy (default) or merkle-v1 (see shared.hash.hash)
+    CATALOG_HASH_ALGORITHM=<algorithm> md5 (default), blake2b or sha256 (see shared.hash.ALGORITHMS and shared.rekey)
+    CATALOG_CHUNK_THRESHOLD=<n> bytes values of at least n bytes are stored as deduplicated chunks (see shared.chunks)
+    CATALOG_CODEC=<codec> none (default), zlib, lzma or bz2 compression of the records (see shared.deser.CODECS)
+    CATALOG_CACHE_BYTES=<n> caches the items read, within a budget of n bytes shared by all catalogs (see CATALOG_CACHE)
+    """
     try:
         CATALOG_PATH = pathlib.Path(os.environ["CATALOG_PATH"])
     except KeyError:
         raise Exception("CATALOG_PATH is not defined.\nHint: set CATALOG_PATH environment variable to the catalog directory of your choice.")
 
-    Catalog = shared.catalog.Catalog if write else shared.catalog.ROCatalog
+    engine = engine or os.environ.get("CATALOG_ENGINE", "files")
+    try:
+        ROCatalog, Catalog = CATALOG_ENGINES[engine]
+    except KeyError:
+        raise Exception(f"unknown CATALOG_ENGINE {engine}.\nHint: use one of {', '.join(CATALOG_ENGINES)}")
+    Catalog = Catalog if write else ROCatalog
     
     return Catalog(
         path        = CATALOG_PATH / HPARAMS.__name__,
         item_suffix = f".{HPARAMS.__name__.lower()}",
         Type        = HPARAMS,
-        salt        = b""
+        salt        = b"",
+        indexed     = os.environ.get("CATALOG_INDEX", "") == "1",
+        shard_depth = int(os.environ.get("CATALOG_SHARD_DEPTH", "0")),
+        cache       = CATALOG_CACHE,
+        durability  = os.environ.get("CATALOG_DURABILITY", "none"),
+        hash_scheme = os.environ.get("CATALOG_HASH_SCHEME", "legacy"),
+        hash_algorithm = os.environ.get("CATALOG_HASH_ALGORITHM", "md5"),
+        chunk_threshold = int(os.environ.get("CATALOG_CHUNK_THRESHOLD", "0")),
+        codec       = os.environ.get("CATALOG_CODEC", "none"),
     )
@@ -0,0 +1,175 @@
+"""asyncio wrapper of a Catalog: the blocking calls (flock, file I/O) run in a bounded thread pool.
+
+    async with AsyncCatalog(catalog) as aio:
+        _hash = await aio.add(item)
+        item  = await aio.get(_hash)
+        async for _hash in aio.iter(): ...
+
+hashes and items are those of the wrapped catalog (same calls, in another thread).
+"""
+import asyncio, concurrent.futures, itertools
+
+
+class AsyncCatalog:
+    def __init__(aio, catalog, max_workers=4, max_pending=None):
+        """`max_pending`: calls submitted at once (default 2 * max_workers), others wait for a slot (backpressure)"""
+        aio.catalog  = catalog
+        aio.executor = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix="AsyncCatalog")
+        aio.pending  = asyncio.Semaphore(max_pending or 2 * max_workers)
+
+    async def run(aio, function, *args, complete=False, executor=None):
+        """`complete`: once submitted the call is not interrupted, a cancelled caller waits for it before CancelledError
+        (e.g. add: no half written item file is left behind). `executor`: instead of the pool (see iter)"""
+        # note: the slot is held until the call ends in its thread, not until the caller stops waiting for it
+        # (a cancelled caller would otherwise let more than max_pending calls run at once)
+        loop = asyncio.get_running_loop()
+        await aio.pending.acquire()
+        try:
+            submitted = (executor or aio.executor).submit(function, *args)
+        except BaseException:
+            aio.pending.release()
+            raise
+        submitted.add_done_callback(lambda _: release_threadsafe(loop, aio.pending))
+        future = asyncio.wrap_future(submitted)
+        if not complete:
+            return await future
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            while not future.done():
+                try:
+                    await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    pass
+            raise
+
+    async def add(aio, item) -> "Hash":
+        return await aio.run(aio.catalog.add, item, complete=True)
+
+    async def add_nosafe(aio, item) -> "Hash":
+        return await aio.run(aio.catalog.add_nosafe, item, complete=True)
+
+    async def get(aio, hash, lazy=False):
+        return await aio.run(aio.catalog.get, hash, lazy)
+
+    async def contains(aio, hash) -> bool:
+        return await aio.run(aio.catalog.contains, hash)
+
+    async def iter(aio, batch_size=256) -> ["Hash"]:
+        """async iterator of catalog.iter, listed by batches in a thread of its own"""
+        # note: the generator is created, advanced and closed in the same thread (e.g. the sqlite cursor of an
+        # indexed catalog can not be used from another thread, see catalog_index.hashes)
+        lister = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="AsyncCatalog.iter")
+        hashes = None
+        try:
+            hashes = await aio.run(aio.catalog.iter, executor=lister)
+            while True:
+                batch = await aio.run(lambda: list(itertools.islice(hashes, batch_size)), executor=lister)
+                if not batch:
+                    return
+                for _hash in batch:
+                    yield _hash
+        finally:
+            if hashes is not None:
+                lister.submit(hashes.close)
+            lister.shutdown(wait=False)
+
+    def close(aio):
+        aio.executor.shutdown(wait=True)
+
+    async def __aenter__(aio):
+        return aio
+
+    async def __aexit__(aio, *exc_info):
+        await asyncio.get_running_loop().run_in_executor(None, aio.close)
+
+def release_threadsafe(loop, semaphore):
+    try:
+        loop.call_soon_threadsafe(semaphore.release)
+    except RuntimeError:  # loop closed: nobody waits for the slot anymore
+        pass
+
+
+#### tests
+def test_AsyncCatalog():
+    import os
+    import pathlib
+    import shutil
+    import shared.catalog, shared.hash, shared.hparams
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    hparams, = shared.hparams.fixture_nested_hparams()
+    catalog = shared.catalog.Catalog(
+        path = SDEXPERIMENTS_PATH / "testAsyncCatalog",
+        item_suffix = ".hparams",
+        Type = type(hparams),
+    )
+    shutil.rmtree(catalog.path, ignore_errors=True)
+    items = [hparams._replace(seed=seed) for seed in range(20)]
+
+    async def main():
+        async with AsyncCatalog(catalog, max_workers=2, max_pending=3) as aio:
+            hashes = await asyncio.gather(*(aio.add(item) for item in items))
+            assert list(hashes) == [catalog.add(item) for item in items]
+            assert await asyncio.gather(*(aio.get(_hash) for _hash in hashes)) == items
+            assert await aio.contains(hashes[0]) and not await aio.contains(b"\0" * 16)
+            assert {_hash async for _hash in aio.iter(batch_size=7)} == set(hashes)
+            # a cancelled add leaves a complete item
+            item = hparams._replace(seed=-1)
+            task = asyncio.create_task(aio.add(item))
+            await asyncio.sleep(0)
+            task.cancel()
+            try:
+                await task
+                assert False, "expected CancelledError"
+            except asyncio.CancelledError:
+                pass
+    asyncio.run(main())
+    item = hparams._replace(seed=-1)
+    _hash = shared.hash.hash(catalog.salt, catalog.Type, item)
+    assert catalog.get(_hash) == item
+
+    shutil.rmtree(catalog.path)
+
+    # indexed: listed from a sqlite cursor, while other calls run in the pool
+    catalog = catalog._replace(path=SDEXPERIMENTS_PATH / "testAsyncCatalogIndexed", indexed=True)
+    shutil.rmtree(catalog.path, ignore_errors=True)
+    hashes = catalog.add_many([hparams._replace(seed=seed) for seed in range(2000)])
+    async def iter_while_contains():
+        async with AsyncCatalog(catalog, max_workers=4) as aio:
+            async def listed():
+                return [_hash async for _hash in aio.iter(batch_size=10)]
+            async def contained():
+                return [await aio.contains(_hash) for _hash in hashes]
+            return await asyncio.gather(listed(), contained(), contained())
+    listed, *contained = asyncio.run(iter_while_contains())
+    assert sorted(listed) == sorted(hashes) and all(map(all, contained))
+    shutil.rmtree(catalog.path)
+
+def test_AsyncCatalog_cancelled_calls_hold_their_slot():
+    import threading
+    release = threading.Event()
+    running, peak = [0], [0]
+    lock = threading.Lock()
+    def blocking():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        release.wait(5)
+        with lock:
+            running[0] -= 1
+
+    async def main():
+        async with AsyncCatalog(catalog=None, max_workers=4, max_pending=2) as aio:
+            tasks = [asyncio.create_task(aio.run(blocking)) for _ in range(2)]
+            await asyncio.sleep(0.1)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # the cancelled calls still run: the next calls wait for their slots
+            tasks = [asyncio.create_task(aio.run(blocking)) for _ in range(2)]
+            await asyncio.sleep(0.1)
+            assert peak[0] == 2 and not any(task.done() for task in tasks)
+            release.set()
+            await asyncio.gather(*tasks)
+    asyncio.run(main())
+    assert peak[0] == 2 and running[0] == 0
@@ -0,0 +1,106 @@
+"""in-process LRU cache of deserialized catalog items, bounded by a byte budget.
+
+items are content addressed and written read only: a (catalog path, hash) key never changes, no invalidation needed.
+the cost of an item is the size of its serialized form. cached items are shared between callers (tuples, bytes and
+read only arrays are immutable).
+"""
+import collections, threading, typing
+
+
+class CacheStats(typing.NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    items: int
+    size: int
+    budget: int
+
+class ReadCache:
+    def __init__(cache, budget: int):
+        """`budget`: bytes, items larger than the budget are not cached"""
+        cache.budget    = budget
+        cache.items     = collections.OrderedDict()  # key -> (item, size), least recently used first
+        cache.size      = 0
+        cache.hits      = 0
+        cache.misses    = 0
+        cache.evictions = 0
+        cache.lock      = threading.Lock()
+
+    def get(cache, key, default=None):
+        with cache.lock:
+            try:
+                item, size = cache.items[key]
+            except KeyError:
+                cache.misses += 1
+                return default
+            cache.items.move_to_end(key)
+            cache.hits += 1
+            return item
+
+    def put(cache, key, item, size: int):
+        if size > cache.budget:
+            return
+        with cache.lock:
+            if key in cache.items:
+                cache.items.move_to_end(key)
+                return
+            cache.items[key] = item, size
+            cache.size += size
+            while cache.size > cache.budget:
+                _, (_, evicted_size) = cache.items.popitem(last=False)
+                cache.size -= evicted_size
+                cache.evictions += 1
+
+    def clear(cache):
+        with cache.lock:
+            cache.items.clear()
+            cache.size = 0
+
+    def stats(cache) -> CacheStats:
+        with cache.lock:
+            return CacheStats(cache.hits, cache.misses, cache.evictions, len(cache.items), cache.size, cache.budget)
+
+
+#### tests
+def test_ReadCache():
+    cache = ReadCache(budget=10)
+    cache.put("a", "A", 4)
+    cache.put("b", "B", 4)
+    assert cache.get("a") == "A"            # b is now the least recently used
+    cache.put("c", "C", 4)                  # evicts b
+    assert cache.get("b") is None
+    assert cache.get("c") == "C" and cache.get("a") == "A"
+    cache.put("d", "D", 11)                 # over budget: not cached
+    assert cache.get("d", "missing") == "missing"
+    assert cache.stats() == CacheStats(hits=3, misses=2, evictions=1, items=2, size=8, budget=10)
+
+def test_Catalog_cache():
+    import os
+    import pathlib
+    import shutil
+    import shared.catalog, shared.hparams, shared.packfile
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    hparams, = shared.hparams.fixture_nested_hparams()
+    cache = ReadCache(budget=2**20)
+    for Catalog in (shared.catalog.Catalog, shared.packfile.PackCatalog):
+        catalog = Catalog(
+            path = SDEXPERIMENTS_PATH / f"testCatalogCache{Catalog.__name__}",
+            item_suffix = ".hparams",
+            Type = type(hparams),
+            cache = cache,
+        )
+        shutil.rmtree(catalog.path, ignore_errors=True)
+        _hash = catalog.add(hparams)
+        before = cache.stats()
+        assert catalog.get(_hash) == hparams
+        assert catalog.get(_hash) is catalog.get(_hash)
+        stats = cache.stats()
+        assert (stats.hits - before.hits, stats.misses - before.misses, stats.items - before.items) == (2, 1, 1)
+        # lazy gets are not cached
+        assert catalog.get(_hash, lazy=True) is not catalog.get(_hash)
+        try:
+            catalog.get(b"\0" * 16)
+            assert False, "expected KeyError"
+        except KeyError:
+            pass
+        shutil.rmtree(catalog.path)
@@ -1,6 +1,10 @@
 import typing
-import pathlib, fcntl
-from shared import deser, hash #, experimental
+import io, pathlib, mmap, os, shutil, tempfile, threading, itertools, time, concurrent.futures, functools, pickle
+from shared import deser, hash, catalog_index, durability, refs #, experimental
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 class Catalog(typing.NamedTuple):
     path: str          # filesystem
@@ -8,6 +12,15 @@ class Catalog(typing.NamedTuple):
     item_suffix: str   # filesystem
     Type : str         # import_from_qualname, hashable, de/serializable (e.g experimental.EXPERIMENT_HPARAMS
     salt: bytes = b''  # DEPRECATED: makes difficult to determine salt if several salts shared the same path
+    indexed: bool = False  # contains/iter use the sqlite index (see shared.catalog_index)
+    shard_depth: int = 0   # items in nested directories named by hash prefixes, e.g. 2: ab/cd/abcd...<suffix> (see reshard)
+    cache: object = None   # shared.cache.ReadCache of the items returned by get (not lazy)
+    durability: str = "none"  # "none", "close", "batch(n, ms)" or "always" (see shared.durability and flush)
+    hash_scheme: str = "legacy"  # "legacy" or "merkle-v1" (see shared.hash.hash)
+    hash_algorithm: str = "md5"  # see shared.hash.ALGORITHMS, items of other algorithms stay readable (see shared.rekey)
+    chunk_threshold: int = 0     # bytes values of at least this size are stored as deduplicated chunks (see shared.chunks), 0: never
+    codec: str = "none"          # compression of the records (see deser.CODECS), hashes do not depend on it
+    codec_threshold: int = 4096  # smaller records are not compressed
 
     def test_fixtures(catalog):
         # define an experiment in python
@@ -21,105 +34,558 @@ class Catalog(typing.NamedTuple):
         #raise NotImplementedError("TODO mkdirs(catalog.path, exists_ok=True)")
     
     def item_path(catalog, hash) -> pathlib.Path:
+        hash_hex = hash.hex()
+        shards = (hash_hex[2*i:2*i+2] for i in range(catalog.shard_depth))
+        return pathlib.Path(catalog.path, *shards, f"{hash_hex}{catalog.item_suffix}")
+
+    def flat_item_path(catalog, hash) -> pathlib.Path:
+        """item_path before sharding (see reshard)"""
         return pathlib.Path(catalog.path) / f"{hash.hex()}{catalog.item_suffix}"
 
+    def find_item_path(catalog, hash) -> pathlib.Path:
+        """item_path, or flat_item_path if not resharded yet, or None"""
+        item_path = catalog.item_path(hash)
+        if item_path.exists():
+            return item_path
+        if catalog.shard_depth and catalog.flat_item_path(hash).exists():
+            return catalog.flat_item_path(hash)
+        return None
+
     def contains(catalog, hash) -> bool:
+        if catalog.indexed:
+            return catalog_index.contains(catalog, hash)
         catalog.ensure_exists()
-        return catalog.item_path(hash).exists()
+        return catalog.find_item_path(hash) is not None
+
+    def exists(catalog, hash) -> bool:
+        """contains, double checked on disk for an indexed catalog (before writing: its index may lag behind)"""
+        if catalog.contains(hash):
+            return True
+        item_path = catalog.find_item_path(hash) if catalog.indexed else None
+        if item_path is not None:
+            catalog_index.record(catalog, hash, item_path.stat().st_size)
+            return True
+        return False
+
+    def added(catalog, hash, size, item):
+        """bookkeeping once an item is written"""
+        if catalog.indexed:
+            catalog_index.record(catalog, hash, size)
+        refs.record_many(catalog, ((hash, item),))
+
+    def find_by(catalog, **references) -> ["Hash"]:
+        """hashes of the items referring to the given values, e.g. find_by(experiment=ref) (see shared.refs)"""
+        return refs.find_by(catalog, **references)
+
+    def where(catalog, *conditions, refresh=False) -> ["Hash"]:
+        """hashes of the items whose fields match conditions, e.g. where(("optimizer.lr", "<", 1e-3)) (see shared.query)"""
+        from shared import query
+        return query.where(catalog, *conditions, refresh=refresh)
     
+    def hash_item(catalog, item) -> "Hash":
+        return hash.hash(catalog.salt, catalog.Type, item, catalog.hash_scheme, catalog.hash_algorithm)
+
+    def stream_digest(catalog):
+        """hashlib object to update while serializing (see add_stream), None if the hash scheme can not"""
+        return hash.new(catalog.salt, catalog.hash_algorithm) if catalog.hash_scheme == "legacy" else None
+
+    def hash_buffer(catalog, buffer) -> "Hash":
+        """hash of the item serialized in a file (note: memory mapped, bytes fields are not loaded)"""
+        buffer.flush()
+        view = mmap.mmap(buffer.fileno(), 0, access=mmap.ACCESS_READ)
+        return catalog.hash_item(catalog.deserialize_view(view))
+
+    def serialize(catalog, item, buffer, digest=None):
+        """deser.serialize with the catalog settings"""
+        chunker = None
+        if catalog.chunk_threshold:
+            from shared import chunks
+            chunker = chunks.Chunker(chunks.chunk_catalog(catalog), catalog.chunk_threshold)
+        if catalog.codec == "none":
+            return deser.serialize(catalog.Type, item, buffer, digest=digest, chunker=chunker)
+        # note: spooled to a file if large, then compressed by chunks (see deser.compress_record)
+        catalog.ensure_exists()
+        with tempfile.SpooledTemporaryFile(max_size=8 * deser.CHUNK_SIZE, dir=catalog.path) as spool:
+            deser.serialize(catalog.Type, item, spool, digest=digest, chunker=chunker)
+            size = spool.tell()
+            spool.seek(0)
+            if size < catalog.codec_threshold:
+                shutil.copyfileobj(spool, buffer)
+            else:
+                deser.compress_record(spool, buffer, catalog.codec)
+
+    def deserialize(catalog, buffer):
+        return deser.deserialize(catalog.Type, buffer, chunks=catalog.reassemble)
+
+    def deserialize_view(catalog, view):
+        return deser.deserialize_view(catalog.Type, view, chunks=catalog.reassemble)
+
+    def deserialize_lazy(catalog, view) -> "deser.LazyRecord":
+        return deser.deserialize_lazy(catalog.Type, view, chunks=catalog.reassemble)
+
+    def reassemble(catalog, manifest) -> bytes:
+        """a bytes value stored as chunks (see shared.chunks)"""
+        from shared import chunks
+        return chunks.reassemble(chunks.chunk_catalog(catalog), manifest)
+
     def add(catalog, item) -> "Hash":
+        # bytes fields given as file-like or iterator of chunks
+        if deser.has_stream(catalog.Type, item):
+            return catalog.add_stream(item)
         # derive hash
-        _hash = hash.hash(catalog.salt, catalog.Type, item)
+        _hash = catalog.hash_item(item)
         # already in catalog ?
-        if catalog.contains(_hash):
+        if catalog.exists(_hash):
             return _hash
         # write it to disk
-        item_path = catalog.item_path(_hash)
-        with open(catalog.item_path(_hash), 'wb') as buffer:
-            # acquire exclusive lock blocking
-            fcntl.flock(buffer, fcntl.LOCK_EX)
-            exception = None
-            try:
-                # serialize and write
-                deser.serialize(catalog.Type, item, buffer)
-            except Exception as exception:
-                pass  # we release the lock before raising
-            # release lock
-            fcntl.flock(buffer, fcntl.LOCK_UN)
+        size = catalog.write(_hash, item)
+        catalog.added(_hash, size, item)
+        return _hash
 
-            if exception is not None:
-                raise exception
-            
+    def write(catalog, _hash, item) -> int:
+        """writes an item file (whether it exists or not). returns its size"""
+        temp_path, size = catalog.write_temp(lambda buffer: catalog.serialize(item, buffer))
+        catalog.publish(temp_path, _hash)
+        return size
+
+    def write_temp(catalog, write) -> "(temp_path, size)":
+        """write(buffer) to a read only temporary file of the catalog directory (fsynced unless durability none)"""
+        catalog.ensure_exists()
+        # note: in the catalog directory, i.e. same filesystem as the items, rename is atomic
+        with tempfile.NamedTemporaryFile(dir=catalog.path, prefix=".", suffix=".tmp", delete=False) as buffer:
+            try:
+                write(buffer)
+                size = buffer.tell()
+                # note: batch too, a published item is never empty/torn after a crash (only directories are batched)
+                if catalog.policy().mode != "none":
+                    buffer.flush()
+                    os.fsync(buffer.fileno())
+            except BaseException:
+                os.unlink(buffer.name)
+                raise
         # set as read only
-        item_path.chmod(0o400)
+        os.chmod(buffer.name, 0o400)
+        return buffer.name, size
+
+    def publish(catalog, temp_path, _hash, exclusive=False):
+        """moves a complete item file (see write_temp) to its item_path: readers never see a partial item.
+        `exclusive`: hard link instead of rename, FileExistsError if the item exists"""
+        item_path = catalog.item_path(_hash)
+        if catalog.shard_depth:
+            item_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        try:
+            if exclusive:
+                os.link(temp_path, item_path)
+            else:
+                os.rename(temp_path, item_path)
+        finally:
+            if exclusive:
+                os.unlink(temp_path)
+        catalog.persist((item_path,), synced=True)
+
+    def policy(catalog) -> "durability.Durability":
+        return durability.parse(catalog.durability)
+
+    def persist(catalog, paths, synced=False):
+        """applies the durability policy to files just published. `synced`: their content was fsynced already"""
+        policy = catalog.policy()
+        if policy.mode == "batch":
+            durability.flusher(catalog.path, policy).submit(paths, synced)
+        elif policy.mode == "always" or (policy.mode == "close" and not synced):
+            for path in paths if not synced else ():
+                durability.fsync_file(path)
+            if policy.mode == "always":
+                for directory in dict.fromkeys(pathlib.Path(path).parent for path in paths):
+                    durability.fsync_directory(directory)
+
+    def flush(catalog):
+        """barrier: the items added before are persisted once flush returns (durability batch, the others persist
+        items in add, but none)"""
+        policy = catalog.policy()
+        if policy.mode == "batch":
+            durability.flusher(catalog.path, policy).flush()
+
+    def write_batch(catalog, hashes_and_items):
+        """writes items known to be missing (see add_many)"""
+        hashes_and_items = list(hashes_and_items)
+        rows = [(_hash, catalog.write(_hash, item)) for _hash, item in hashes_and_items]
+        if catalog.indexed:
+            catalog_index.record_many(catalog, rows)
+        refs.record_many(catalog, hashes_and_items)
+
+    def add_many(catalog, items, max_workers=None, batch_size=1024) -> ["Hash"]:
+        """add for many items, with the same final state as add in a loop: items are hashed in a process pool
+        (see hash_many), hashes already present are filtered in a single listing pass, new items are written by
+        batches (see write_batch). returns the hashes in input order"""
+        items = list(items)
+        # note: streamed items can only be read once, they are added one by one
+        streamed = {i for i, item in enumerate(items) if deser.has_stream(catalog.Type, item)}
+        hashes = hash_many(catalog.salt, catalog.Type, [item for i, item in enumerate(items) if i not in streamed], max_workers,
+                           scheme=catalog.hash_scheme, algorithm=catalog.hash_algorithm)
+        hashes.reverse()
+        hashes = [catalog.add(item) if i in streamed else hashes.pop() for i, item in enumerate(items)]
+        catalog.ensure_exists()
+        present = set(catalog.iter())
+        batch = []
+        for _hash, item in zip(hashes, items):
+            if _hash in present:
+                continue
+            present.add(_hash)
+            batch.append((_hash, item))
+            if len(batch) == batch_size:
+                catalog.write_batch(batch)
+                batch = []
+        if batch:
+            catalog.write_batch(batch)
+        return hashes
+
+    def add_stream(catalog, item) -> "Hash":
+        """variant of add for items with streamed bytes fields (see deser.is_stream):
+        hashed and written in a single pass, by chunks, to a temporary file then renamed"""
+        digest = catalog.stream_digest()
+        temp_path, size = catalog.write_temp(lambda buffer: catalog.serialize(item, buffer, digest=digest))
+        if digest is None:
+            with open(temp_path, "rb") as buffer:
+                _hash = catalog.hash_buffer(buffer)
+        else:
+            _hash = digest.digest()
+        # already in catalog ?
+        if catalog.exists(_hash):
+            os.unlink(temp_path)
+            return _hash
+        catalog.publish(temp_path, _hash)
+        catalog.added(_hash, size, item)
         return _hash
 
     E_ADD_NOSAFE = type("E_ADD_NOSAFE", (Exception,), {})
     def add_nosafe(catalog, item) -> "Hash":
         """variant of add: fails if exists"""
+        assert not deser.has_stream(catalog.Type, item), "streamed bytes fields are not supported by add_nosafe"
         # derive hash
-        _hash = hash.hash(catalog.salt, catalog.Type, item)
+        _hash = catalog.hash_item(item)
         # already in catalog ?
-        if catalog.contains(_hash):
+        if catalog.exists(_hash):
             raise catalog.E_ADD_NOSAFE(f"Already contained in catalog: {_hash.hex()}")
-        # write it to disk
-        item_path = catalog.item_path(_hash)
-        with open(catalog.item_path(_hash), 'wb') as buffer:
-            # acquire exclusive lock NON blocking (would raise BlockingIOError)
-            try:
-                fcntl.flock(buffer, fcntl.LOCK_EX | fcntl.LOCK_NB)
-            except BlockingIOError:
-                raise catalog.E_ADD_NOSAFE(f"Already locked in catalog: {_hash.hex()}")
-            exception = None
-            try:
-                # serialize and write
-                deser.serialize(catalog.Type, item, buffer)
-            except Exception as _exception:
-                exception = _exception
-                pass  # we release the lock before raising
-            # release lock
-            fcntl.flock(buffer, fcntl.LOCK_UN)
-
-            if exception is not None:
-                raise exception
-            
-        # set as read only
-        item_path.chmod(0o400)
+        # write it to disk, then link it (note: fails if another writer published it in the meantime)
+        temp_path, size = catalog.write_temp(lambda buffer: catalog.serialize(item, buffer))
+        try:
+            catalog.publish(temp_path, _hash, exclusive=True)
+        except FileExistsError:
+            raise catalog.E_ADD_NOSAFE(f"Already contained in catalog: {_hash.hex()}")
+        catalog.added(_hash, size, item)
         return _hash
     
-    def get(catalog, hash):
-        # already in catalog ?
-        if not catalog.contains(hash):
-            raise KeyError(f"{hash.hex()} not in catalog {catalog}")        
-        # it can now be reloaded
+    def open_item(catalog, hash) -> "(buffer, item_path)":
+        """opens the item file for reading (KeyError if not in catalog)"""
+        # already in catalog ? (note: opening is enough, no need for contains)
         item_path = catalog.item_path(hash)
-        with open(catalog.item_path(hash), 'rb') as buffer:
-            # acquire shared lock blocking
-            fcntl.flock(buffer, fcntl.LOCK_SH)
-            exception = None
+        try:
+            return open(item_path, 'rb'), item_path
+        except FileNotFoundError:
             try:
-                # read and deserialize
-                item = deser.deserialize(catalog.Type, buffer)
-            except Exception as _exception:
-                exception = _exception
-                pass  # we release the lock before raising
-            # release lock
-            fcntl.flock(buffer, fcntl.LOCK_UN)
+                if not catalog.shard_depth:
+                    raise
+                item_path = catalog.flat_item_path(hash)
+                return open(item_path, 'rb'), item_path
+            except FileNotFoundError:
+                alias = catalog.alias(hash)
+                if alias is None:
+                    raise KeyError(f"{hash.hex()} not in catalog {catalog}")
+                return catalog.open_item(alias)
+
+    def alias(catalog, hash) -> "Hash":
+        """the hash an item was re-keyed to (see shared.rekey), or None. note: get resolves aliases, contains does not"""
+        from shared import rekey
+        return rekey.aliases(catalog).get(hash)
 
-            if exception is not None:
-                raise exception
+    def open_record(catalog, hash) -> "(buffer, size)":
+        """the item file, positioned at the start of its record of `size` bytes (see column)"""
+        buffer, item_path = catalog.open_item(hash)
+        # note: unbuffered, skipped frames are not read ahead
+        buffer = buffer.detach()
+        return buffer, os.fstat(buffer.fileno()).st_size
 
+    def read(catalog, hash) -> bytes:
+        """the serialized item, read in a single call (see get_many)"""
+        buffer, item_path = catalog.open_item(hash)
+        with buffer:
+            return buffer.read()
+
+    def get(catalog, hash, lazy=False):
+        """`lazy`: a deser.LazyRecord, fields are decoded on access (see materialize). the item file is memory mapped,
+        bytes fields are memoryview slices of the mapping (read on access)"""
+        if catalog.cache is not None and not lazy:
+            return catalog.get_cached(hash)
+        buffer, item_path = catalog.open_item(hash)
+        # it can now be reloaded (note: no lock, items are published complete, see publish)
+        with buffer:
+            # read and deserialize
+            if lazy:
+                # note: the mapping is closed once no memoryview refers to it anymore
+                size = os.fstat(buffer.fileno()).st_size
+                view = mmap.mmap(buffer.fileno(), size, access=mmap.ACCESS_READ) if size else b''
+                return catalog.deserialize_lazy(view)
+            return catalog.deserialize(buffer)
+
+    def get_cached(catalog, hash):
+        """get through catalog.cache (items never change: no invalidation)"""
+        key  = (str(catalog.path), hash)
+        item = catalog.cache.get(key, _MISSING)
+        if item is _MISSING:
+            data = catalog.read(hash)
+            item = catalog.deserialize(io.BytesIO(data))
+            catalog.cache.put(key, item, len(data))
         return item
 
+    def get_many(catalog, hashes, max_workers=8, ordered=True, processes=0) -> ["GetResult"]:
+        """get for many hashes, yields a GetResult per hash (error is the KeyError of a missing hash).
+
+        items are read in a pool of `max_workers` threads (I/O overlaps) and decoded in the calling thread,
+        or in a pool of `processes` processes. at most 2 * max_workers items are in flight (bounded memory).
+        `ordered`: results in input order, else as soon as read"""
+        hashes = iter(hashes)
+        window = 2 * max_workers
+        decode = functools.partial(decode_item, catalog._replace(cache=None))  # note: picklable for decoders
+        decoders = concurrent.futures.ProcessPoolExecutor(processes) if processes else None
+        def fetch(_hash):
+            data = catalog.read(_hash)
+            # note: the reader thread waits for the decoder process, items are returned decoded
+            return data if decoders is None else decoders.submit(decode, data).result()
+        def result(_hash, future) -> GetResult:
+            try:
+                data = future.result()
+                return GetResult(_hash, decode(data) if decoders is None else data)
+            except Exception as exception:
+                return GetResult(_hash, None, exception)
+        readers = concurrent.futures.ThreadPoolExecutor(max_workers)
+        try:
+            pending = {}  # future -> hash (note: dict keeps submission order)
+            for _hash in hashes:
+                pending[readers.submit(fetch, _hash)] = _hash
+                if len(pending) < window:
+                    continue
+                if ordered:
+                    future = next(iter(pending))
+                    yield result(pending.pop(future), future)
+                else:
+                    done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        yield result(pending.pop(future), future)
+            for future in (list(pending) if ordered else concurrent.futures.as_completed(pending)):
+                yield result(pending[future], future)
+        finally:
+            # note: on early close, queued reads are cancelled and running ones awaited
+            readers.shutdown(cancel_futures=True)
+            if decoders is not None:
+                decoders.shutdown(cancel_futures=True)
+
+    def scan(catalog, predicate=None, readahead=64, workers=8, ordered=True, budget=64 << 20, hashes=None) -> ["GetResult"]:
+        """get of the items (default: all), streamed: files are read ahead in a pool of `workers` threads, at most
+        `readahead` reads in flight and `budget` bytes read but not yet decoded (bounded memory, whatever the catalog
+        size, note: an item larger than budget is read alone). `predicate`: (hash, deser.LazyRecord) -> bool, checked
+        in the reader thread on the header and the fields it accesses, the items it rejects are dropped before being
+        decoded, e.g.
+            catalog.scan(lambda _hash, item: item.optimizer.lr < 1e-3)
+        `ordered`: results in catalog order, else as soon as read"""
+        hashes    = iter(catalog.iter() if hashes is None else hashes)
+        condition = threading.Condition()
+        state     = {"held": 0, "ticket": 0, "closed": False}  # bytes reserved (read, not yet decoded), next reservation
+        def reserve(ticket, size):
+            # note: in submission order, the oldest read is never waiting for the budget held by later ones
+            with condition:
+                condition.wait_for(lambda: state["closed"] or (state["ticket"] == ticket and
+                                                               (not state["held"] or state["held"] + size <= budget)))
+                if state["closed"]:
+                    raise concurrent.futures.CancelledError()
+                state["held"]   += size
+                state["ticket"] += 1
+                condition.notify_all()
+        def release(size):
+            with condition:
+                state["held"] -= size
+                condition.notify_all()
+        def fetch(_hash, ticket) -> "bytearray or None":
+            buffer = None
+            try:
+                buffer, size = catalog.open_record(_hash)
+            finally:
+                reserve(ticket, 0 if buffer is None else size)
+            try:
+                with buffer:
+                    data = read_exactly(buffer, size)
+                if predicate is None or predicate(_hash, catalog.deserialize_lazy(memoryview(data))):
+                    return data
+            except BaseException:
+                release(size)
+                raise
+            release(size)
+            return None
+        def result(_hash, future) -> GetResult:
+            try:
+                data = future.result()
+                if data is None:
+                    return None
+                try:
+                    return GetResult(_hash, decode_item(catalog, data))
+                finally:
+                    release(len(data))
+            except Exception as exception:
+                return GetResult(_hash, None, exception)
+        readers = concurrent.futures.ThreadPoolExecutor(workers)
+        try:
+            pending, tickets = {}, 0  # future -> hash (note: dict keeps submission order)
+            while True:
+                for _hash in itertools.islice(hashes, readahead - len(pending)):
+                    pending[readers.submit(fetch, _hash, tickets)] = _hash
+                    tickets += 1
+                if not pending:
+                    return
+                if ordered:
+                    done = (next(iter(pending)),)
+                else:
+                    done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    _result = result(pending.pop(future), future)
+                    if _result is not None:
+                        yield _result
+        finally:
+            # note: on early close, queued reads are cancelled, those waiting for the budget give up
+            with condition:
+                state["closed"] = True
+                condition.notify_all()
+            readers.shutdown(cancel_futures=True)
+
+    def stream(catalog, hash, field) -> [bytes]:
+        """the bytes value of a field (dotted path, e.g. "checkpoint") of an item, by chunks: the record is read from
+        its file (see open_record) frame by frame, a value stored as chunks (see shared.chunks) one chunk at a time.
+        a tuple of bytes yields its elements"""
+        from shared import chunks
+        _plan  = deser.plan(catalog.Type)
+        path   = tuple(field.split("."))
+        buffer, size = catalog.open_record(hash)
+        with buffer:
+            head = buffer.read(len(deser.MAGIC))
+            if head != deser.MAGIC:
+                # note: a v1 record (no kinds) is decoded whole
+                value = catalog.deserialize_view(memoryview(head + read_exactly(buffer, size - len(head))))
+                for name in path:
+                    value = getattr(value, name)
+                yield from map(bytes, value) if isinstance(value, tuple) else (bytes(value),)
+                return
+            # note: frames are read in order, the others skipped, a compressed record is decompressed by chunks
+            header, reader = deser.open_record(_plan, buffer, head)
+            for step in _plan.steps:
+                frame_size, kind = deser.frame_header_v2.unpack(reader.read(deser.frame_header_v2.size))
+                if step.path != path:
+                    deser.skip_frame(reader, frame_size)
+                    continue
+                if kind == deser.KIND_MANIFEST:
+                    yield from chunks.stream(chunks.chunk_catalog(catalog), reader.read(frame_size))
+                elif kind == deser.KIND_VALUE:
+                    yield from deser.iter_frame_chunks(reader, frame_size)
+                else:
+                    value = step.unpack(kind, reader.read(frame_size))
+                    yield from map(bytes, value) if isinstance(value, tuple) else (bytes(value),)
+                return
+        raise KeyError(f"no field {field} in {catalog.Type.__name__}")
+
+    def column(catalog, path, dtype=float, reduce=None, hashes=None, max_workers=8, batch_size=256) -> "Column":
+        """one leaf field (dotted path, e.g. "seed") of the items (default: all) in an array (a list without numpy):
+        only the frames up to the field are visited, the others are skipped (see deser.read_field), files are read
+        in a thread pool. `reduce`: value -> array element, e.g. lambda loss: loss[-1] for a tuple field"""
+        _plan = deser.plan(catalog.Type)
+        try:
+            index = next(i for i, step in enumerate(_plan.steps) if ".".join(step.path) == path)
+        except StopIteration:
+            raise KeyError(f"{path} is not a leaf path of {catalog.Type.__name__}")
+        start  = time.perf_counter()
+        hashes = list(catalog.iter() if hashes is None else hashes)
+        values = numpy.empty(len(hashes), dtype) if numpy is not None else [None] * len(hashes)
+        def read_values(batch_start) -> "(batch start, values, read, skipped)":
+            batch_values, batch_read, batch_size_ = [], 0, 0
+            for _hash in hashes[batch_start:batch_start + batch_size]:
+                buffer, size = catalog.open_record(_hash)
+                with buffer:
+                    offset = buffer.tell()
+                    value, skipped = deser.read_field(_plan, buffer, index, chunks=catalog.reassemble)
+                    batch_read += buffer.tell() - offset - skipped
+                batch_values.append(value if reduce is None else reduce(value))
+                batch_size_ += size
+            return batch_start, batch_values, batch_read, batch_size_ - batch_read
+        bytes_read, bytes_skipped = 0, 0
+        # note: by batches, one task per batch (not per item)
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            for batch_start, batch_values, read, skipped in executor.map(read_values, range(0, len(hashes), batch_size)):
+                values[batch_start:batch_start + len(batch_values)] = batch_values
+                bytes_read    += read
+                bytes_skipped += skipped
+        return Column(tuple(hashes), values, bytes_read, bytes_skipped, time.perf_counter() - start)
+
     def iter(catalog) -> ["Hash"]:
+        if catalog.indexed:
+            yield from catalog_index.hashes(catalog)
+            return
         catalog.ensure_exists()
-        path = pathlib.Path(catalog.path)
-        for _path in path.glob(f"*{catalog.item_suffix}"):
+        for _path in catalog.iter_item_paths():
             _hash_hex = _path.parts[-1][:-len(catalog.item_suffix)]
             _hash = bytes.fromhex(_hash_hex)
             yield _hash
-        
-        
+
+    def iter_item_paths(catalog, max_workers=16) -> [pathlib.Path]:
+        """item files at any depth (flat and sharded), shards are listed in parallel"""
+        def list_shard(path) -> [pathlib.Path]:
+            item_paths = []
+            for dirpath, dirnames, filenames in os.walk(path):
+                item_paths += [pathlib.Path(dirpath, filename) for filename in filenames if filename.endswith(catalog.item_suffix)]
+            return item_paths
+        shard_paths = []
+        with os.scandir(catalog.path) as entries:
+            for entry in entries:
+                if entry.is_dir() and not entry.name.startswith("."):  # e.g. .chunks
+                    shard_paths.append(entry.path)
+                elif entry.name.endswith(catalog.item_suffix):
+                    yield pathlib.Path(entry.path)
+        if not shard_paths:
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(shard_paths))) as executor:
+            for item_paths in executor.map(list_shard, shard_paths):
+                yield from item_paths
+
+    def remove_temp_files(catalog, grace=3600) -> int:
+        """removes the temporary files (see write_temp) older than `grace` seconds, left behind by writers killed
+        before publishing them, also those of the catalogs under catalog.path (e.g. .chunks). returns their number"""
+        removed, now = 0, time.time()
+        for dirpath, dirnames, filenames in os.walk(catalog.path):
+            for filename in filenames:
+                if not (filename.startswith(".") and filename.endswith(".tmp")):
+                    continue
+                temp_path = os.path.join(dirpath, filename)
+                try:
+                    if now - os.stat(temp_path).st_mtime < grace:
+                        continue  # note: may be being written
+                    os.unlink(temp_path)
+                except FileNotFoundError:
+                    continue  # published or removed in the meantime
+                removed += 1
+        return removed
+
+    def reshard(catalog) -> int:
+        """in place migration of all items to the layout of catalog.shard_depth (whatever their current layout).
+        note: can be interrupted and run again. returns the number of items moved"""
+        moved = 0
+        for _path in tuple(catalog.iter_item_paths()):
+            _hash = bytes.fromhex(_path.name[:-len(catalog.item_suffix)])
+            item_path = catalog.item_path(_hash)
+            if _path == item_path:
+                continue
+            item_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            os.rename(_path, item_path)
+            moved += 1
+        # remove emptied shards
+        for dirpath, dirnames, filenames in os.walk(catalog.path, topdown=False):
+            if dirpath != str(catalog.path) and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+        return moved
         
     def log(catalog, hash, index, artefact):
         # TODO implement as another catalog for Type artefact, path=f"{catalog.path}/{hash}.ARTEFACTS"
@@ -128,6 +594,58 @@ class Catalog(typing.NamedTuple):
         raise NotImplementedError("artefact catalog a index is not implemented yet")
 
 
+_MISSING = object()
+
+class GetResult(typing.NamedTuple):
+    hash: "Hash"
+    item: object
+    error: Exception = None
+
+class Column(typing.NamedTuple):
+    hashes: tuple
+    values: "numpy.ndarray"  # values[i] of hashes[i]
+    bytes_read: int          # of the records, up to the field
+    bytes_skipped: int       # of the records, not read (frames skipped, frames after the field)
+    seconds: float
+
+    @property
+    def items_per_second(column) -> float:
+        return len(column.hashes) / column.seconds if column.seconds else float("inf")
+
+    @property
+    def skipped_ratio(column) -> float:
+        total = column.bytes_read + column.bytes_skipped
+        return column.bytes_skipped / total if total else 0.
+
+def read_exactly(buffer, size) -> bytearray:
+    data, offset = bytearray(size), 0
+    view = memoryview(data)
+    while offset < size:
+        read = buffer.readinto(view[offset:])
+        if not read:
+            raise ValueError(f"truncated record, expected {size} bytes got {offset}")
+        offset += read
+    return data
+
+def decode_item(catalog, data):
+    return catalog.deserialize(io.BytesIO(data))
+
+def hash_items(salt, Type, items, scheme="legacy", algorithm="md5") -> ["Hash"]:
+    return [hash.hash(salt, Type, item, scheme, algorithm) for item in items]
+
+def hash_many(salt, Type, items, max_workers=None, chunk_size=4096, scheme="legacy", algorithm="md5") -> ["Hash"]:
+    """hash.hash of items, by chunks in a process pool (in process if few items or Type can not be pickled)"""
+    try:
+        pickle.dumps(Type)
+    except Exception:
+        max_workers = 1
+    if max_workers == 1 or len(items) <= chunk_size:
+        return hash_items(salt, Type, items, scheme, algorithm)
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        return [_hash for hashes in executor.map(functools.partial(hash_items, salt, Type, scheme=scheme, algorithm=algorithm), chunks) for _hash in hashes]
+
+
 class ROCatalog(Catalog):
     def ensure_exists(catalog):
         path = pathlib.Path(catalog.path)
@@ -184,6 +702,404 @@ def test_HPARAMS_Catalog():
         # clean up
         shutil.rmtree( pathlib.Path(catalog.path) )
 
+def test_Catalog_reads_v1_items():
+    import os
+    import pathlib
+    import shutil
+    import shared.hparams
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    for hparams in shared.hparams.fixture_nested_hparams():
+        catalog = Catalog(
+            path = SDEXPERIMENTS_PATH / "testV1Catalog",
+            item_suffix = ".hparams",
+            Type = type(hparams),
+        )
+        shutil.rmtree(pathlib.Path(catalog.path), ignore_errors=True)
+        catalog.ensure_exists()
+        # an item written before format v2 (the hash does not depend on the format)
+        _hash = hash.hash(catalog.salt, catalog.Type, hparams)
+        with open(catalog.item_path(_hash), 'wb') as buffer:
+            deser.serialize(catalog.Type, hparams, buffer, version=1)
+        assert catalog.get(_hash) == hparams
+        assert catalog.add(hparams) == _hash
+        shutil.rmtree(pathlib.Path(catalog.path))
+
+
+def test_sharded_Catalog():
+    import os
+    import pathlib
+    import shutil
+    import shared.hparams
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    hparams, = shared.hparams.fixture_nested_hparams()
+    flat_catalog = Catalog(
+        path = SDEXPERIMENTS_PATH / "testShardedCatalog",
+        item_suffix = ".hparams",
+        Type = type(hparams),
+    )
+    shutil.rmtree(pathlib.Path(flat_catalog.path), ignore_errors=True)
+    items  = [hparams._replace(seed=seed) for seed in range(50)]
+    hashes = [flat_catalog.add(item) for item in items]
+
+    # the flat layout is still readable
+    catalog = flat_catalog._replace(shard_depth=2)
+    assert catalog.item_path(hashes[0]).relative_to(catalog.path).parts[:2] == (hashes[0].hex()[:2], hashes[0].hex()[2:4])
+    for _hash, item in zip(hashes[:25], items[:25]):
+        assert catalog.contains(_hash)
+        assert catalog.get(_hash) == item
+    # new items are sharded
+    extra = catalog.add(hparams._replace(seed=-1))
+    assert catalog.item_path(extra).exists()
+    assert set(catalog.iter()) == set(hashes) | {extra}
+
+    # migration (back and forth)
+    assert catalog.reshard() == len(hashes)
+    assert catalog.reshard() == 0
+    assert not tuple(pathlib.Path(catalog.path).glob(f"*{catalog.item_suffix}"))
+    for _hash, item in zip(hashes, items):
+        assert catalog.item_path(_hash).exists()
+        assert catalog.get(_hash) == item
+    assert set(catalog.iter()) == set(hashes) | {extra}
+    assert flat_catalog.reshard() == len(hashes) + 1
+    assert set(flat_catalog.iter()) == set(hashes) | {extra}
+    assert all(path.is_file() for path in pathlib.Path(catalog.path).iterdir())
+
+    shutil.rmtree(pathlib.Path(catalog.path))
+
+
+def test_Catalog_add_many():
+    import os
+    import pathlib
+    import shutil
+    import shared.hparams
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    hparams, = shared.hparams.fixture_nested_hparams()
+    items = [hparams._replace(seed=seed % 1000) for seed in range(1200)]
+    assert hash_many(b'', type(hparams), items, max_workers=2, chunk_size=100) == hash_items(b'', type(hparams), items)
+    for shard_depth, indexed in ((0, False), (1, True)):
+        sequential, batched = (Catalog(
+            path = SDEXPERIMENTS_PATH / name,
+            item_suffix = ".hparams",
+            Type = type(hparams),
+            indexed = indexed,
+            shard_depth = shard_depth,
+        ) for name in ("testAddSequential", "testAddMany"))
+        for catalog in (sequential, batched):
+            shutil.rmtree(pathlib.Path(catalog.path), ignore_errors=True)
+        hashes = [sequential.add(item) for item in items]
+        # some items already present
+        batched.add(items[1])
+        assert batched.add_many(items, max_workers=2, batch_size=100) == hashes
+        assert batched.add_many(items[:10]) == hashes[:10]
+        assert set(batched.iter()) == set(sequential.iter())
+        for _hash in set(hashes):
+            sequential_path, batched_path = sequential.item_path(_hash), batched.item_path(_hash)
+            assert sequential_path.read_bytes() == batched_path.read_bytes()
+            assert sequential_path.stat().st_mode == batched_path.stat().st_mode
+        for catalog in (sequential, batched):
+            shutil.rmtree(pathlib.Path(catalog.path))
+
+
+def stress_add(catalog, items, nosafe=False) -> int:
+    """(test_Catalog_concurrent_writers) adds items, returns how many were added by this process if nosafe"""
+    added = 0
+    for item in items:
+        if not nosafe:
+            catalog.add(item)
+            continue
+        try:
+            catalog.add_nosafe(item)
+            added += 1
+        except catalog.E_ADD_NOSAFE:
+            pass
+    return added
+
+def stress_get(catalog, hashes_and_items, rounds) -> int:
+    """(test_Catalog_concurrent_writers) gets items while they are written, returns how many were complete"""
+    complete = 0
+    for _ in range(rounds):
+        for _hash, item in hashes_and_items:
+            try:
+                assert catalog.get(_hash) == item
+                complete += 1
+            except KeyError:
+                pass  # not published yet
+    return complete
+
+def test_Catalog_concurrent_writers():
+    import os
+    import pathlib
+    import random
+    import shutil
+    import shared.hparams
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    hparams, = shared.hparams.fixture_nested_hparams()
+    catalog = Catalog(
+        path = SDEXPERIMENTS_PATH / "testCatalogConcurrentWriters",
+        item_suffix = ".hparams",
+        Type = type(hparams),
+        shard_depth = 1,
+    )
+    shutil.rmtree(catalog.path, ignore_errors=True)
+    # large enough items for readers to race with writers
+    items  = [hparams._replace(seed=seed, blob=bytes([seed % 256]) * 2**16) for seed in range(100)]
+    hashes = hash_items(catalog.salt, catalog.Type, items)
+    with concurrent.futures.ProcessPoolExecutor(6) as executor:
+        writers = [executor.submit(stress_add, catalog, random.sample(items[:50], 50)) for _ in range(4)]
+        readers = [executor.submit(stress_get, catalog, list(zip(hashes[:50], items[:50])), 20) for _ in range(2)]
+        for future in writers + readers:
+            future.result()
+        # add_nosafe: a single process adds each item
+        nosafe  = [executor.submit(stress_add, catalog, random.sample(items[50:], 50), nosafe=True) for _ in range(4)]
+        assert sum(future.result() for future in nosafe) == 50
+    assert set(catalog.iter()) == set(hashes)
+    for _hash, item in zip(hashes, items):
+        assert catalog.get(_hash) == item
+    # no temporary file left behind
+    assert not tuple(pathlib.Path(catalog.path).glob("*.tmp"))
+    shutil.rmtree(catalog.path)
+
+
+def test_Catalog_remove_temp_files():
+    import os
+    import pathlib
+    import shutil
+    import shared.hparams
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    hparams, = shared.hparams.fixture_nested_hparams()
+    catalog = Catalog(
+        path = SDEXPERIMENTS_PATH / "testCatalogRemoveTempFiles",
+        item_suffix = ".hparams",
+        Type = type(hparams),
+    )
+    shutil.rmtree(catalog.path, ignore_errors=True)
+    _hash = catalog.add(hparams)
+    # left behind by killed writers (old), being written (young)
+    (catalog.path / ".chunks").mkdir()
+    old   = [catalog.write_temp(lambda buffer: catalog.serialize(hparams, buffer))[0], catalog.path / ".chunks" / ".x.tmp"]
+    young = catalog.write_temp(lambda buffer: catalog.serialize(hparams, buffer))[0]
+    old[1].touch()
+    for temp_path in old:
+        os.utime(temp_path, (0, 0))
+    assert catalog.remove_temp_files(grace=60) == 2
+    assert not any(map(os.path.exists, old)) and os.path.exists(young)
+    assert list(catalog.iter()) == [_hash] and catalog.get(_hash) == hparams
+    shutil.rmtree(catalog.path)
+
+
+def test_Catalog_get_many():
+    import os
+    import pathlib
+    import shutil
+    import shared.hparams
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    hparams, = shared.hparams.fixture_nested_hparams()
+    catalog = Catalog(
+        path = SDEXPERIMENTS_PATH / "testCatalogGetMany",
+        item_suffix = ".hparams",
+        Type = type(hparams),
+        shard_depth = 1,
+    )
+    shutil.rmtree(catalog.path, ignore_errors=True)
+    items  = [hparams._replace(seed=seed) for seed in range(40)]
+    hashes = catalog.add_many(items)
+    missing = b"\0" * 16
+    query  = hashes[:20] + [missing] + hashes[20:]
+    # ordered: input order, missing hash reported in place
+    results = list(catalog.get_many(query, max_workers=3))
+    assert [result.hash for result in results] == query
+    assert [result.item for result in results if result.error is None] == items
+    assert isinstance(results[20].error, KeyError) and results[20].item is None
+    # unordered, decoded in processes
+    results = list(catalog.get_many(query, max_workers=3, ordered=False, processes=2))
+    assert {result.hash: result.item for result in results if result.error is None} == dict(zip(hashes, items))
+    assert [result.hash for result in results if result.error is not None] == [missing]
+    # early close
+    results = catalog.get_many(hashes, max_workers=2)
+    assert next(results).item == items[0]
+    results.close()
+    shutil.rmtree(catalog.path)
+
+
+def test_Catalog_scan():
+    import os
+    import time
+    import pathlib
+    import shutil
+    import shared.hparams, shared.packfile
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    hparams, = shared.hparams.fixture_nested_hparams()
+    for _Catalog in (Catalog, shared.packfile.PackCatalog):
+        catalog = _Catalog(
+            path = SDEXPERIMENTS_PATH / f"testCatalogScan{_Catalog.__name__}",
+            item_suffix = ".hparams",
+            Type = type(hparams),
+        )
+        shutil.rmtree(catalog.path, ignore_errors=True)
+        items  = [hparams._replace(seed=seed) for seed in range(50)]
+        hashes = catalog.add_many(items)
+        # ordered: catalog order
+        results = list(catalog.scan(readahead=4, workers=3))
+        assert [result.hash for result in results] == list(catalog.iter())
+        assert {result.hash: result.item for result in results} == dict(zip(hashes, items))
+        # predicate on the lazily decoded fields, unordered, a budget of a single item
+        even = [(_hash, item) for _hash, item in zip(hashes, items) if item.seed % 2 == 0]
+        results = catalog.scan(lambda _hash, item: item.seed % 2 == 0, ordered=False, budget=1, hashes=hashes)
+        assert sorted((result.hash, result.item.seed) for result in results) == sorted((_hash, item.seed) for _hash, item in even)
+        # bytes read ahead, not yet consumed, stay within budget
+        read, sizes = [0], {}
+        class Reader:
+            def __init__(reader, buffer):
+                reader.buffer = buffer
+            def __enter__(reader):
+                return reader
+            def __exit__(reader, *exc_info):
+                reader.buffer.close()
+            def readinto(reader, view):
+                size = reader.buffer.readinto(view)
+                read[0] += size
+                return size
+        class CountingCatalog(_Catalog):
+            def open_record(catalog, hash):
+                buffer, sizes[hash] = super().open_record(hash)
+                return Reader(buffer), sizes[hash]
+        counting = CountingCatalog(*catalog)
+        budget, consumed, peak = 3 * max(counting.open_record(_hash)[1] for _hash in hashes), 0, 0
+        read[0] = 0
+        for result in counting.scan(readahead=32, workers=8, budget=budget):
+            time.sleep(0.002)  # note: a slow consumer, reads are not
+            consumed += sizes[result.hash]
+            peak = max(peak, read[0] - consumed)
+        assert consumed == read[0] and peak <= budget, (peak, budget)
+        # missing hash reported, early close
+        missing = b"\0" * 16
+        results = catalog.scan(hashes=[missing] + hashes)
+        assert isinstance(next(results).error, KeyError)
+        assert next(results).item == items[0]
+        results.close()
+        shutil.rmtree(catalog.path)
+
+
+def test_Catalog_merkle_hash_scheme():
+    import io
+    import os
+    import pathlib
+    import shutil
+    import shared.packfile
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    items = tuple(fixture_FILE_HPARAMS())[:3]
+    for Catalog_ in (FileCatalog, shared.packfile.PackCatalog):
+        catalog = Catalog_(
+            path = SDEXPERIMENTS_PATH / f"testCatalogMerkle{Catalog_.__name__}",
+            item_suffix = ".file",
+            Type = FILE_HPARAMS,
+            hash_scheme = "merkle-v1",
+        )
+        shutil.rmtree(catalog.path, ignore_errors=True)
+        hashes = [hash.hash(b'', FILE_HPARAMS, item, "merkle-v1") for item in items]
+        assert [catalog.add(item) for item in items] == hashes
+        # streamed bytes: hashed from the written item
+        assert catalog.add(items[1]._replace(name="streamed", bytes=io.BytesIO(items[1].bytes))) == \
+            hash.hash(b'', FILE_HPARAMS, items[1]._replace(name="streamed"), "merkle-v1")
+        assert catalog.add_many(items) == hashes
+        assert [catalog.get(_hash) for _hash in hashes] == list(items)
+        shutil.rmtree(catalog.path)
+
+
+def test_Catalog_codecs():
+    import io
+    import os
+    import pathlib
+    import shutil
+    import tracemalloc
+    import shared.packfile
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    text  = FILE_HPARAMS("run_log", ",".join(str(i / 7) for i in range(20000)).encode())
+    tiny  = FILE_HPARAMS("tiny", b"0.5")
+    for Catalog_ in (FileCatalog, shared.packfile.PackCatalog):
+        for codec in ("zlib", "lzma", "bz2"):
+            catalog = Catalog_(
+                path = SDEXPERIMENTS_PATH / f"testCatalogCodec{Catalog_.__name__}{codec}",
+                item_suffix = ".file",
+                Type = FILE_HPARAMS,
+                codec = codec,
+            )
+            shutil.rmtree(catalog.path, ignore_errors=True)
+            hashes = [catalog.add(item) for item in (text, tiny)]
+            # hashes do not depend on the codec
+            assert hashes == hash_items(b'', FILE_HPARAMS, (text, tiny))
+            raw, compressed = catalog.read(hashes[1]), catalog.read(hashes[0])
+            assert deser.record_header.unpack_from(raw)[2] == 0  # under codec_threshold
+            assert deser.CODEC_FLAGS[deser.record_header.unpack_from(compressed)[2]] == codec
+            assert len(compressed) < len(text.bytes) / 2
+            for _hash, item in zip(hashes, (text, tiny)):
+                assert catalog.get(_hash) == item
+                assert bytes(catalog.get(_hash, lazy=True).bytes) == item.bytes
+                assert b"".join(catalog.stream(_hash, "bytes")) == item.bytes
+            shutil.rmtree(catalog.path)
+    # large streamed bytes are compressed and read back by chunks
+    catalog = FileCatalog(path=SDEXPERIMENTS_PATH / "testCatalogCodecStream", item_suffix=".file", Type=FILE_HPARAMS, codec="zlib")
+    shutil.rmtree(catalog.path, ignore_errors=True)
+    size = 32 * 2**20
+    tracemalloc.start()
+    _hash = catalog.add(FILE_HPARAMS("large", (bytes([i % 256]) * 2**16 for i in range(size // 2**16))))
+    assert sum(len(chunk) for chunk in catalog.stream(_hash, "bytes")) == size
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < 24 * 2**20, peak
+    assert catalog.item_path(_hash).stat().st_size < size / 100
+    shutil.rmtree(catalog.path)
+    # large uncompressed bytes are read back by chunks too (not the whole record)
+    catalog = catalog._replace(codec="none")
+    shutil.rmtree(catalog.path, ignore_errors=True)
+    _hash = catalog.add(FILE_HPARAMS("large", (bytes([i % 256]) * 2**16 for i in range(size // 2**16))))
+    tracemalloc.start()
+    assert sum(len(chunk) for chunk in catalog.stream(_hash, "bytes")) == size
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < 8 * 2**20, peak
+    shutil.rmtree(catalog.path)
+
+def test_Catalog_column():
+    import os
+    import pathlib
+    import shutil
+    import experiment_model
+    import shared.packfile
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    RunLog_HPARAMS, IterationLog_HPARAMS = experiment_model.RunLog_HPARAMS, experiment_model.IterationLog_HPARAMS
+    items = [RunLog_HPARAMS(experiment_model.ExperimentRef_HPARAMS(f"{seed:032x}", "train"),
+                            IterationLog_HPARAMS(tuple(range(1000)), tuple(seed / (i + 1) for i in range(1000))))
+             for seed in range(20)]
+    for Catalog_, codec in ((Catalog, "none"), (Catalog, "zlib"), (shared.packfile.PackCatalog, "none")):
+        catalog = Catalog_(
+            path = SDEXPERIMENTS_PATH / f"testCatalogColumn{Catalog_.__name__}{codec}",
+            item_suffix = ".runlog",
+            Type = RunLog_HPARAMS,
+            codec = codec,
+        )
+        shutil.rmtree(catalog.path, ignore_errors=True)
+        hashes = [catalog.add(item) for item in items]
+        if Catalog_ is Catalog:
+            # a v1 record
+            v1 = items[0]._replace(experiment=items[0].experiment._replace(split="v1"))
+            temp_path, _ = catalog.write_temp(lambda buffer: deser.serialize(RunLog_HPARAMS, v1, buffer, version=1))
+            hashes.append(catalog.hash_item(v1))
+            catalog.publish(temp_path, hashes[-1])
+            items.append(v1)
+        # final loss: the iteration frame is skipped
+        column = catalog.column("log.loss", reduce=lambda loss: loss[-1], hashes=hashes, max_workers=4, batch_size=8)
+        assert column.hashes == tuple(hashes)
+        assert list(column.values) == [item.log.loss[-1] for item in items]
+        assert column.bytes_read + column.bytes_skipped == sum(len(catalog.read(_hash)) for _hash in hashes)
+        if codec == "none":
+            assert column.skipped_ratio > 0.4
+        assert sorted(catalog.column("experiment.experiment_hash_hex", dtype=object).values) == \
+               sorted(item.experiment.experiment_hash_hex for item in items)
+        if Catalog_ is Catalog:
+            items.pop()
+        shutil.rmtree(catalog.path)
+
 
 def fixture_FILE_HPARAMS():
     yield FILE_HPARAMS(name="test-empty", bytes=b'')
@@ -191,6 +1107,62 @@ def fixture_FILE_HPARAMS():
     yield FILE_HPARAMS(name="test-10-Kbytes", bytes=b'0'*10*2**10)
     yield FILE_HPARAMS(name="test-10-Mbytes", bytes=b'0'*10*2**20)
         
+def test_FileCatalog_add_streamed_bytes():
+    import os
+    import pathlib
+    import shutil
+    import tempfile
+    import tracemalloc
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    catalog = FileCatalog(
+        path = SDEXPERIMENTS_PATH / "testStreamCatalog",
+        item_suffix = ".file",
+        Type = FILE_HPARAMS,
+    )
+    shutil.rmtree(pathlib.Path(catalog.path), ignore_errors=True)
+
+    # small: file-like and iterator of chunks give the same item as bytes
+    for file_hparams in fixture_FILE_HPARAMS():
+        import io
+        _hash = hash.hash(catalog.salt, catalog.Type, file_hparams)
+        chunks = (file_hparams.bytes[i:i+1000] for i in range(0, len(file_hparams.bytes), 1000))
+        assert catalog.add(file_hparams._replace(bytes=io.BytesIO(file_hparams.bytes))) == _hash
+        assert catalog.add(file_hparams._replace(bytes=chunks)) == _hash
+        assert catalog.get(_hash) == file_hparams
+
+    # large: memory stays bounded by the chunk size
+    with tempfile.TemporaryFile() as source:
+        for _ in range(64):
+            source.write(os.urandom(2**20))
+        source.seek(0)
+        tracemalloc.start()
+        _hash = catalog.add(FILE_HPARAMS(name="test-64-Mbytes", bytes=source))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert peak < 8 * 2**20, f"peak memory {peak}"
+        source.seek(0)
+        assert catalog.get(_hash, lazy=True).bytes == source.read()
+    assert not tuple(pathlib.Path(catalog.path).glob(".*.tmp"))
+
+    shutil.rmtree(pathlib.Path(catalog.path))
+
+def test_Catalog_stream_tuple_of_bytes():
+    import os
+    import pathlib
+    import shutil
+    import shared.packfile
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    for _Catalog in (Catalog, shared.packfile.PackCatalog):
+        catalog = _Catalog(
+            path = SDEXPERIMENTS_PATH / f"testStreamTuple{_Catalog.__name__}",
+            item_suffix = ".file",
+            Type = FILE_HPARAMS,
+        )
+        shutil.rmtree(catalog.path, ignore_errors=True)
+        _hash = catalog.add(FILE_HPARAMS("blobs", (b"a", b"bc")))
+        assert list(catalog.stream(_hash, "bytes")) == [b"a", b"bc"]
+        shutil.rmtree(catalog.path)
+
 def test_FileCatalog():
     import os
     import pathlib
@@ -217,6 +1189,11 @@ def test_FileCatalog():
         _item = catalog.get(_hash)
         assert _item == item
         assert _hash in catalog.iter()
+        _item = catalog.get(_hash, lazy=True)
+        assert isinstance(_item.bytes, memoryview)
+        assert _item.name == item.name
+        assert _item.materialize() == item
+        assert catalog.add(_item.materialize()) == _hash
             
 
     # clean up
@@ -227,12 +1204,28 @@ if __name__ == "__main__":
     import sys, shared.utils, shared.hparams
     argv = [arg for arg in sys.argv if not arg.startswith("--")]
     catalog_qualname = argv[1]
+    for arg in sys.argv:
+        if arg.startswith("--reshard="):
+            # migrate to the given shard depth
+            catalog = shared.utils.catalog_from_qualname(catalog_qualname, write=True)
+            catalog = catalog._replace(shard_depth=int(arg[len("--reshard="):]))
+            print(f"resharded {catalog.reshard()} items of {catalog.path} to depth {catalog.shard_depth}")
+            sys.exit()
+        if arg.startswith("--clean"):
+            # temporary files older than the grace period (default an hour), e.g. --clean=600
+            catalog = shared.utils.catalog_from_qualname(catalog_qualname, write=True)
+            grace = float(arg[len("--clean="):]) if arg.startswith("--clean=") else 3600
+            print(f"removed {catalog.remove_temp_files(grace)} temporary files of {catalog.path}")
+            sys.exit()
     ro_catalog = shared.utils.ro_catalog_from_qualname(catalog_qualname)
-    for h in ro_catalog.iter():
-        if "--pretty" in sys.argv:
-            item = ro_catalog.get(h)
-            print(shared.hparams.pretty(item))
-        else:
+    if "--pretty" in sys.argv:
+        # note: items are read ahead (see scan)
+        for result in ro_catalog.scan():
+            if result.error is not None:
+                raise result.error
+            print(shared.hparams.pretty(result.item, scheme=ro_catalog.hash_scheme))
+    else:
+        for h in ro_catalog.iter():
             print(h.hex())
     
     
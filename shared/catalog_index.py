@@ -0,0 +1,123 @@
+"""optional sqlite index of a Catalog: contains/iter are index lookups instead of stat/glob on the catalog directory.
+
+the index (<catalog.path>/.index.sqlite) records hash, size, insertion time and format version of each item.
+it is updated by Catalog.add when the catalog is `indexed`. rebuild() resyncs it from the directory
+(e.g. after items were added by a non indexed catalog).
+"""
+import os, pathlib, threading, time
+from shared import db, deser
+
+SCHEMA     = "CATALOG_INDEX"
+INDEX_NAME = ".index.sqlite"
+
+
+def uri(catalog) -> str:
+    return f"file:{pathlib.Path(catalog.path).absolute() / INDEX_NAME}"
+
+_connections = threading.local()  # note: sqlite3 connections are not shared between threads (nor forked processes)
+def connect(catalog) -> "sqlite3.Connection":
+    """cached db.session with the catalog index attached as SCHEMA"""
+    connections = _connections.__dict__.setdefault("connections", {})
+    key = (os.getpid(), str(catalog.path))
+    if key not in connections:
+        catalog.ensure_exists()
+        connection = db.session((SCHEMA,), {SCHEMA: uri(catalog)})
+        connection.execute(f'''CREATE TABLE IF NOT EXISTS "{SCHEMA}".items (
+            hash BLOB PRIMARY KEY, size INTEGER, inserted REAL, version INTEGER
+        ) WITHOUT ROWID''')
+        connections[key] = connection
+    return connections[key]
+
+def record(catalog, _hash, size, version=deser.FORMAT_VERSION, inserted=None):
+    connection = connect(catalog)
+    with connection:
+        connection.execute(f'INSERT OR IGNORE INTO "{SCHEMA}".items VALUES (?, ?, ?, ?)',
+                           (_hash, size, time.time() if inserted is None else inserted, version))
+
+def record_many(catalog, hashes_and_sizes, version=deser.FORMAT_VERSION):
+    """record in a single transaction"""
+    inserted = time.time()
+    connection = connect(catalog)
+    with connection:
+        connection.executemany(f'INSERT OR IGNORE INTO "{SCHEMA}".items VALUES (?, ?, ?, ?)',
+                               ((_hash, size, inserted, version) for _hash, size in hashes_and_sizes))
+
+def contains(catalog, _hash) -> bool:
+    cursor = connect(catalog).execute(f'SELECT 1 FROM "{SCHEMA}".items WHERE hash = ?', (_hash,))
+    return cursor.fetchone() is not None
+
+def hashes(catalog) -> ["Hash"]:
+    for _hash, in connect(catalog).execute(f'SELECT hash FROM "{SCHEMA}".items'):
+        yield _hash
+
+def item_version(item_path) -> int:
+    with open(item_path, "rb") as buffer:
+        return 2 if buffer.read(len(deser.MAGIC)) == deser.MAGIC else 1
+
+def rebuild(catalog) -> "(added, removed)":
+    """resync the index from the catalog directory"""
+    unindexed = catalog._replace(indexed=False)
+    on_disk   = set(unindexed.iter())
+    connection= connect(catalog)
+    indexed   = set(hashes(catalog))
+    added, removed = on_disk - indexed, indexed - on_disk
+    rows = []
+    for _hash in added:
+        item_path = unindexed.find_item_path(_hash)
+        stat = item_path.stat()
+        rows.append((_hash, stat.st_size, stat.st_mtime, item_version(item_path)))
+    with connection:
+        connection.executemany(f'INSERT OR REPLACE INTO "{SCHEMA}".items VALUES (?, ?, ?, ?)', rows)
+        connection.executemany(f'DELETE FROM "{SCHEMA}".items WHERE hash = ?', ((_hash,) for _hash in removed))
+    return len(added), len(removed)
+
+
+#### tests
+def test_indexed_Catalog():
+    import os
+    import shutil
+    import shared.catalog, shared.hparams
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    hparams, = shared.hparams.fixture_nested_hparams()
+    catalog = shared.catalog.Catalog(
+        path = SDEXPERIMENTS_PATH / "testIndexedCatalog",
+        item_suffix = ".hparams",
+        Type = type(hparams),
+        indexed = True,
+    )
+    shutil.rmtree(catalog.path, ignore_errors=True)
+
+    items  = [hparams._replace(seed=seed) for seed in range(10)]
+    hashes = [catalog.add(item) for item in items]
+    for _hash, item in zip(hashes, items):
+        assert catalog.contains(_hash)
+        assert catalog.get(_hash) == item
+    assert set(catalog.iter()) == set(hashes)
+    size, version = connect(catalog).execute(f'SELECT size, version FROM "{SCHEMA}".items WHERE hash = ?', (hashes[0],)).fetchone()
+    assert (size, version) == (catalog.item_path(hashes[0]).stat().st_size, deser.FORMAT_VERSION)
+
+    # items added or removed behind the index
+    unindexed = catalog._replace(indexed=False)
+    extra = unindexed.add(hparams._replace(seed=-1))
+    catalog.item_path(hashes[0]).unlink()
+    assert not catalog.contains(extra)
+    assert rebuild(catalog) == (1, 1)
+    assert catalog.contains(extra) and not catalog.contains(hashes[0])
+    assert set(catalog.iter()) == set(hashes[1:]) | {extra}
+    assert rebuild(catalog) == (0, 0)
+    # an indexed catalog does not rewrite an item missing from its index
+    connect(catalog).execute(f'DELETE FROM "{SCHEMA}".items WHERE hash = ?', (extra,)).connection.commit()
+    assert catalog.add(hparams._replace(seed=-1)) == extra
+    assert catalog.contains(extra)
+
+    shutil.rmtree(catalog.path)
+
+
+if __name__ == "__main__":
+    # CLI: python -m shared.catalog_index <HPARAMS qualname> --rebuild
+    import sys, shared.utils
+    argv = [arg for arg in sys.argv if not arg.startswith("--")]
+    catalog = shared.utils.ro_catalog_from_qualname(argv[1])._replace(indexed=True)
+    if "--rebuild" in sys.argv:
+        added, removed = rebuild(catalog)
+        print(f"index of {catalog.path}: added {added}, removed {removed}")
@@ -0,0 +1,297 @@
+"""content-defined chunk store for large bytes fields (e.g. checkpoints), enabled by Catalog.chunk_threshold.
+
+bytes values of at least chunk_threshold bytes are cut into chunks where a rolling (gear) hash of the last 64 bytes
+matches a mask: an insertion or a change only moves the boundaries around it, unchanged regions give the same chunks.
+chunks are items of a chunk catalog (<catalog.path>/.chunks, Chunk_HPARAMS), written once whatever the number of
+records referring to them. the record stores a manifest of (chunk hash, size) instead of the value
+(deser.KIND_MANIFEST), reassembled by get (see reassemble) or streamed chunk by chunk (see Catalog.stream).
+item hashes are unchanged: they hash the values, not the manifests.
+
+    python -m shared.chunks <HPARAMS qualname> --report --gc
+"""
+import os, random, struct, time, typing
+from shared import deser
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MIN_SIZE = 2**14   # bytes, chunk sizes are in [MIN_SIZE, MAX_SIZE] (but the last chunk of a value)
+AVG_BITS = 16      # boundary probability 2**-AVG_BITS (after MIN_SIZE): ~80KB chunks on average
+MAX_SIZE = 2**18
+BLOCK_SIZE = 2**22 # bytes chunked at once
+
+_gear_random = random.Random(0x67656172)
+GEAR = tuple(_gear_random.getrandbits(64) for _ in range(256))
+MASK64 = 2**64 - 1
+
+def boundaries_python(data, min_size=MIN_SIZE, avg_bits=AVG_BITS, max_size=MAX_SIZE) -> [int]:
+    """chunk ends in data (the last one is len(data) only if it is a boundary). reference implementation"""
+    ends, start, h = [], 0, 0
+    shift = 64 - avg_bits
+    for i, byte in enumerate(data):
+        h = ((h << 1) + GEAR[byte]) & MASK64
+        size = i + 1 - start
+        if (size >= min_size and h >> shift == 0) or size >= max_size:
+            ends.append(i + 1)
+            start, h = i + 1, 0
+    return ends
+
+def boundaries_numpy(data, min_size=MIN_SIZE, avg_bits=AVG_BITS, max_size=MAX_SIZE) -> [int]:
+    """same as boundaries_python: the gear hash at i is sum(GEAR[data[i-k]] << k for k < 64), computed for all i
+    by doubling the window (6 vectorized passes), candidates are then filtered by the chunk sizes"""
+    h = numpy.array(GEAR, dtype=numpy.uint64)[numpy.frombuffer(data, dtype=numpy.uint8)]
+    shifted, window = numpy.empty_like(h), 1
+    while window < 64 and window < len(h):
+        # note: h[i] += h[i - window] << window, from the values before the pass (shifted is a copy)
+        numpy.left_shift(h[:-window], numpy.uint64(window), out=shifted[:-window])
+        h[window:] += shifted[:-window]
+        window *= 2
+    # note: the hash is reset at chunk starts, equal since min_size >= 64 (older bytes are shifted out)
+    candidates = numpy.flatnonzero((h >> numpy.uint64(64 - avg_bits)) == 0) + 1
+    ends, start = [], 0
+    for end in candidates.tolist():
+        while end - start > max_size:
+            start += max_size
+            ends.append(start)
+        if end - start >= min_size:
+            ends.append(end)
+            start = end
+    while len(data) - start >= max_size:
+        start += max_size
+        ends.append(start)
+    return ends
+
+def boundaries(data) -> [int]:
+    return boundaries_numpy(data) if numpy is not None else boundaries_python(data)
+
+def iter_cdc_chunks(chunks) -> [bytes]:
+    """content-defined chunks of the concatenation of chunks (e.g. deser.iter_chunks of a stream)"""
+    pending = b''
+    for chunk in chunks:
+        # note: by blocks, the memory used by boundaries is bounded whatever the size of chunk
+        view = memoryview(chunk).cast("B")
+        for offset in range(0, len(view), BLOCK_SIZE):
+            pending += view[offset:offset + BLOCK_SIZE]
+            if len(pending) < MAX_SIZE:
+                continue
+            start = 0
+            for end in boundaries(pending):
+                yield pending[start:end]
+                start = end
+            pending = pending[start:]
+    if pending:
+        # note: the remaining bytes end the value, whether or not a boundary
+        start = 0
+        for end in boundaries(pending):
+            yield pending[start:end]
+            start = end
+        if start < len(pending):
+            yield pending[start:]
+
+
+class Chunk_HPARAMS(typing.NamedTuple):
+    data: bytes
+
+def chunk_catalog(catalog):
+    """the catalog of the chunks of catalog (same engine and settings, not chunked)"""
+    import pathlib
+    return catalog._replace(
+        path = pathlib.Path(catalog.path) / ".chunks",
+        item_suffix = ".chunk",
+        Type = Chunk_HPARAMS,
+        chunk_threshold = 0,
+        cache = None,
+    )
+
+manifest_entry = struct.Struct("<QB")  # chunk size, chunk hash size, then chunk hash
+
+def iter_manifest(manifest) -> "(hash, size)":
+    offset = 0
+    while offset < len(manifest):
+        size, hash_size = manifest_entry.unpack_from(manifest, offset)
+        offset += manifest_entry.size
+        yield bytes(manifest[offset:offset + hash_size]), size
+        offset += hash_size
+
+class Chunker(typing.NamedTuple):
+    """deser.serialize chunker: stores chunks in chunks_catalog"""
+    chunks_catalog: object
+    threshold: int
+
+    def store(chunker, chunks) -> bytes:
+        manifest = []
+        for chunk in iter_cdc_chunks(chunks):
+            # note: add writes only the chunks not in the catalog
+            item  = Chunk_HPARAMS(chunk)
+            _hash = chunker.chunks_catalog.add(item)
+            # note: a reused chunk may be unreferenced until the record is published, touched gc keeps it (see gc)
+            while not touch(chunker.chunks_catalog, _hash):
+                # removed by gc in the meantime
+                size = chunker.chunks_catalog.write(_hash, item)
+                chunker.chunks_catalog.added(_hash, size, item)
+            manifest.append(manifest_entry.pack(len(chunk), len(_hash)) + _hash)
+        return b"".join(manifest)
+
+def touch(chunks_catalog, _hash) -> bool:
+    """sets the mtime of a chunk to now (files engine), False if it is missing"""
+    import shared.packfile
+    if isinstance(chunks_catalog, shared.packfile.PackCatalog):
+        return True  # note: records are never removed
+    item_path = chunks_catalog.find_item_path(_hash)
+    try:
+        os.utime(item_path)
+        return True
+    except (FileNotFoundError, TypeError):  # note: TypeError, item_path is None
+        return False
+
+def stream(chunks_catalog, manifest) -> [bytes]:
+    for _hash, size in iter_manifest(manifest):
+        data = chunks_catalog.get(_hash).data
+        assert len(data) == size, f"chunk {_hash.hex()} is {len(data)} bytes, expected {size}"
+        yield data
+
+def reassemble(chunks_catalog, manifest) -> bytes:
+    return b"".join(stream(chunks_catalog, manifest))
+
+
+def iter_manifests(catalog) -> "(hash, manifest)":
+    """the manifests of the records of catalog"""
+    _plan = deser.plan(catalog.Type)
+    for _hash in catalog.iter():
+        view = memoryview(catalog.read(_hash))
+        if view[:len(deser.MAGIC)] != deser.MAGIC:
+            continue  # v1 records are never chunked
+        for step, kind, data in deser.iter_record_frames(_plan, view):
+            if kind == deser.KIND_MANIFEST:
+                yield _hash, data
+
+class DedupReport(typing.NamedTuple):
+    records: int          # records with chunked values
+    logical_bytes: int    # size of the chunked values
+    chunks: int           # distinct chunks referenced
+    stored_bytes: int     # size of the distinct chunks referenced
+    ratio: float          # logical_bytes / stored_bytes
+
+def report(catalog) -> DedupReport:
+    records, logical_bytes, sizes = set(), 0, {}
+    for _hash, manifest in iter_manifests(catalog):
+        records.add(_hash)
+        for chunk_hash, size in iter_manifest(manifest):
+            logical_bytes += size
+            sizes[chunk_hash] = size
+    stored_bytes = sum(sizes.values())
+    return DedupReport(len(records), logical_bytes, len(sizes), stored_bytes,
+                       logical_bytes / stored_bytes if stored_bytes else 1.0)
+
+def gc(catalog, grace=3600) -> int:
+    """removes the chunks referenced by no record of catalog (files engine). returns the number of chunks removed.
+    `grace`: seconds, chunks younger or reused since (see touch) are kept (their record may be being written)"""
+    import shared.catalog_index, shared.packfile
+    chunks_catalog = chunk_catalog(catalog)
+    if isinstance(chunks_catalog, shared.packfile.PackCatalog):
+        raise ValueError("gc is not supported by the pack engine (records are never removed)")
+    referenced = {chunk_hash for _, manifest in iter_manifests(catalog) for chunk_hash, _ in iter_manifest(manifest)}
+    removed, now = 0, time.time()
+    for chunk_hash in tuple(chunks_catalog.iter()):
+        if chunk_hash in referenced:
+            continue
+        item_path = chunks_catalog.find_item_path(chunk_hash)
+        if item_path is None or now - item_path.stat().st_mtime < grace:
+            continue
+        # note: moved aside then checked again, a chunk touched before the move is put back, one touched after is
+        # missing for its writer, that writes it again (see Chunker.store)
+        removed_path = item_path.with_name(f".{item_path.name}.gc.tmp")
+        os.rename(item_path, removed_path)
+        if now - removed_path.stat().st_mtime < grace:
+            os.rename(removed_path, item_path)
+            continue
+        removed_path.unlink()
+        removed += 1
+    if removed and chunks_catalog.indexed:
+        shared.catalog_index.rebuild(chunks_catalog)
+    return removed
+
+
+#### tests
+def test_boundaries():
+    data = random.Random(0).randbytes(2**20) + bytes(2**19)  # random, then constant (max_size cuts)
+    ends = boundaries_python(data)
+    if numpy is not None:
+        assert boundaries_numpy(data) == ends
+    sizes = [end - start for start, end in zip([0] + ends, ends)]
+    assert all(MIN_SIZE <= size <= MAX_SIZE for size in sizes)
+    # streaming gives the same chunks, an insertion only moves the boundaries around it
+    chunks = list(iter_cdc_chunks(data[i:i + 100_000] for i in range(0, len(data), 100_000)))
+    assert b"".join(chunks) == data and [len(chunk) for chunk in chunks[:-1]] == sizes[:len(chunks) - 1]
+    # note: in the constant part, boundaries are max_size cuts, not content defined
+    random_chunks = set(iter_cdc_chunks([data[:2**20]]))
+    edited = set(iter_cdc_chunks([data[:500_000] + b"inserted" + data[500_000:2**20]]))
+    assert len(edited - random_chunks) <= 2
+
+def test_chunked_Catalog():
+    import io
+    import os
+    import pathlib
+    import shutil
+    import shared.catalog, shared.hash, shared.packfile
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    FILE_HPARAMS = shared.catalog.FILE_HPARAMS
+    base = random.Random(1).randbytes(2**21)
+    # consecutive checkpoints: a few bytes changed
+    items = [FILE_HPARAMS(f"checkpoint-{i}", base[:i * 2**18] + bytes([i]) * 64 + base[i * 2**18 + 64:]) for i in range(4)]
+    for Catalog in (shared.catalog.Catalog, shared.packfile.PackCatalog):
+        catalog = Catalog(
+            path = SDEXPERIMENTS_PATH / f"testChunked{Catalog.__name__}",
+            item_suffix = ".file",
+            Type = FILE_HPARAMS,
+            chunk_threshold = 2**16,
+        )
+        shutil.rmtree(catalog.path, ignore_errors=True)
+        hashes = [catalog.add(item) for item in items]
+        assert hashes == [shared.hash.hash(b'', FILE_HPARAMS, item) for item in items]
+        small = catalog.add(FILE_HPARAMS("small", b"not chunked"))
+        # streamed
+        streamed = items[0]._replace(name="streamed")
+        assert catalog.add(streamed._replace(bytes=io.BytesIO(streamed.bytes))) == shared.hash.hash(b'', FILE_HPARAMS, streamed)
+        for _hash, item in zip(hashes, items):
+            assert catalog.get(_hash) == item
+            assert bytes(catalog.get(_hash, lazy=True).bytes) == item.bytes
+            assert b"".join(catalog.stream(_hash, "bytes")) == item.bytes
+        assert b"".join(catalog.stream(small, "bytes")) == b"not chunked"
+        assert [result.item for result in catalog.get_many(hashes)] == items
+        dedup = report(catalog)
+        assert dedup.records == 5 and dedup.logical_bytes == 5 * len(base) and dedup.ratio > 3
+        # gc
+        if Catalog is shared.catalog.Catalog:
+            assert gc(catalog, grace=0) == 0
+            catalog.find_item_path(hashes[3]).unlink()
+            catalog.find_item_path(hashes[2]).unlink()
+            assert gc(catalog, grace=0) > 0
+            assert [catalog.get(_hash) for _hash in hashes[:2]] == items[:2]
+            # an unreferenced old chunk reused by a record being written (manifest stored, record not published yet)
+            chunks_catalog = chunk_catalog(catalog)
+            for chunk_hash in chunks_catalog.iter():
+                os.utime(chunks_catalog.find_item_path(chunk_hash), (0, 0))
+            catalog.find_item_path(hashes[1]).unlink()
+            manifest = Chunker(chunks_catalog, catalog.chunk_threshold).store([items[1].bytes])
+            gc(catalog, grace=60)
+            assert reassemble(chunks_catalog, manifest) == items[1].bytes
+            # a missing chunk is written again
+            chunk_hash, _ = next(iter_manifest(manifest))
+            chunks_catalog.find_item_path(chunk_hash).unlink()
+            assert Chunker(chunks_catalog, catalog.chunk_threshold).store([items[1].bytes]) == manifest
+            assert reassemble(chunks_catalog, manifest) == items[1].bytes
+        shutil.rmtree(catalog.path)
+
+
+if __name__ == "__main__":
+    import sys, shared.utils
+    argv = [arg for arg in sys.argv if not arg.startswith("--")]
+    catalog = shared.utils.catalog_from_qualname(argv[1], write="--gc" in sys.argv)
+    if "--report" in sys.argv:
+        dedup = report(catalog)
+        print(f"{catalog.path}: {dedup.records} chunked records, {dedup.logical_bytes} bytes in {dedup.chunks} chunks "
+              f"of {dedup.stored_bytes} bytes (dedup ratio {dedup.ratio:.2f})")
+    if "--gc" in sys.argv:
+        print(f"{catalog.path}: removed {gc(catalog)} unreferenced chunks")
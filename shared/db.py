@@ -3,16 +3,17 @@ import os
 import typing
 
 
-def session(schemas: typing.Sequence):
+def session(schemas: typing.Sequence, schema_to_uri: typing.Mapping = None):
     '''opens a sqlite3 connection with in memory as main + specified attached schemas.
 
     *schemas*: sequence of schema names to be attached. Corresponding URIs will be looked up from env variables matching the pattern <SCHEMA>_SQLITE_URI.
+    *schema_to_uri*: optional mapping[schema,URI] taking precedence over env variables.
     
     :returns: an instantiated sqlite3.Connection
     '''
 
     conn = sqlite3.connect(":memory:",uri=True)
-    schema_to_uri = schemas_uris_from_env()
+    schema_to_uri = {**schemas_uris_from_env(), **(schema_to_uri or {})}
     attach_stmts = tuple(
         f'''ATTACH "{schema_to_uri[schema]}" as "{schema}" ; '''
         for schema in schemas
@@ -38,5 +39,10 @@ def test_can_open_default_session():
     schemas = ("DATA","META")
     connection = session(schemas)
     connection.close()
+
+def test_can_open_session_with_explicit_uris():
+    connection = session(("DATA",), {"DATA": "file::memory:"})
+    connection.execute('CREATE TABLE "DATA".t (x)')
+    connection.close()
     
     
@@ -173,7 +173,8 @@ def decode_walk_step(buffer) -> "bytes,buffer":
     value_as_bytes = buffer.read(size)
     return value_as_bytes, buffer
 
-def serialize(Type, obj, buffer):
+def walk_serialize(Type, obj, buffer):
+    """reference implementation of serialize (re-walks Type for every obj). Hint: use serialize()"""
     for walk_step in walk(Type, obj):
         try:
             value_as_bytes = to_bytes(walk_step.type, walk_step.value)
@@ -183,7 +184,8 @@ def serialize(Type, obj, buffer):
         except Exception as e:
             raise Exception(walk_step.name, e)
 
-def deserialize(Type, buffer) -> object:
+def walk_deserialize(Type, buffer) -> object:
+    """reference implementation of deserialize (re-walks Type for every obj). Hint: use deserialize()"""
     def iterate(Type, buffer):
       for walk_step in walk(Type, Type):
         try:
@@ -199,6 +201,648 @@ def deserialize(Type, buffer) -> object:
     return reconstructed
 
 
+### compiled plans
+# walk/from_walk re-inspect Type.__annotations__ (and is_composite_type) for every obj.
+# a Plan flattens the walk once per Type: later calls only run the flat steps.
+import operator, hashlib
+import bz2, io, lzma, zlib
+
+try:
+    import numpy
+except ImportError:  # optional: numeric tuples are then decoded as tuples
+    numpy = None
+
+if numpy is not None:
+    class FrozenArray(numpy.ndarray):
+        """read-only array decoded from a int/float tuple: hashes (and prints) like the tuple.
+
+        compares like the tuple with a tuple or a same shape array, elementwise (as numpy) otherwise"""
+        def is_whole_value(self, other):
+            return isinstance(other, tuple) or (isinstance(other, numpy.ndarray) and other.shape == self.shape)
+        def __eq__(self, other):
+            if self.is_whole_value(other):
+                return numpy.array_equal(self, other)
+            return numpy.ndarray.__eq__(self, other)
+        def __ne__(self, other):
+            if self.is_whole_value(other):
+                return not numpy.array_equal(self, other)
+            return numpy.ndarray.__ne__(self, other)
+        def __hash__(self):
+            return hash(tuple(self.tolist()))
+        def __repr__(self):
+            return repr(tuple(self.tolist()))
+        def __array_wrap__(self, array, context=None, return_scalar=False):
+            # note: results of computations are plain arrays (with elementwise ==)
+            array = array.view(numpy.ndarray)
+            return array[()] if return_scalar else array
+    array_types = (numpy.ndarray,)
+else:
+    array_types = ()
+
+class PlanStep(typing.NamedTuple):
+    path: tuple                # field names from Type down to the base type field
+    name: str                  # same as WalkStep.name
+    type: type                 # base type
+    encode: typing.Callable    # value -> bytes, same as to_bytes(type, value) (format v1 and hash)
+    decode: typing.Callable    # bytes -> value, same as from_bytes(type, bytes) (format v1)
+    pack: typing.Callable      # value -> (kind, data) (format v2)
+    unpack: typing.Callable    # (kind, data) -> value (format v2)
+
+class Plan(typing.NamedTuple):
+    Type: type
+    steps: tuple               # PlanStep, in walk order
+    values: typing.Callable    # obj -> tuple of step values, same order as walk(Type, obj)
+    build: typing.Callable     # sequence of step values -> obj, same as from_walk
+    fingerprint: bytes         # md5 of steps paths and types (format v2 header)
+
+def _encode_str(obj): return obj.encode("utf-8")
+def _encode_int(obj): return str(obj).encode("utf-8")
+def _encode_bool(obj): return str(int(obj)).encode("utf-8")
+def _encode_bytes(obj): return obj
+item_encoders = {str: _encode_str, int: _encode_int, float: _encode_int, bool: _encode_bool, bytes: _encode_bytes}
+
+def _decode_str(as_bytes): return as_bytes.decode("utf-8")
+def _decode_int(as_bytes): return int(as_bytes.decode("utf-8"))
+def _decode_float(as_bytes): return float(as_bytes.decode("utf-8"))
+def _decode_bool(as_bytes): return bool(int(as_bytes.decode("utf-8")))
+def _decode_bytes(as_bytes): return as_bytes
+item_decoders = {str: _decode_str, int: _decode_int, float: _decode_float, bool: _decode_bool, bytes: _decode_bytes}
+
+# note: bytes values may also be memoryview (see deserialize_view)
+item_types = {str: str, int: int, float: float, bool: bool, bytes: (bytes, bytearray, memoryview)}
+
+def encoder(Type) -> typing.Callable:
+    """specialized to_bytes(Type, .)"""
+    encode_item = item_encoders[Type]
+    item_type   = item_types[Type]
+    def encode(obj):
+        # container
+        if isinstance(obj, tuple):
+            return StartContainerToken + SeparatorToken.join(map(encode, obj)) + EndContainerToken
+        elif isinstance(obj, array_types):
+            return encode(tuple(obj.tolist()))
+        # item
+        assert isinstance(obj, item_type), f"expected {Type} or tuple of {Type}, got {type(obj)}"
+        return encode_item(obj)
+    return encode
+
+def decoder(Type) -> typing.Callable:
+    """specialized from_bytes(Type, .)"""
+    decode_item = item_decoders[Type]
+    def decode(as_bytes):
+        # container
+        if as_bytes[0:1] == StartContainerToken:
+            assert as_bytes[-1:] == EndContainerToken
+            return tuple(map(decode, as_bytes[1:-1].split(SeparatorToken)))
+        # item
+        return decode_item(as_bytes)
+    return decode
+
+### format v2
+# record: header, then one frame per plan step
+# header: magic, version, flags, plan fingerprint
+#   flags & FLAG_CODEC: codec of the frames (see CODECS), compressed as a whole after the header
+# frame : data size (uint64le), kind, data
+#   kind 'v': base type value: int as int64le (wider if needed), float as float64le, bool as uint8, str as utf-8, bytes as is
+#   kind 'a': tuple of int/float packed as an int64le/float64le array (read as a FrozenArray if numpy is available)
+#   kind 't': any other tuple: data is a sequence of frames (one per item)
+#   kind 'M': bytes value stored as chunks, data is their manifest (see shared.chunks)
+# note: v1 records have no header. v1 is still read (and written on demand for compatibility)
+MAGIC = b"\x89GCT"
+FORMAT_VERSION = 2
+record_header = struct.Struct("<4sHH16s")
+frame_header_v2 = struct.Struct("<Qc")
+KIND_VALUE, KIND_ARRAY, KIND_TUPLE = b"v", b"a", b"t"
+KIND_MANIFEST = b"M"  # bytes value stored as chunks elsewhere (see serialize chunker, shared.chunks)
+FLAG_CODEC = 0x000f
+
+# codec -> (flags, compressor factory, decompressor factory)
+CODECS = {
+    "none": (0, None, None),
+    "zlib": (1, zlib.compressobj, zlib.decompressobj),
+    "lzma": (2, lzma.LZMACompressor, lzma.LZMADecompressor),
+    "bz2" : (3, bz2.BZ2Compressor, bz2.BZ2Decompressor),
+}
+CODEC_FLAGS = {flags: codec for codec, (flags, _, _) in CODECS.items()}
+
+def record_codec(header) -> str:
+    try:
+        return CODEC_FLAGS[header.flags & FLAG_CODEC]
+    except KeyError:
+        raise ValueError(f"unknown codec flags {header.flags & FLAG_CODEC}")
+
+def codec_spec(codec) -> "(flags, compressor, decompressor)":
+    try:
+        return CODECS[codec]
+    except KeyError:
+        raise ValueError(f"unknown codec {codec!r}, expected one of {', '.join(CODECS)}")
+
+def compress_record(source, buffer, codec, chunk_size=None):
+    """copies a v2 record from source to buffer, its frames compressed by chunks with codec (see CODECS)"""
+    flags, compressor, _ = codec_spec(codec)
+    header = RecordHeader(*record_header.unpack(source.read(record_header.size)))
+    assert header.magic == MAGIC and header.flags & FLAG_CODEC == 0, "expected an uncompressed v2 record"
+    buffer.write(record_header.pack(header.magic, header.version, header.flags | flags, header.fingerprint))
+    compressor = compressor()
+    for chunk in iter_chunks(source, chunk_size or CHUNK_SIZE):
+        buffer.write(compressor.compress(chunk))
+    buffer.write(compressor.flush())
+
+class DecompressReader:
+    """file-like of the decompressed content of buffer (read by chunks)"""
+    def __init__(reader, buffer, decompressor):
+        reader.buffer, reader.decompressor, reader.pending = buffer, decompressor, bytearray()
+    def read(reader, size=-1) -> bytes:
+        decompressor = reader.decompressor
+        while (size < 0 or len(reader.pending) < size) and not decompressor.eof:
+            # note: output bounded by max_length (e.g. 1MB of zeros compresses 1000x), the rest of the input is
+            # kept by the decompressor (unconsumed_tail for zlib, internally for lzma and bz2)
+            max_length = CHUNK_SIZE if size < 0 else size - len(reader.pending)
+            if hasattr(decompressor, "unconsumed_tail"):
+                data = decompressor.unconsumed_tail or reader.buffer.read(CHUNK_SIZE)
+                if not data:
+                    break
+            else:
+                data = reader.buffer.read(CHUNK_SIZE) if decompressor.needs_input else b''
+                if not data and decompressor.needs_input:
+                    break
+            reader.pending += decompressor.decompress(data, max_length)
+        size = len(reader.pending) if size < 0 else size
+        data = bytes(reader.pending[:size])
+        del reader.pending[:size]
+        return data
+
+def iter_frame_chunks(reader, size, chunk_size=None) -> [bytes]:
+    """the data of a frame of `size` bytes, read by chunks"""
+    while size:
+        chunk = reader.read(min(size, chunk_size or CHUNK_SIZE))
+        if not chunk:
+            raise ValueError(f"truncated record, {size} bytes missing")
+        size -= len(chunk)
+        yield chunk
+
+def open_record(_plan, buffer, head=b'') -> "(RecordHeader, reader)":
+    """reads the header of a v2 record, returns it and a file-like of its (decompressed) frames"""
+    header = read_header(_plan, buffer, head)
+    codec = record_codec(header)
+    if codec == "none":
+        return header, buffer
+    return header, DecompressReader(buffer, codec_spec(codec)[2]())
+
+def skip_frame(reader, size) -> int:
+    """skips the data of a frame, returns the number of bytes skipped without being read (seek): none for a
+    compressed record (decompressed then dropped)"""
+    if isinstance(reader, DecompressReader):
+        for _ in iter_frame_chunks(reader, size):
+            pass
+        return 0
+    reader.seek(size, io.SEEK_CUR)
+    return size
+
+def read_field(_plan, buffer, index, chunks=None) -> "(value, skipped)":
+    """the value of the step `index` of a record (v1 or v2): the frames before it are skipped (see skip_frame),
+    the frames after it are not read. returns the value and the number of bytes skipped"""
+    head, skipped = buffer.read(len(MAGIC)), 0
+    if head != MAGIC:
+        for step in _plan.steps[:index + 1]:
+            size, = frame_header.unpack(head + buffer.read(frame_header.size - len(head)))
+            head = b''
+            if step is _plan.steps[index]:
+                return step.decode(buffer.read(size)), skipped
+            skipped += skip_frame(buffer, size)
+    header, reader = open_record(_plan, buffer, head)
+    for step in _plan.steps[:index + 1]:
+        size, kind = frame_header_v2.unpack(reader.read(frame_header_v2.size))
+        if step is _plan.steps[index]:
+            return unpack_step(step, kind, reader.read(size), chunks), skipped
+        skipped += skip_frame(reader, size)
+
+class RecordHeader(typing.NamedTuple):
+    magic: bytes
+    version: int
+    flags: int
+    fingerprint: bytes
+
+_int64   = struct.Struct("<q")
+_float64 = struct.Struct("<d")
+def _pack_int(obj):
+    try:
+        return _int64.pack(obj)
+    except struct.error:
+        return obj.to_bytes(obj.bit_length() // 8 + 1, "little", signed=True)
+def _pack_float(obj): return _float64.pack(obj)
+def _pack_bool(obj): return b"\x01" if obj else b"\x00"
+item_packers = {str: _encode_str, int: _pack_int, float: _pack_float, bool: _pack_bool, bytes: _encode_bytes}
+
+def _unpack_int(data): return _int64.unpack(data)[0] if len(data) == 8 else int.from_bytes(data, "little", signed=True)
+def _unpack_float(data): return _float64.unpack(data)[0]
+def _unpack_bool(data): return data[0] != 0
+def _unpack_str(data): return str(data, "utf-8")
+item_unpackers = {str: _unpack_str, int: _unpack_int, float: _unpack_float, bool: _unpack_bool, bytes: _decode_bytes}
+
+array_codes  = {int: "q", float: "d"}
+array_dtypes = {"q": "<i8", "d": "<f8"}
+array_kinds  = {"q": "bi", "d": "biuf"}  # numpy dtype kinds safely cast to array_dtypes
+
+def pack_array(obj, array_code):
+    """packed little-endian array, or None if obj is not a flat tuple (or array) of numbers"""
+    if numpy is None:
+        try:
+            return struct.pack(f"<{len(obj)}{array_code}", *obj)
+        except struct.error:
+            return None
+    try:
+        array = numpy.asarray(obj)
+    except (ValueError, OverflowError):  # e.g. ragged nested tuples
+        return None
+    if array.ndim != 1 or (array.size and array.dtype.kind not in array_kinds[array_code]):
+        return None
+    array = numpy.ascontiguousarray(array, dtype=array_dtypes[array_code])
+    return memoryview(array).cast("B")
+
+def unpack_array(data, array_code):
+    if numpy is None:
+        return struct.unpack(f"<{len(data) // 8}{array_code}", data)
+    # note: no copy, the array is a view over data
+    array = numpy.frombuffer(data, dtype=array_dtypes[array_code]).view(FrozenArray)
+    array.flags.writeable = False
+    return array
+
+def pack_frame(kind, data) -> bytes:
+    return frame_header_v2.pack(len(data), kind) + data
+
+def iter_frames(data) -> "(kind, data)":
+    offset, end = 0, len(data)
+    while offset < end:
+        size, kind = frame_header_v2.unpack_from(data, offset)
+        offset += frame_header_v2.size
+        yield kind, data[offset:offset + size]
+        offset += size
+
+def packer(Type) -> typing.Callable:
+    """value -> (kind, data) for a step of base type Type"""
+    pack_item  = item_packers[Type]
+    item_type  = item_types[Type]
+    array_code = array_codes.get(Type)
+    def pack(obj):
+        # container
+        if isinstance(obj, tuple) or isinstance(obj, array_types):
+            if array_code is not None:
+                data = pack_array(obj, array_code)
+                if data is not None:
+                    return KIND_ARRAY, data
+                # e.g. nested tuples, int out of int64 range: falls back to frames
+            if isinstance(obj, array_types):
+                obj = tuple(obj.tolist())
+            return KIND_TUPLE, b"".join(pack_frame(*pack(item)) for item in obj)
+        # item
+        assert isinstance(obj, item_type), f"expected {Type} or tuple of {Type}, got {type(obj)}"
+        return KIND_VALUE, pack_item(obj)
+    return pack
+
+def unpacker(Type) -> typing.Callable:
+    """(kind, data) -> value for a step of base type Type"""
+    unpack_item = item_unpackers[Type]
+    array_code  = array_codes.get(Type)
+    def unpack(kind, data):
+        if kind == KIND_VALUE:
+            return unpack_item(data)
+        elif kind == KIND_ARRAY:
+            return unpack_array(data, array_code)
+        elif kind == KIND_TUPLE:
+            return tuple(unpack(*frame) for frame in iter_frames(data))
+        else:
+            raise ValueError(f"unknown frame kind {kind} for {Type}")
+    return unpack
+
+def compile_plan(Type) -> Plan:
+    """flatten walk(Type, .) into steps, and generate the functions extracting/rebuilding values"""
+    steps     = []
+    getters   = []
+    namespace = {}
+    def visit(Type, path) -> str:
+        # returns the source of the expression rebuilding a Type from `v`
+        Type_name = f"T{len(namespace)}"
+        namespace[Type_name] = Type
+        fields = []
+        for annotation_name, annotation_type in Type.__annotations__.items():
+            if is_composite_type(annotation_type):
+                value_source = visit(annotation_type, path + (annotation_name,))
+            else:
+                value_source = f"v[{len(steps)}]"
+                steps.append(PlanStep(path + (annotation_name,), annotation_name, annotation_type,
+                                      encoder(annotation_type), decoder(annotation_type),
+                                      packer(annotation_type), unpacker(annotation_type)))
+                getters.append(".".join(path + (annotation_name,)))
+            fields.append(f"{annotation_name}={value_source}")
+        return f"{Type_name}({', '.join(fields)})"
+    build_source = visit(Type, ())
+    build = eval(f"lambda v: {build_source}", namespace)
+    if len(getters) == 1:
+        values = lambda obj, _get=operator.attrgetter(*getters): (_get(obj),)
+    else:
+        values = operator.attrgetter(*getters) if getters else lambda obj: ()
+    layout = ";".join(f"{'.'.join(step.path)}:{step.type.__name__}" for step in steps)
+    fingerprint = hashlib.md5(layout.encode("utf-8")).digest()
+    return Plan(Type, tuple(steps), values, build, fingerprint)
+
+_plans = {}
+def plan(Type) -> Plan:
+    """cached compile_plan(Type)"""
+    try:
+        return _plans[Type]
+    except KeyError:
+        _plan = _plans[Type] = compile_plan(Type)
+        return _plan
+
+
+# deser (using plans)
+frame_header = struct.Struct("!L")
+
+CHUNK_SIZE = 2**20
+
+def is_stream(value) -> bool:
+    """bytes values may be streamed from a file-like (with read) or an iterator of bytes chunks"""
+    return hasattr(value, "read") or hasattr(value, "__next__")
+
+def iter_chunks(value, chunk_size=CHUNK_SIZE):
+    if hasattr(value, "read"):
+        while True:
+            chunk = value.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        yield from value
+
+def has_stream(Type, obj) -> bool:
+    _plan = plan(Type)
+    return any(step.type is bytes and is_stream(value) for step, value in zip(_plan.steps, _plan.values(obj)))
+
+def serialize(Type, obj, buffer, version=FORMAT_VERSION, digest=None, chunker=None):
+    """`digest`: if provided (e.g. hashlib object), updated as shared.hash.hash does. It allows to hash and
+    write in a single pass, as required by streamed bytes values (see is_stream, buffer must then be seekable)
+
+    `chunker`: if provided, bytes values streamed or of at least chunker.threshold bytes are given to
+    chunker.store(chunks) which stores them and returns a manifest, written instead (frame KIND_MANIFEST)"""
+    _plan = plan(Type)
+    if version == 1:
+        assert digest is None, "digest is only supported with format v2"
+        return serialize_v1(_plan, obj, buffer)
+    assert version == 2, f"unknown format version {version}"
+    buffer.write(record_header.pack(MAGIC, 2, 0, _plan.fingerprint))
+    for step, value in zip(_plan.steps, _plan.values(obj)):
+        try:
+            if chunker is not None and step.type is bytes and not isinstance(value, tuple) \
+                    and (is_stream(value) or len(value) >= chunker.threshold):
+                chunks = iter_chunks(value) if is_stream(value) else (value,)
+                manifest = chunker.store(digested(chunks, digest))
+                buffer.write(frame_header_v2.pack(len(manifest), KIND_MANIFEST))
+                buffer.write(manifest)
+                continue
+            if step.type is bytes and is_stream(value):
+                write_stream_frame(buffer, iter_chunks(value), digest)
+                continue
+            if digest is not None:
+                digest.update(step.encode(value))
+            kind, data = step.pack(value)
+            buffer.write(frame_header_v2.pack(len(data), kind))
+            buffer.write(data)
+        except Exception as e:
+            raise Exception(step.name, e)
+
+def digested(chunks, digest):
+    """chunks, updating digest as they pass"""
+    for chunk in chunks:
+        if digest is not None:
+            digest.update(chunk)
+        yield chunk
+
+def write_stream_frame(buffer, chunks, digest=None) -> int:
+    """writes a bytes value frame whose size is not known in advance (the header is patched afterwards)"""
+    start = buffer.tell()
+    buffer.write(frame_header_v2.pack(0, KIND_VALUE))
+    size = 0
+    for chunk in chunks:
+        if digest is not None:
+            digest.update(chunk)
+        buffer.write(chunk)
+        size += len(chunk)
+    end = buffer.tell()
+    buffer.seek(start)
+    buffer.write(frame_header_v2.pack(size, KIND_VALUE))
+    buffer.seek(end)
+    return size
+
+def serialize_v1(_plan, obj, buffer):
+    for step, value in zip(_plan.steps, _plan.values(obj)):
+        try:
+            value_as_bytes = step.encode(value)
+            size = len(value_as_bytes)
+            assert size < 2**32, f'frame size must be encode as uint32be, got {size} > 2**32'
+            buffer.write(frame_header.pack(size))
+            buffer.write(value_as_bytes)
+        except Exception as e:
+            raise Exception(step.name, e)
+
+def read_header(_plan, buffer, head=b'') -> RecordHeader:
+    """reads and checks a v2 header (`head` being the already read start of it)"""
+    head += buffer.read(record_header.size - len(head))
+    return check_header(_plan, head)
+
+def check_header(_plan, head) -> RecordHeader:
+    header = RecordHeader(*record_header.unpack_from(head))
+    if header.magic != MAGIC:
+        raise ValueError(f"not a v2 record: {header.magic}")
+    if header.version != 2:
+        raise ValueError(f"unsupported format version {header.version}")
+    if header.fingerprint != _plan.fingerprint:
+        raise ValueError(f"record was not written for {_plan.Type.__name__} (fingerprint mismatch)")
+    return header
+
+def unpack_step(step, kind, data, chunks):
+    if kind == KIND_MANIFEST:
+        if chunks is None:
+            raise ValueError(f"{'.'.join(step.path)} is stored as chunks (KIND_MANIFEST), no chunk store given")
+        return chunks(data)
+    return step.unpack(kind, data)
+
+def deserialize(Type, buffer, chunks=None) -> object:
+    """reads a v2 record, or a v1 record (detected by the absence of MAGIC).
+    `chunks`: manifest -> bytes, for the values stored as chunks (see serialize chunker)"""
+    _plan = plan(Type)
+    head = buffer.read(len(MAGIC))
+    if head != MAGIC:
+        return deserialize_v1(_plan, buffer, head)
+    header, buffer = open_record(_plan, buffer, head)
+    values = []
+    for step in _plan.steps:
+        try:
+            size, kind = frame_header_v2.unpack(buffer.read(frame_header_v2.size))
+            values.append(unpack_step(step, kind, buffer.read(size), chunks))
+        except Exception as e:
+            raise Exception(step, e)
+    return _plan.build(values)
+
+def deserialize_view(Type, view, chunks=None) -> object:
+    """as deserialize, but from a buffer (e.g. a mmap): bytes values are memoryview slices of it (no copy)"""
+    _plan = plan(Type)
+    view = memoryview(view)
+    if view[:len(MAGIC)] != MAGIC:
+        return deserialize_view_v1(_plan, view)
+    values = [unpack_step(step, kind, data, chunks) for step, kind, data in iter_record_frames(_plan, view)]
+    return _plan.build(values)
+
+def iter_record_frames(_plan, view) -> "(step, kind, data)":
+    """frames of a v2 record in a buffer, data are memoryview slices of it (of its decompressed copy if compressed)"""
+    header = check_header(_plan, view)
+    offset = record_header.size
+    codec = record_codec(header)
+    if codec != "none":
+        view, offset = memoryview(DecompressReader(io.BytesIO(view[offset:]), codec_spec(codec)[2]()).read()), 0
+    for step in _plan.steps:
+        try:
+            size, kind = frame_header_v2.unpack_from(view, offset)
+            offset += frame_header_v2.size
+            data = view[offset:offset + size]
+            if len(data) != size:
+                raise ValueError(f"truncated record, expected {size} bytes got {len(data)}")
+            offset += size
+        except Exception as e:
+            raise Exception(step, e)
+        yield step, kind, data
+
+def deserialize_view_v1(_plan, view) -> object:
+    return _plan.build([decode_step_v1(step, data) for step, _, data in iter_record_frames_v1(_plan, view)])
+
+def iter_record_frames_v1(_plan, view) -> "(step, None, data)":
+    offset = 0
+    for step in _plan.steps:
+        try:
+            size, = frame_header.unpack_from(view, offset)
+            offset += frame_header.size
+            data = view[offset:offset + size]
+            offset += size
+        except Exception as e:
+            raise Exception(step, e)
+        yield step, None, data
+
+def decode_step_v1(step, data):
+    if step.type is bytes and data[:1] != StartContainerToken:
+        return data
+    return step.decode(bytes(data))
+
+
+# lazy records
+class LazyLayout(typing.NamedTuple):
+    Type: type
+    start: int     # steps of Type in the plan of the record type: start <= index < stop
+    stop: int
+    fields: dict   # name -> step index (leaf) or LazyLayout (composite)
+
+_layouts = {}
+def layout(Type, start=0) -> LazyLayout:
+    """where the fields of Type are among the steps of a record (cached)"""
+    try:
+        return _layouts[Type, start]
+    except KeyError:
+        fields, index = {}, start
+        for annotation_name, annotation_type in Type.__annotations__.items():
+            if is_composite_type(annotation_type):
+                fields[annotation_name] = layout(annotation_type, index)
+                index = fields[annotation_name].stop
+            else:
+                fields[annotation_name] = index
+                index += 1
+        _layout = _layouts[Type, start] = LazyLayout(Type, start, index, fields)
+        return _layout
+
+class LazyFrames:
+    """the frame table of a record, (kind, offset, size) of each step from one scan of its frame headers, and the
+    values decoded so far"""
+    __slots__ = ("plan", "view", "frames", "values", "chunks", "v1")
+    def __init__(frames, _plan, view, chunks=None):
+        view = memoryview(view)
+        frames.plan, frames.chunks = _plan, chunks
+        frames.v1 = view[:len(MAGIC)] != MAGIC
+        offset = 0 if frames.v1 else record_header.size
+        codec  = "none" if frames.v1 else record_codec(check_header(_plan, view))
+        if codec != "none":
+            # note: decompressed (not decoded) first, offsets in the decompressed frames (see iter_record_frames)
+            view, offset = memoryview(DecompressReader(io.BytesIO(view[offset:]), codec_spec(codec)[2]()).read()), 0
+        header = frame_header if frames.v1 else frame_header_v2
+        table  = []
+        for step in _plan.steps:
+            if frames.v1:
+                (size,), kind = header.unpack_from(view, offset), None
+            else:
+                size, kind = header.unpack_from(view, offset)
+            offset += header.size
+            table.append((kind, offset, size))
+            offset += size
+        if offset > len(view):
+            raise ValueError(f"truncated record, expected {offset} bytes got {len(view)}")
+        frames.view, frames.frames = view, table
+        frames.values = [_MISSING] * len(table)
+
+    def value(frames, index):
+        value = frames.values[index]
+        if value is _MISSING:
+            step, (kind, offset, size) = frames.plan.steps[index], frames.frames[index]
+            data  = frames.view[offset:offset + size]
+            value = decode_step_v1(step, data) if frames.v1 else unpack_step(step, kind, data, frames.chunks)
+            frames.values[index] = value
+        return value
+
+_MISSING = object()
+
+class LazyRecord:
+    """an item whose fields are decoded on first access (then cached), see deserialize_lazy.
+    composite fields are LazyRecord too. materialize() returns the item (a Type instance)"""
+    __slots__ = ("_layout", "_frames")
+    def __init__(lazy, _layout, _frames):
+        lazy._layout, lazy._frames = _layout, _frames
+
+    def __getattr__(lazy, name):
+        try:
+            field = lazy._layout.fields[name]
+        except KeyError:
+            raise AttributeError(f"{lazy._layout.Type.__name__} has no field {name}") from None
+        if isinstance(field, LazyLayout):
+            return LazyRecord(field, lazy._frames)
+        return lazy._frames.value(field)
+
+    @property
+    def _fields(lazy) -> tuple:
+        return lazy._layout.Type._fields
+
+    def materialize(lazy):
+        """the Type instance: the fields not accessed yet are decoded"""
+        _layout = lazy._layout
+        return plan(_layout.Type).build([lazy._frames.value(index) for index in range(_layout.start, _layout.stop)])
+
+    def __repr__(lazy):
+        return f"LazyRecord({lazy._layout.Type.__name__})"
+
+def deserialize_lazy(Type, view, chunks=None) -> LazyRecord:
+    """as deserialize_view, but the values are decoded on access (see LazyRecord). note: a compressed record is
+    decompressed (not decoded) first, see iter_record_frames"""
+    _plan = plan(Type)
+    return LazyRecord(layout(Type), LazyFrames(_plan, view, chunks))
+
+def deserialize_v1(_plan, buffer, head=b'') -> object:
+    values = []
+    for step in _plan.steps:
+        try:
+            size_as_bytes = head + buffer.read(frame_header.size - len(head))
+            head = b''
+            size, = frame_header.unpack(size_as_bytes)
+            values.append(step.decode(buffer.read(size)))
+        except Exception as e:
+            raise Exception(step, e)
+    return _plan.build(values)
+
+
 # tests
 def test_HPARAMS_types_are_composed_of_base_types():
     import shared.hparams
@@ -241,12 +885,214 @@ def test_deser_HPARAMS_round_trip():
         reconstructed = deserialize(Type, buffer)
 
         assert reconstructed == instance
-    
+
+def test_deser_nested_HPARAMS_round_trip():
+    import shared.hparams
+    import io
+    for hparams in shared.hparams.fixture_nested_hparams():
+        buffer = io.BytesIO()
+        Type = type(hparams)
+        serialize(Type, hparams, buffer)
+        buffer.seek(0)
+        assert deserialize(Type, buffer) == hparams
+
+def test_plan_steps_match_walk():
+    import shared.hparams
+    for hparams in (*shared.hparams.fixture_hparams(), *shared.hparams.fixture_nested_hparams()):
+        Type = type(hparams)
+        _plan = plan(Type)
+        assert plan(Type) is _plan
+        walk_steps = tuple(walk(Type, hparams))
+        assert tuple(step.name for step in _plan.steps) == tuple(s.name for s in walk_steps)
+        assert tuple(step.type for step in _plan.steps) == tuple(s.type for s in walk_steps)
+        assert _plan.values(hparams) == tuple(s.value for s in walk_steps)
+        assert _plan.build(_plan.values(hparams)) == hparams
+
+def test_plan_serialize_is_byte_identical_to_walk_serialize():
+    import shared.hparams
+    import io
+    for hparams in (*shared.hparams.fixture_hparams(), *shared.hparams.fixture_nested_hparams()):
+        Type = type(hparams)
+        buffer, walk_buffer = io.BytesIO(), io.BytesIO()
+        serialize(Type, hparams, buffer, version=1)
+        walk_serialize(Type, hparams, walk_buffer)
+        assert buffer.getvalue() == walk_buffer.getvalue()
+        walk_buffer.seek(0)
+        assert walk_deserialize(Type, walk_buffer) == hparams
+        walk_buffer.seek(0)
+        assert deserialize(Type, walk_buffer) == hparams
+
+def test_v2_header_and_fixed_width_scalars():
+    import shared.hparams
+    import io
+    for hparams in shared.hparams.fixture_nested_hparams():
+        Type = type(hparams)
+        buffer = io.BytesIO()
+        serialize(Type, hparams, buffer)
+        header = RecordHeader(*record_header.unpack(buffer.getvalue()[:record_header.size]))
+        assert header == RecordHeader(MAGIC, 2, 0, plan(Type).fingerprint)
+        assert plan(Type).steps[0].pack(hparams.seed) == (KIND_VALUE, _int64.pack(hparams.seed))
+        buffer.seek(0)
+        assert deserialize(Type, buffer) == hparams
+
+def test_v2_containers_are_length_prefixed():
+    import shared.hparams
+    import io
+    class containers_HPARAMS(shared.hparams.HPARAMS):
+        blobs: bytes
+        names: str
+        ints: int
+        floats: float
+        nested: int
+        empty: int
+        big: int
+    hparams = containers_HPARAMS(
+        blobs  = (b"\x00", b"[\x00]", b""),
+        names  = ("a\x00b", "[", ""),
+        ints   = (1, -2, 2**63 - 1),
+        floats = (0.1, -1e300),
+        nested = ((1, 2), (3,)),
+        empty  = (),
+        big    = (2**64, -2**70),
+    )
+    buffer = io.BytesIO()
+    serialize(containers_HPARAMS, hparams, buffer)
+    buffer.seek(0)
+    assert deserialize(containers_HPARAMS, buffer) == hparams
+
+def test_v2_numeric_tuples_are_read_as_arrays():
+    import shared.hparams, shared.hash
+    import io
+    class curve_HPARAMS(shared.hparams.HPARAMS):
+        iteration: int
+        loss: float
+    hparams = curve_HPARAMS(iteration=tuple(range(1000)), loss=tuple(1/(i+1) for i in range(1000)))
+    buffer = io.BytesIO()
+    serialize(curve_HPARAMS, hparams, buffer)
+    buffer.seek(0)
+    reconstructed = deserialize(curve_HPARAMS, buffer)
+    assert reconstructed == hparams and hparams == reconstructed
+    assert reconstructed != hparams._replace(loss=(0.,))
+    assert shared.hash.hash(b'', curve_HPARAMS, reconstructed) == shared.hash.hash(b'', curve_HPARAMS, hparams)
+    if numpy is None:
+        return
+    assert isinstance(reconstructed.loss, numpy.ndarray)
+    assert not reconstructed.loss.flags.writeable
+    # whole-value equality only against a tuple or a same shape array, elementwise otherwise
+    assert reconstructed.iteration != hparams.iteration[:-1]
+    assert reconstructed.iteration == numpy.arange(1000)
+    assert (reconstructed.iteration == 1).tolist() == [i == 1 for i in range(1000)]
+    assert (reconstructed.iteration != 1).sum() == 999
+    assert repr(reconstructed.iteration[:3]) == repr((0, 1, 2))
+    assert "array" not in shared.hparams.pretty(reconstructed)
+    assert "array" not in shared.hparams.pretty(reconstructed._replace(iteration=numpy.arange(3)))
+    assert reconstructed.loss.dtype == numpy.dtype("<f8")
+    # arrays can be written back
+    buffer = io.BytesIO()
+    serialize(curve_HPARAMS, reconstructed, buffer)
+    buffer.seek(0)
+    assert deserialize(curve_HPARAMS, buffer) == hparams
+
+def test_deserialize_view_HPARAMS_round_trip():
+    import shared.hparams
+    import io
+    for hparams in (*shared.hparams.fixture_hparams(), *shared.hparams.fixture_nested_hparams()):
+        Type = type(hparams)
+        for version in (1, 2):
+            buffer = io.BytesIO()
+            serialize(Type, hparams, buffer, version=version)
+            reconstructed = deserialize_view(Type, buffer.getbuffer())
+            assert reconstructed == hparams
+            for step, value in zip(plan(Type).steps, plan(Type).values(reconstructed)):
+                if step.type is bytes:
+                    assert isinstance(value, memoryview)
+
+def test_deserialize_lazy():
+    import shared.hparams
+    import io
+    hparams, = shared.hparams.fixture_nested_hparams()
+    Type = type(hparams)
+    for version, codec in ((1, "none"), (2, "none"), (2, "zlib")):
+        buffer = io.BytesIO()
+        serialize(Type, hparams, buffer, version=version)
+        if codec != "none":
+            buffer.seek(0)
+            source, buffer = buffer, io.BytesIO()
+            compress_record(source, buffer, codec)
+        lazy = deserialize_lazy(Type, buffer.getbuffer())
+        # fields are decoded on access, once
+        assert lazy._frames.values.count(_MISSING) == len(plan(Type).steps)
+        assert lazy.right.name == "right" and lazy.seed == 777
+        assert lazy.right.name is lazy.right.name
+        assert lazy._frames.values.count(_MISSING) == len(plan(Type).steps) - 2
+        assert lazy.right.materialize() == hparams.right and bytes(lazy.blob) == hparams.blob
+        assert lazy.materialize() == hparams and type(lazy.materialize()) is Type
+        assert lazy._fields == Type._fields
+        try:
+            lazy.missing
+            assert False, "expected AttributeError"
+        except AttributeError:
+            pass
+
+def test_serialize_streamed_bytes():
+    import shared.hparams, shared.hash
+    import io
+    hparams, = shared.hparams.fixture_nested_hparams()
+    Type = type(hparams)
+    expected = io.BytesIO()
+    serialize(Type, hparams, expected)
+    for stream in (io.BytesIO(hparams.blob), iter([hparams.blob[:1], hparams.blob[1:]])):
+        streamed = hparams._replace(blob=stream)
+        assert has_stream(Type, streamed)
+        buffer, digest = io.BytesIO(), shared.hash.new(b'')
+        serialize(Type, streamed, buffer, digest=digest)
+        assert buffer.getvalue() == expected.getvalue()
+        assert digest.digest() == shared.hash.hash(b'', Type, hparams)
+
+def test_v2_rejects_other_type():
+    import shared.hparams
+    import io
+    hparams, = shared.hparams.fixture_nested_hparams()
+    buffer = io.BytesIO()
+    serialize(type(hparams), hparams, buffer)
+    buffer.seek(0)
+    try:
+        deserialize(shared.hparams.fixture_leaf_HPARAMS, buffer)
+    except ValueError:
+        pass
+    else:
+        assert False, "fingerprint mismatch should raise"
+
+
+# benchmark
+def bench_plan_vs_walk(n=10_000):
+    """compare serialize/deserialize against the walk_serialize/walk_deserialize reference"""
+    import shared.hparams
+    import io, time
+    for hparams in shared.hparams.fixture_nested_hparams():
+        Type = type(hparams)
+        for name, _serialize, _deserialize in (
+                ("walk", walk_serialize, walk_deserialize),
+                ("plan", serialize, deserialize)):
+            t0 = time.perf_counter()
+            for _ in range(n):
+                buffer = io.BytesIO()
+                _serialize(Type, hparams, buffer)
+            t1 = time.perf_counter()
+            for _ in range(n):
+                buffer.seek(0)
+                _deserialize(Type, buffer)
+            t2 = time.perf_counter()
+            print(f"{Type.__name__} {name}: serialize {n/(t1-t0):,.0f}/s deserialize {n/(t2-t1):,.0f}/s")
+
 if __name__ == "__main__":
-    import os
+    import os, sys
     if os.path.abspath(os.curdir).endswith("shared"): os.chdir("..")
     from shared.deser import *
-    test_experimental_HPARAMS_types_are_composed_of_base_types()
+    if "--bench" in sys.argv:
+        bench_plan_vs_walk()
+        sys.exit()
+    test_HPARAMS_types_are_composed_of_base_types()
     test_walk_HPARAMS_round_trip()
     test_as_bytes_HPARAMS_round_trip()
     test_deser_HPARAMS_round_trip()
@@ -0,0 +1,240 @@
+"""durability policy of catalog writes (Catalog.durability):
+
+ - "none":         no fsync, the OS writes items back when it wants
+ - "close":        an item is fsynced before it is published (a published item is never empty/torn after a crash),
+                   its directory entry is not (files engine), the index entry is (pack engine)
+ - "batch(n, ms)": as close for the content of the items (an fsync per add, per batch of add_many for the pack
+                   engine), then their metadata by group: a background flusher fsyncs the directories of the items
+                   published (files engine) or the index (pack engine) once n writes are pending or after ms
+                   milliseconds. Catalog.flush() waits for the pending writes. note: the content is not group
+                   committed, an item added since the last flush may be missing after a crash, never torn
+ - "always":       the item and its directory are fsynced before add returns
+"""
+import atexit, functools, os, re, threading, typing
+
+
+class Durability(typing.NamedTuple):
+    mode: str
+    n: int = 0
+    ms: float = 0
+
+MODES = ("none", "close", "batch", "always")
+
+@functools.lru_cache(maxsize=None)
+def parse(durability: str) -> Durability:
+    match = re.fullmatch(r"\s*batch\(\s*(\d+)\s*,\s*(\d+(?:\.\d*)?)\s*\)\s*", durability)
+    if match:
+        return Durability("batch", int(match[1]), float(match[2]))
+    if durability.strip() in MODES and durability.strip() != "batch":
+        return Durability(durability.strip())
+    raise ValueError(f"unknown durability {durability!r}, expected one of none, close, batch(n, ms), always")
+
+def fsync_file(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def fsync_directory(path):
+    """persists the entries of a directory (e.g. a renamed file)"""
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def fsync_files(paths, directories=()):
+    """fsync files then their directories and `directories` (note: files removed in the meantime are skipped)"""
+    directories = dict.fromkeys(map(os.path.abspath, directories))
+    for path in paths:
+        try:
+            fsync_file(path)
+        except FileNotFoundError:
+            continue
+        directories[os.path.dirname(os.path.abspath(path))] = None
+    for directory in directories:
+        fsync_directory(directory)
+
+
+class Flusher:
+    """background group fsync of the files and directories of a catalog (see flusher)"""
+    def __init__(flusher, n, ms):
+        flusher.n, flusher.ms = n, ms
+        flusher.pending   = {}     # paths to fsync (note: dict as an ordered set)
+        flusher.directories = {}   # directories to fsync (of files fsynced already)
+        flusher.submitted = 0      # writes submitted
+        flusher.synced    = 0      # writes persisted
+        flusher.commits   = 0      # group commits
+        flusher.urgent    = False  # a flush is waiting
+        flusher.error     = None   # raised by the next flush
+        flusher.condition = threading.Condition()
+        flusher.thread    = threading.Thread(target=flusher.run, name="Flusher", daemon=True)
+        flusher.thread.start()
+
+    def submit(flusher, paths, synced=False):
+        """a write of paths (published files) to persist. `synced`: their content was fsynced, only their directories are"""
+        with flusher.condition:
+            if synced:
+                flusher.directories.update(dict.fromkeys(os.path.dirname(os.path.abspath(path)) for path in paths))
+            else:
+                flusher.pending.update(dict.fromkeys(paths))
+            flusher.submitted += 1
+            if flusher.submitted - flusher.synced >= flusher.n:
+                flusher.condition.notify_all()
+
+    def run(flusher):
+        while True:
+            with flusher.condition:
+                flusher.condition.wait_for(lambda: flusher.submitted > flusher.synced)
+                flusher.condition.wait_for(lambda: flusher.urgent or flusher.submitted - flusher.synced >= flusher.n,
+                                           timeout=flusher.ms / 1000)
+                paths, flusher.pending = flusher.pending, {}
+                directories, flusher.directories = flusher.directories, {}
+                submitted, flusher.urgent = flusher.submitted, False
+            error = None
+            try:
+                fsync_files(paths, directories)
+            except OSError as exception:
+                error = exception
+            with flusher.condition:
+                flusher.synced   = submitted
+                flusher.commits += 1
+                flusher.error    = flusher.error or error
+                flusher.condition.notify_all()
+
+    def flush(flusher):
+        """barrier: returns once the writes submitted before are persisted (raises the OSError of a failed fsync)"""
+        with flusher.condition:
+            submitted = flusher.submitted
+            if flusher.synced < submitted:
+                flusher.urgent = True
+                flusher.condition.notify_all()
+                flusher.condition.wait_for(lambda: flusher.synced >= submitted)
+            error, flusher.error = flusher.error, None
+        if error is not None:
+            raise error
+
+_flushers = {}
+_flushers_mutex = threading.Lock()
+def flusher(path, policy: Durability) -> Flusher:
+    """the flusher of a catalog path (shared in a process, note: threads do not survive fork)"""
+    key = (os.getpid(), os.path.abspath(path), policy)
+    with _flushers_mutex:
+        if key not in _flushers:
+            _flushers[key] = Flusher(policy.n, policy.ms)
+        return _flushers[key]
+
+@atexit.register
+def flush_all():
+    for key, _flusher in tuple(_flushers.items()):
+        if key[0] == os.getpid():
+            _flusher.flush()
+
+
+#### tests
+def test_parse():
+    assert parse("none") == Durability("none")
+    assert parse("always") == Durability("always")
+    assert parse("batch(64, 5)") == Durability("batch", 64, 5.0)
+    for durability in ("batch", "sometimes", "batch(1)"):
+        try:
+            parse(durability)
+            assert False, "expected ValueError"
+        except ValueError:
+            pass
+
+def test_Catalog_durability():
+    import os
+    import pathlib
+    import shutil
+    import shared.catalog, shared.durability, shared.hparams, shared.packfile
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    hparams, = shared.hparams.fixture_nested_hparams()
+    for Catalog in (shared.catalog.Catalog, shared.packfile.PackCatalog):
+        for i, durability in enumerate(("none", "close", "always", "batch(4, 10000)")):
+            catalog = Catalog(
+                path = SDEXPERIMENTS_PATH / f"testCatalogDurability{Catalog.__name__}{i}",
+                item_suffix = ".hparams",
+                Type = type(hparams),
+                durability = durability,
+            )
+            shutil.rmtree(catalog.path, ignore_errors=True)
+            items  = [hparams._replace(seed=seed) for seed in range(10)]
+            hashes = [catalog.add(item) for item in items]
+            catalog.flush()
+            assert [catalog.get(_hash) for _hash in hashes] == items
+            if durability.startswith("batch"):
+                _flusher = shared.durability.flusher(catalog.path, parse(durability))
+                # group commits: 2 full batches (n=4), the remaining writes by flush
+                assert _flusher.synced == _flusher.submitted == 10
+                assert _flusher.commits <= 3
+            shutil.rmtree(catalog.path)
+
+def test_Catalog_batch_publishes_synced_items():
+    import os
+    import pathlib
+    import shutil
+    import shared.catalog, shared.hparams
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    hparams, = shared.hparams.fixture_nested_hparams()
+    catalog = shared.catalog.Catalog(
+        path = SDEXPERIMENTS_PATH / "testCatalogBatchPublishesSynced",
+        item_suffix = ".hparams",
+        Type = type(hparams),
+        durability = "batch(1000, 10000)",
+    )
+    shutil.rmtree(catalog.path, ignore_errors=True)
+    items  = [hparams._replace(seed=seed) for seed in range(5)]
+    hashes = [catalog.hash_item(item) for item in items]
+    # fsynced file (inode) -> whether its item was at its item_path then
+    synced, _fsync = {}, os.fsync
+    def fsync(fd):
+        _fsync(fd)
+        synced[os.fstat(fd).st_ino] = [catalog.item_path(_hash).exists() for _hash in hashes]
+    os.fsync = fsync
+    try:
+        assert [catalog.add(item) for item in items] == hashes
+        # note: the flusher has not run (n, ms), the content of the items was fsynced before they were published
+        for i, _hash in enumerate(hashes):
+            assert synced[os.stat(catalog.item_path(_hash)).st_ino][i] is False
+        catalog.flush()
+    finally:
+        os.fsync = _fsync
+    shutil.rmtree(catalog.path)
+
+def test_PackCatalog_syncs_records_before_indexing():
+    import os
+    import pathlib
+    import shutil
+    import shared.hparams, shared.packfile
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    hparams, = shared.hparams.fixture_nested_hparams()
+    for i, durability in enumerate(("close", "always", "batch(1000, 10000)")):
+        catalog = shared.packfile.PackCatalog(
+            path = SDEXPERIMENTS_PATH / f"testPackCatalogSyncsRecords{i}",
+            item_suffix = ".hparams",
+            Type = type(hparams),
+            durability = durability,
+        )
+        shutil.rmtree(catalog.path, ignore_errors=True)
+        index_path = pathlib.Path(catalog.index().path)
+        # fsynced file (inode) -> size of the index then
+        synced, _fsync = {}, os.fsync
+        def fsync(fd):
+            _fsync(fd)
+            synced.setdefault(os.fstat(fd).st_ino, []).append(index_path.stat().st_size if index_path.exists() else 0)
+        os.fsync = fsync
+        try:
+            for seed in range(3):
+                size = index_path.stat().st_size if index_path.exists() else 0
+                catalog.add(hparams._replace(seed=seed))
+                segment_path = catalog.segment_path(catalog.location(catalog.hash_item(hparams._replace(seed=seed))).segment)
+                # note: the record was fsynced before its index entry was appended
+                assert size in synced[os.stat(segment_path).st_ino]
+            catalog.flush()
+            assert synced[os.stat(index_path).st_ino]
+        finally:
+            os.fsync = _fsync
+        shutil.rmtree(catalog.path)
+
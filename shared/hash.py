@@ -9,16 +9,152 @@ class HashProtocol(typing.Protocol):
 
 
 # current
-import hashlib
-from shared import deser  # TODO future: will move to WalkProtocol
+import functools, hashlib, struct
+from shared import cache, deser  # TODO future: will move to WalkProtocol
 
-def hash(current_hash: bytes, Type, instance) -> bytes:
+# algorithm -> (tag, hashlib constructor). md5 digests are not tagged (16 bytes, as all the hashes before
+# algorithms), the others are prefixed by their tag byte: catalogs mixing algorithms stay readable (see algorithm_of)
+ALGORITHMS = {
+    "md5":     (None,    hashlib.md5),
+    "blake2b": (b"\x01", functools.partial(hashlib.blake2b, digest_size=32)),
+    "sha256":  (b"\x02", hashlib.sha256),
+}
+TAGS = {tag: algorithm for algorithm, (tag, _) in ALGORITHMS.items() if tag is not None}
+
+def algorithm_spec(algorithm) -> "(tag, constructor)":
+    try:
+        return ALGORITHMS[algorithm]
+    except KeyError:
+        raise ValueError(f"unknown hash algorithm {algorithm!r}, expected one of {', '.join(ALGORITHMS)}")
+
+def algorithm_of(_hash: bytes) -> str:
+    """the algorithm of a digest returned by hash"""
+    if len(_hash) == 16:
+        return "md5"
+    try:
+        return TAGS[_hash[:1]]
+    except KeyError:
+        raise ValueError(f"unknown hash algorithm tag of {_hash.hex()}")
+
+class TaggedDigest:
+    """hashlib object whose digest is prefixed by the algorithm tag"""
+    def __init__(digest, tag, hashlib_object):
+        digest.tag, digest.hashlib_object = tag, hashlib_object
+    def update(digest, data):
+        digest.hashlib_object.update(data)
+    def digest(digest) -> bytes:
+        return digest.tag + digest.hashlib_object.digest()
+
+def new(current_hash: bytes, algorithm="md5"):
+    """hashlib object used by hash (e.g. for deser.serialize(..., digest=))"""
+    tag, constructor = algorithm_spec(algorithm)
+    digest = constructor()
+    digest.update(current_hash or b'')
+    return digest if tag is None else TaggedDigest(tag, digest)
+
+SCHEMES = ("legacy", "merkle-v1")
+
+def hash(current_hash: bytes, Type, instance, scheme="legacy", algorithm="md5") -> bytes:
+    """`scheme`: "legacy" hashes the flattened walk of instance, "merkle-v1" combines the digests of sub HPARAMS
+    (see merkle_hash). the digests of the schemes differ.
+    `algorithm`: see ALGORITHMS"""
+    if scheme == "merkle-v1":
+        return merkle_hash(current_hash, Type, instance, algorithm)
+    if scheme != "legacy":
+        raise ValueError(f"unknown hash scheme {scheme!r}, expected one of {', '.join(SCHEMES)}")
+    current_hash = new(current_hash, algorithm)
+    # TODO: currently experimental.*_HPARAMS dependecy is hard coded in deser.py (see future)
+    plan = deser.plan(Type)
+    for step, value in zip(plan.steps, plan.values(instance)):
+        # note: we don t rely on the file format, only on step (container/base) type encoding
+        if step.type is bytes and deser.is_stream(value):
+            # note: consumes the stream
+            for chunk in deser.iter_chunks(value):
+                current_hash.update(chunk)
+        else:
+            current_hash.update(step.encode(value))
+    return current_hash.digest()
+
+# merkle-v1: node digest = H(tag, for each field: b"N" + node digest of a sub HPARAMS, b"B" + H(bytes),
+#            b"L" + length + encoded value), hash = H(salt, tag, root node digest) with H the algorithm
+MERKLE_TAG = b"merkle-v1"
+merkle_length = struct.Struct("<Q")
+
+class MerkleNode(typing.NamedTuple):
+    Type: type
+    fields: tuple  # (name, sub Type or None, base type, encode)
+
+_merkle_nodes = {}
+def merkle_node(Type) -> MerkleNode:
+    try:
+        return _merkle_nodes[Type]
+    except KeyError:
+        fields = tuple((name, annotation_type, None, None) if deser.is_composite_type(annotation_type) else
+                       (name, None, annotation_type, deser.encoder(annotation_type))
+                       for name, annotation_type in Type.__annotations__.items())
+        _merkle_node = _merkle_nodes[Type] = MerkleNode(Type, fields)
+        return _merkle_node
+
+# node digests of instances, by identity (note: tuples can not be weak referenced, the memo keeps its instances
+# alive, bounded LRU of `budget` bytes). only nodes of immutable leaves of at most MERKLE_MEMO_LEAF_BYTES bytes are
+# memoized: not a large bytes value (e.g. a checkpoint), nor a bytearray/memoryview/array mutated since
+merkle_memo = cache.ReadCache(budget=2**24)
+MERKLE_MEMO_LEAF_BYTES = 4096
+MERKLE_MEMO_OVERHEAD = 64  # bytes accounted per node
+
+def immutable(value) -> bool:
+    if type(value) is tuple:
+        return all(map(immutable, value))
+    return type(value) in (bool, int, float, str, bytes)
+
+def merkle_node_digest(Type, instance, algorithm="md5") -> "(digest, memoizable)":
+    key = (Type, id(instance), algorithm)
+    entry = merkle_memo.get(key)
+    if entry is not None and entry[0] is instance:
+        return entry[1], True
+    _, constructor = algorithm_spec(algorithm)
+    digest, memoizable, leaf_bytes = constructor(), True, 0
+    digest.update(MERKLE_TAG)
+    for name, SubType, base_type, encode in merkle_node(Type).fields:
+        value = getattr(instance, name)
+        if SubType is not None:
+            sub_digest, sub_memoizable = merkle_node_digest(SubType, value, algorithm)
+            digest.update(b"N" + sub_digest)
+            memoizable = memoizable and sub_memoizable
+        elif base_type is bytes and not isinstance(value, tuple):
+            # note: same digest streamed or not, a streamed instance is not memoized (its stream is consumed)
+            memoizable = memoizable and type(value) is bytes
+            chunks = deser.iter_chunks(value) if deser.is_stream(value) else (value,)
+            bytes_digest = constructor()
+            for chunk in chunks:
+                bytes_digest.update(chunk)
+                leaf_bytes += len(chunk)
+            digest.update(b"B" + bytes_digest.digest())
+        else:
+            as_bytes = encode(value)
+            memoizable = memoizable and immutable(value)
+            leaf_bytes += len(as_bytes)
+            digest.update(b"L" + merkle_length.pack(len(as_bytes)) + as_bytes)
+    digest = digest.digest()
+    memoizable = memoizable and leaf_bytes <= MERKLE_MEMO_LEAF_BYTES
+    if memoizable:
+        merkle_memo.put(key, (instance, digest), MERKLE_MEMO_OVERHEAD + leaf_bytes)
+    return digest, memoizable
+
+def merkle_hash(current_hash: bytes, Type, instance, algorithm="md5") -> bytes:
+    """hash scheme "merkle-v1": digests of sub HPARAMS instances are memoized, e.g. hashing a variant (_replace)
+    of a leaf at depth d costs d node digests"""
+    node_digest, _ = merkle_node_digest(Type, instance, algorithm)
+    digest = new(current_hash, algorithm)
+    digest.update(MERKLE_TAG + node_digest)
+    return digest.digest()
+
+def walk_hash(current_hash: bytes, Type, instance) -> bytes:
+    """reference implementation of hash (re-walks Type for every instance). Hint: use hash()"""
     if current_hash is None:
         current_hash = b''
     current_hash = hashlib.new("md5", current_hash)
-    # TODO: currently experimental.*_HPARAMS dependecy is hard coded in deser.py (see future)
     for walk_step in deser.walk(Type, instance):
-        # note: we don t rely on the file format, only on step (container/base) type encoding
         as_bytes = deser.to_bytes(walk_step.type, walk_step.value)
         current_hash.update(as_bytes)
     return current_hash.digest()
@@ -34,7 +170,73 @@ def test_hash_HPARAMS_return_bytes():
         current_hash = hash(current_hash, Type, instance)
         assert isinstance(current_hash, bytes)
         
+
+def test_hash_is_identical_to_walk_hash():
+    import shared.hparams
+    for hparams in (*shared.hparams.fixture_hparams(), *shared.hparams.fixture_nested_hparams()):
+        Type = type(hparams)
+        assert hash(b'', Type, hparams) == walk_hash(b'', Type, hparams)
+        assert hash(b'salt', Type, hparams) == walk_hash(b'salt', Type, hparams)
     
+def test_merkle_hash():
+    import shared.hparams
+    hparams, = shared.hparams.fixture_nested_hparams()
+    Type = type(hparams)
+    _hash = hash(b'', Type, hparams, scheme="merkle-v1")
+    assert _hash != hash(b'', Type, hparams)
+    assert hash(b'salt', Type, hparams, scheme="merkle-v1") != _hash
+    # memoized: same digest from scratch
+    merkle_memo.clear()
+    assert hash(b'', Type, hparams, scheme="merkle-v1") == _hash
+    # a variant of a leaf only computes the nodes on its path (root and right)
+    variant = hparams._replace(right=hparams.right._replace(value=1.0))
+    before = merkle_memo.stats()
+    assert hash(b'', Type, variant, scheme="merkle-v1") != _hash
+    after = merkle_memo.stats()
+    assert (after.misses - before.misses, after.hits - before.hits) == (2, 1)
+    # equal values, different instances
+    clone = Type(*hparams[:1], type(hparams.left)(*hparams.left), *hparams[2:])
+    assert hash(b'', Type, clone, scheme="merkle-v1") == _hash
+    # streamed bytes
+    import io
+    streamed = hparams._replace(blob=io.BytesIO(hparams.blob))
+    assert hash(b'', Type, streamed, scheme="merkle-v1") == _hash
+    # mutable bytes are not memoized (the digest of a mutated instance is not stale)
+    mutable = hparams._replace(blob=bytearray(hparams.blob))
+    assert hash(b'', Type, mutable, scheme="merkle-v1") == _hash
+    mutable.blob[:1] = b"!"
+    assert hash(b'', Type, mutable, scheme="merkle-v1") == hash(b'', Type, hparams._replace(blob=bytes(mutable.blob)), scheme="merkle-v1")
+    # large bytes are not retained by the memo
+    import shared.catalog
+    large = shared.catalog.FILE_HPARAMS("checkpoint", bytes(2**20))
+    merkle_hash(b'', shared.catalog.FILE_HPARAMS, large)
+    assert merkle_memo.get((shared.catalog.FILE_HPARAMS, id(large), "md5")) is None
+    assert all(entry[0] is not large for entry, size in merkle_memo.items.values())
+    try:
+        hash(b'', Type, hparams, scheme="sha-v0")
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+
+def test_hash_algorithms():
+    import io
+    import shared.hparams
+    hparams, = shared.hparams.fixture_nested_hparams()
+    Type = type(hparams)
+    assert hash(b'', Type, hparams, algorithm="md5") == hash(b'', Type, hparams)
+    for scheme in SCHEMES:
+        hashes = {algorithm: hash(b'salt', Type, hparams, scheme, algorithm) for algorithm in ALGORITHMS}
+        assert len(set(hashes.values())) == len(ALGORITHMS)
+        for algorithm, _hash in hashes.items():
+            assert algorithm_of(_hash) == algorithm
+        # streamed bytes
+        streamed = hparams._replace(blob=io.BytesIO(hparams.blob))
+        assert hash(b'salt', Type, streamed, scheme, "blake2b") == hashes["blake2b"]
+    # digest updated by serialize
+    buffer, digest = io.BytesIO(), new(b'', "sha256")
+    deser.serialize(Type, hparams, buffer, digest=digest)
+    assert digest.digest() == hash(b'', Type, hparams, algorithm="sha256")
+
 def old_test_hash_EXPERIMENT_HPARAMS_return_bytes():
     """ DEPRECATED because it relies on shared.experimental. Hint: see test_hash_HPARAMS_return_bytes() """
     raise Exception(""" DEPRECATED because it relies on shared.experimental. Hint: see test_hash_HPARAMS_return_bytes() """)
@@ -4,19 +4,24 @@ import typing
 HPARAMS = typing.NamedTuple
 
 
-def pretty(hparams, depth=0):
-    """return a 'pretty' string representation of a `hparams`."""
+def pretty(hparams, depth=0, scheme="legacy"):
+    """return a 'pretty' string representation of a `hparams`.
+
+    `scheme`: of the hashes shown (see shared.hash.hash), "merkle-v1" hashes each sub hparams once"""
     LF,TAB,COLUMN = '\n','\t'*(depth+1), ': '
     max_field_name_length = max(map(len,hparams._fields))
 
-    import shared.hash
-    hparams_hash = shared.hash.hash(b'', type(hparams), hparams)
+    import shared.hash, shared.deser
+    hparams_hash = shared.hash.hash(b'', type(hparams), hparams, scheme)
     rpr = f"{type(hparams).__name__}({hparams_hash.hex()})"
     for field_name in hparams._fields:
         field_name_fmt = (field_name + " "*max_field_name_length)[:max_field_name_length]
         field_value = getattr(hparams, field_name)
         if is_HPARAMS_instance_safe(field_value):
-            field_value_fmt = pretty(field_value, depth+1)
+            field_value_fmt = pretty(field_value, depth+1, scheme)
+        elif isinstance(field_value, shared.deser.array_types):
+            # note: numeric tuples read as arrays are shown as the tuples they were written as
+            field_value_fmt = repr(tuple(field_value.tolist()))
         else:
             field_value_fmt = repr(field_value)
         rpr+= LF + TAB + field_name_fmt + COLUMN + field_value_fmt
@@ -27,9 +32,9 @@ def is_HPARAMS_subclass(obj) -> bool:
     if not isinstance(obj, type):
         raise TypeError(f"expected a type, got {type(obj).__name__}")
     is_name_ending_with_HPARAMS = obj.__name__.endswith("_HPARAMS")
-    is_a_type = isinstance(obj, type)
-    is_HPARAMS_subclass = issubclass(obj, HPARAMS)
-    return is_name_ending_with_HPARAMS and is_a_type
+    # note: typing.NamedTuple is a function since python 3.9 (issubclass would raise)
+    is_HPARAMS_subclass = issubclass(obj, tuple) and hasattr(obj, "_fields")
+    return is_name_ending_with_HPARAMS and is_HPARAMS_subclass
 
 def is_HPARAMS_subclass_safe(obj) -> bool:
     try:
@@ -59,6 +64,27 @@ def fixture_HPARAMS():
     yield some_HPARAMS
     yield some_NamedTuple_HPARAMS
 
+class fixture_leaf_HPARAMS(HPARAMS):
+    name: str
+    value: float
+    shape: int
+class fixture_node_HPARAMS(HPARAMS):
+    seed: int
+    left: fixture_leaf_HPARAMS
+    right: fixture_leaf_HPARAMS
+    flag: bool
+    blob: bytes
+
+def fixture_nested_hparams():
+    """nested and container values (note: defined at module level, hence picklable)"""
+    yield fixture_node_HPARAMS(
+        seed  = 777,
+        left  = fixture_leaf_HPARAMS("left", 0.5, (28, 28)),
+        right = fixture_leaf_HPARAMS("right", -1e-3, (10,)),
+        flag  = True,
+        blob  = b"\xff\x01",
+    )
+
 def fixture_non_HPARAMS():
     class some_non_HPARAMS_(typing.NamedTuple):
         some_str: str
@@ -93,6 +119,10 @@ def test_is_HPARAMS_subclass_refuses_non_HPARAMS_subclasses():
             raised = True
         refused= (not accepted) or raised
         assert refused, f"is_HPARAMS_subclass should refuse type_non_HPARAMS {type_non_HPARAMS}"
+    # named like an HPARAMS, not a NamedTuple
+    class PLAIN_HPARAMS:
+        seed: int
+    assert not is_HPARAMS_subclass(PLAIN_HPARAMS)
 
 def test_is_HPARAMS_instance_accepts_instances_of_HPARAMS_subclasses():
     for hparams_instance in fixture_hparams():
@@ -0,0 +1,209 @@
+"""leases on the items of a catalog shared by several hosts (e.g. experiments trained by N nodes mounting CATALOG_PATH).
+
+a lease is an item of the lease catalog (<catalog.path>/.leases, Lease_HPARAMS(key hex, generation)) created with
+add_nosafe: of the workers claiming a key, only one creates its next generation (exclusive create, see publish).
+the holder renews it by updating the mtime of its file (heartbeat) and releases it by setting its mtime to 0.
+a lease whose mtime is older than ttl is expired: the next generation may be claimed (stolen), the previous holder
+learns it on its next renew. note: hosts clocks must agree within much less than ttl.
+
+    python -m shared.lease experiment_model.EXPERIMENT_HPARAMS train.train --is-done=train.is_done [--ttl=600]
+"""
+import os, pathlib, sys, threading, time, traceback, typing
+
+
+class Lease_HPARAMS(typing.NamedTuple):
+    key_hex: str
+    generation: int
+
+def lease_catalog(catalog):
+    """the catalog of the leases on the items of catalog (files engine: leases are files with an mtime)"""
+    import shared.catalog
+    return shared.catalog.Catalog(
+        path = pathlib.Path(catalog.path) / ".leases",
+        item_suffix = ".lease",
+        Type = Lease_HPARAMS,
+        durability = catalog.durability,
+    )
+
+class Lease(typing.NamedTuple):
+    leases: object  # lease catalog
+    key: bytes
+    generation: int
+
+    def path(lease) -> pathlib.Path:
+        return lease.leases.item_path(lease.leases.hash_item(Lease_HPARAMS(lease.key.hex(), lease.generation)))
+
+    def lost(lease) -> bool:
+        """the lease expired and was claimed by another worker"""
+        return lease.leases.contains(lease.leases.hash_item(Lease_HPARAMS(lease.key.hex(), lease.generation + 1)))
+
+    def renew(lease) -> bool:
+        """heartbeat, False if the lease was lost"""
+        if lease.lost():
+            return False
+        os.utime(lease.path())
+        return True
+
+    def release(lease):
+        """expires the lease now (e.g. the work is done, or failed and may be retried by others)"""
+        if not lease.lost():
+            os.utime(lease.path(), (0, 0))
+
+def current(leases, key) -> "(generation, mtime)":
+    """the last generation of the leases on key and the mtime of its file, (-1, None) if never leased"""
+    generation, mtime = -1, None
+    while True:
+        item_path = leases.item_path(leases.hash_item(Lease_HPARAMS(key.hex(), generation + 1)))
+        try:
+            mtime = item_path.stat().st_mtime
+        except FileNotFoundError:
+            return generation, mtime
+        generation += 1
+
+def acquire(catalog, key, ttl) -> Lease:
+    """claims key (e.g. an experiment hash of catalog), None if another worker holds an unexpired lease on it.
+    `ttl`: seconds without heartbeat after which a lease expires"""
+    leases = lease_catalog(catalog)
+    leases.ensure_exists()
+    generation, mtime = current(leases, key)
+    if mtime is not None and time.time() - mtime < ttl:
+        return None
+    try:
+        leases.add_nosafe(Lease_HPARAMS(key.hex(), generation + 1))
+    except leases.E_ADD_NOSAFE:
+        return None  # note: claimed by another worker in the meantime
+    return Lease(leases, key, generation + 1)
+
+class Heartbeat:
+    """renews a lease every interval seconds in a background thread, while the work runs"""
+    def __init__(heartbeat, lease, interval):
+        heartbeat.lease, heartbeat.interval = lease, interval
+        heartbeat.lost    = False
+        heartbeat.stopped = threading.Event()
+        heartbeat.thread  = threading.Thread(target=heartbeat.run, name="Heartbeat", daemon=True)
+
+    def run(heartbeat):
+        while not heartbeat.stopped.wait(heartbeat.interval):
+            if not heartbeat.lease.renew():
+                heartbeat.lost = True
+                return
+
+    def __enter__(heartbeat):
+        heartbeat.thread.start()
+        return heartbeat
+
+    def __exit__(heartbeat, *exc_info):
+        heartbeat.stopped.set()
+        heartbeat.thread.join()
+
+class DrainReport(typing.NamedTuple):
+    succeeded: tuple  # hashes run by this worker
+    failed: tuple     # (hash, formatted exception)
+    lost: tuple       # hashes whose lease was stolen while running (note: the work may run twice)
+
+def drain(catalog, task, is_done, ttl=600, hashes=None, log=sys.stderr) -> DrainReport:
+    """task(hash) for the hashes (default: catalog.iter()) not is_done, each leased by this worker.
+    run on every node: the nodes drain the catalog together. a failed hash is released, other nodes retry it"""
+    hashes = list(catalog.iter() if hashes is None else hashes)
+    succeeded, failed, lost = [], [], []
+    for _hash in hashes:
+        if is_done(_hash):
+            continue
+        lease = acquire(catalog, _hash, ttl)
+        if lease is None:
+            continue
+        try:
+            # note: done by the previous holder between is_done and acquire
+            if is_done(_hash):
+                continue
+            with Heartbeat(lease, ttl / 3) as heartbeat:
+                try:
+                    task(_hash)
+                except Exception:
+                    failed.append((_hash, traceback.format_exc()))
+                    if log is not None:
+                        print(f"{_hash.hex()} FAILED\n{failed[-1][1]}", file=log)
+                    continue
+            (lost if heartbeat.lost else succeeded).append(_hash)
+        finally:
+            lease.release()
+    return DrainReport(tuple(succeeded), tuple(failed), tuple(lost))
+
+
+#### tests
+def fixture_catalog():
+    import os
+    import shared.catalog, shared.hparams
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    return shared.catalog.Catalog(path=SDEXPERIMENTS_PATH / "testLease", item_suffix=".hparams",
+                                  Type=shared.hparams.fixture_node_HPARAMS)
+
+def fixture_task(_hash):
+    """records each run with a single append write"""
+    catalog = fixture_catalog()
+    time.sleep(0.01)
+    fd = os.open(catalog.path / "runs", os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(fd, f"{_hash.hex()}\n".encode("ascii"))
+    finally:
+        os.close(fd)
+
+def fixture_is_done(_hash):
+    runs = fixture_catalog().path / "runs"
+    return runs.exists() and _hash.hex() in runs.read_text().split()
+
+def fixture_drain(_):
+    return drain(fixture_catalog(), fixture_task, fixture_is_done, ttl=60, log=None)
+
+def test_acquire():
+    import shutil
+    import shared.hparams
+    catalog = fixture_catalog()
+    shutil.rmtree(catalog.path, ignore_errors=True)
+    key = catalog.add(next(shared.hparams.fixture_nested_hparams()))
+    lease = acquire(catalog, key, ttl=60)
+    assert lease.generation == 0 and acquire(catalog, key, ttl=60) is None
+    assert lease.renew()
+    # expired: stolen by the next generation, the holder learns it on renew
+    os.utime(lease.path(), (0, 1))
+    stolen = acquire(catalog, key, ttl=60)
+    assert stolen.generation == 1 and acquire(catalog, key, ttl=60) is None
+    assert not lease.renew() and stolen.renew()
+    lease.release()  # note: no effect on the lease of the new holder
+    assert acquire(catalog, key, ttl=60) is None
+    stolen.release()
+    assert acquire(catalog, key, ttl=60).generation == 2
+    # leases are not items of catalog
+    assert list(catalog.iter()) == [key]
+    shutil.rmtree(catalog.path)
+
+def test_drain():
+    import collections
+    import concurrent.futures
+    import shutil
+    import shared.hparams
+    catalog = fixture_catalog()
+    shutil.rmtree(catalog.path, ignore_errors=True)
+    hparams, = shared.hparams.fixture_nested_hparams()
+    hashes = [catalog.add(hparams._replace(seed=seed)) for seed in range(40)]
+    # 4 nodes drain the catalog: each hash runs once
+    with concurrent.futures.ProcessPoolExecutor(4) as executor:
+        reports = list(executor.map(fixture_drain, range(4)))
+    runs = collections.Counter((catalog.path / "runs").read_text().split())
+    assert runs == collections.Counter(_hash.hex() for _hash in hashes)
+    assert sorted(_hash for report in reports for _hash in report.succeeded) == sorted(hashes)
+    assert not any(report.failed or report.lost for report in reports)
+    shutil.rmtree(catalog.path)
+
+
+if __name__ == "__main__":
+    import shared.utils
+    argv = [arg for arg in sys.argv if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv if arg.startswith("--") and "=" in arg)
+    catalog = shared.utils.ro_catalog_from_qualname(argv[1])
+    task    = shared.utils.import_from_qualname(argv[2])
+    is_done = shared.utils.import_from_qualname(options["is-done"])
+    report  = drain(catalog, task, is_done, ttl=float(options.get("ttl", 600)))
+    print(f"{len(report.succeeded)} succeeded, {len(report.failed)} failed, {len(report.lost)} lost leases",
+          file=sys.stderr)
+    sys.exit(1 if report.failed else 0)
@@ -0,0 +1,617 @@
+"""append-only packfile storage engine: same API as shared.catalog.Catalog, without one file per item.
+
+layout of a PackCatalog directory:
+    segment-<n>.pack  records appended one after the other (a new segment starts past segment_size)
+    pack.idx          index entries hash -> (segment, offset, length), appended after each record
+    pack.lock         writers (add, recover, compact) hold an exclusive flock on it
+
+a record is only indexed once fully written (and fsynced, unless durability none): readers never take a lock.
+a crash can leave a torn record (or a record without index entry): see recover(). a record is checked against its
+crc32 when first read (see verify), recover() checks them all and drops the entries of torn records.
+"""
+import typing
+import pathlib, fcntl, mmap, os, io, tempfile, threading, zlib, struct
+from shared import deser, hash, refs, durability
+from shared.catalog import Catalog
+
+RECORD_MAGIC  = b"PKR\x01"
+record_header = struct.Struct("<4sBQL")  # magic, hash size, payload size, payload crc32 (then hash, then payload)
+entry_header  = struct.Struct("<B")      # hash size (then hash, then entry_location)
+entry_location= struct.Struct("<LQQ")    # segment, payload offset, payload size
+
+
+class Location(typing.NamedTuple):
+    segment: int
+    offset: int    # of the payload (a deser record)
+    length: int
+
+
+def pack_entry(_hash, location) -> bytes:
+    return entry_header.pack(len(_hash)) + _hash + entry_location.pack(*location)
+
+def iter_entries(data) -> "(hash, Location, end)":
+    """complete entries of an index file content (a torn last entry is ignored)"""
+    offset = 0
+    while offset + entry_header.size <= len(data):
+        hash_size, = entry_header.unpack_from(data, offset)
+        end = offset + entry_header.size + hash_size + entry_location.size
+        if end > len(data):
+            return
+        _hash = bytes(data[offset + entry_header.size:offset + entry_header.size + hash_size])
+        yield _hash, Location(*entry_location.unpack_from(data, end - entry_location.size)), end
+        offset = end
+
+
+class PackIndex:
+    """in memory state of pack.idx (shared by all PackCatalog of a path in a process), reloaded incrementally"""
+    def __init__(index, path):
+        index.path = path
+        index.locations = {}
+        index.size  = 0      # bytes of pack.idx already loaded
+        index.inode = None   # pack.idx is replaced by compact: then reloaded from scratch
+        index.recovered = False
+        index.verified  = set()  # locations whose record passed its crc check (see PackCatalog.verify)
+        index.mutex = threading.Lock()
+
+    def reload(index, truncate=False):
+        """load new entries. `truncate`: drop a torn last entry (only when holding the pack lock)"""
+        with index.mutex:
+            try:
+                stat = os.stat(index.path)
+            except FileNotFoundError:
+                return index
+            if stat.st_ino != index.inode:
+                index.locations, index.size, index.inode = {}, 0, stat.st_ino
+                index.verified = set()
+            if stat.st_size == index.size:
+                return index
+            with open(index.path, "rb") as buffer:
+                buffer.seek(index.size)
+                data = buffer.read()
+            end = 0
+            for _hash, location, end in iter_entries(data):
+                index.locations.setdefault(_hash, location)
+            index.size += end
+            if truncate and index.size != stat.st_size:
+                os.truncate(index.path, index.size)
+        return index
+
+_indexes = {}
+_indexes_mutex = threading.Lock()
+
+
+class PackCatalog(Catalog):
+    segment_size = 2**28
+
+    def ensure_exists(catalog):
+        path = pathlib.Path(catalog.path)
+        path.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+    def index(catalog) -> PackIndex:
+        path = str(pathlib.Path(catalog.path) / "pack.idx")
+        with _indexes_mutex:
+            if path not in _indexes:
+                _indexes[path] = PackIndex(path)
+            return _indexes[path]
+
+    def segment_path(catalog, segment) -> pathlib.Path:
+        return pathlib.Path(catalog.path) / f"segment-{segment:08d}.pack"
+
+    def segments(catalog) -> [int]:
+        return sorted(int(path.name[len("segment-"):-len(".pack")])
+                      for path in pathlib.Path(catalog.path).glob("segment-*.pack"))
+
+    def item_path(catalog, hash):
+        raise NotImplementedError("PackCatalog items are not stored as files")
+
+    def lock(catalog):
+        """context manager: exclusive (blocking) flock for writers"""
+        catalog.ensure_exists()
+        return _Lock(pathlib.Path(catalog.path) / "pack.lock")
+
+    def location(catalog, hash) -> Location:
+        """raises KeyError"""
+        index = catalog.index()
+        try:
+            return index.locations[hash]
+        except KeyError:
+            # maybe added by another process
+            return index.reload().locations[hash]
+
+    def contains(catalog, hash) -> bool:
+        try:
+            catalog.location(hash)
+            return True
+        except KeyError:
+            return False
+
+    def exists(catalog, hash) -> bool:
+        """contains (note: the pack index is the catalog, whether indexed or not)"""
+        return catalog.contains(hash)
+
+    def iter(catalog) -> ["Hash"]:
+        catalog.ensure_exists()
+        yield from tuple(catalog.index().reload().locations)
+
+    def add(catalog, item) -> "Hash":
+        # bytes fields given as file-like or iterator of chunks
+        if deser.has_stream(catalog.Type, item):
+            return catalog.add_stream(item)
+        # derive hash
+        _hash = catalog.hash_item(item)
+        # already in catalog ?
+        if catalog.contains(_hash):
+            return _hash
+        buffer = io.BytesIO()
+        catalog.serialize(item, buffer)
+        with catalog.lock():
+            catalog.append(_hash, (buffer.getbuffer(),))
+        refs.record_many(catalog, ((_hash, item),))
+        return _hash
+
+    def add_stream(catalog, item) -> "Hash":
+        """see Catalog.add_stream: the item is spooled to a temporary file, then appended by chunks"""
+        catalog.ensure_exists()
+        digest = catalog.stream_digest()
+        with tempfile.TemporaryFile(dir=catalog.path) as buffer:
+            catalog.serialize(item, buffer, digest=digest)
+            _hash = catalog.hash_buffer(buffer) if digest is None else digest.digest()
+            if catalog.contains(_hash):
+                return _hash
+            buffer.seek(0)
+            with catalog.lock():
+                catalog.append(_hash, deser.iter_chunks(buffer))
+        refs.record_many(catalog, ((_hash, item),))
+        return _hash
+
+    E_ADD_NOSAFE = Catalog.E_ADD_NOSAFE
+    def add_nosafe(catalog, item) -> "Hash":
+        """variant of add: fails if exists"""
+        assert not deser.has_stream(catalog.Type, item), "streamed bytes fields are not supported by add_nosafe"
+        _hash = catalog.hash_item(item)
+        buffer = io.BytesIO()
+        catalog.serialize(item, buffer)
+        with catalog.lock():
+            if catalog.contains(_hash):
+                raise catalog.E_ADD_NOSAFE(f"Already contained in catalog: {_hash.hex()}")
+            catalog.append(_hash, (buffer.getbuffer(),))
+        refs.record_many(catalog, ((_hash, item),))
+        return _hash
+
+    def write_batch(catalog, hashes_and_items):
+        """appends items known to be missing under a single lock (see Catalog.add_many)"""
+        hashes_and_items, records = list(hashes_and_items), []
+        for _hash, item in hashes_and_items:
+            buffer = io.BytesIO()
+            catalog.serialize(item, buffer)
+            records.append((_hash, buffer.getbuffer()))
+        with catalog.lock():
+            catalog.append_many((_hash, (data,)) for _hash, data in records)
+        refs.record_many(catalog, hashes_and_items)
+
+    def append(catalog, _hash, chunks) -> Location:
+        """appends a record then its index entry (note: the caller holds the lock)"""
+        location, = catalog.append_many(((_hash, chunks),))
+        return location
+
+    def append_many(catalog, records) -> [Location]:
+        """appends records (hash, chunks), fsyncs their segments (durability but none), then appends their index
+        entries: an index entry never refers to a record that may be torn after a crash (note: the caller holds
+        the lock)"""
+        index = catalog.index()
+        if not index.recovered:
+            catalog.recover_locked()
+        # already in catalog ? (e.g. added by another process while we were serializing)
+        index.reload()
+        locations, entries, segment_paths = [], {}, {}
+        for _hash, chunks in records:
+            if _hash in index.locations or _hash in entries:
+                locations.append(index.locations.get(_hash) or entries[_hash])
+                continue
+            segments = catalog.segments() or [0]
+            segment  = segments[-1]
+            segment_path = catalog.segment_path(segment)
+            if segment_path.exists() and segment_path.stat().st_size >= catalog.segment_size:
+                segment += 1
+                segment_path = catalog.segment_path(segment)
+            entries[_hash] = write_record(segment_path, segment, _hash, chunks)
+            locations.append(entries[_hash])
+            segment_paths[segment_path] = None
+        if not entries:
+            return locations
+        if catalog.policy().mode != "none":
+            for segment_path in segment_paths:
+                durability.fsync_file(segment_path)
+        with open(index.path, "ab") as buffer:
+            buffer.write(b"".join(pack_entry(_hash, location) for _hash, location in entries.items()))
+        # note: the directory of a new segment is fsynced along with the index (same directory)
+        catalog.persist((index.path,))
+        index.reload()
+        return locations
+
+    def resolve(catalog, hash) -> "(hash, Location)":
+        """location of hash, or of its alias (see Catalog.alias). raises KeyError"""
+        try:
+            return hash, catalog.location(hash)
+        except KeyError:
+            alias = catalog.alias(hash)
+            try:
+                return alias, catalog.location(alias)
+            except KeyError:
+                raise KeyError(f"{hash.hex()} not in catalog {catalog}")
+
+    def get(catalog, hash, lazy=False):
+        """`lazy`: a deser.LazyRecord (see Catalog.get), the segment is memory mapped, bytes fields are memoryview
+        slices of the mapping"""
+        if catalog.cache is not None and not lazy:
+            return catalog.get_cached(hash)
+        hash, location = catalog.resolve(hash)
+        try:
+            return catalog.read_location(hash, location, lazy)
+        except FileNotFoundError:
+            # segment removed by compact: locations changed
+            catalog.index().reload()
+            return catalog.read_location(hash, catalog.location(hash), lazy)
+
+    def read(catalog, hash) -> bytes:
+        """the serialized item (see Catalog.get_many)"""
+        hash, location = catalog.resolve(hash)
+        try:
+            return catalog.read_bytes(hash, location)
+        except FileNotFoundError:
+            catalog.index().reload()
+            return catalog.read_bytes(hash, catalog.location(hash))
+
+    def open_record(catalog, hash) -> "(buffer, size)":
+        """the segment file of the record, positioned at its start (see Catalog.column). note: not verified (see
+        verify), the record may be read in part"""
+        hash, location = catalog.resolve(hash)
+        try:
+            buffer = open(catalog.segment_path(location.segment), "rb")
+        except FileNotFoundError:
+            location = catalog.index().reload().locations[hash]
+            buffer = open(catalog.segment_path(location.segment), "rb")
+        buffer.seek(location.offset)
+        return buffer, location.length
+
+    def read_bytes(catalog, hash, location) -> bytes:
+        with open(catalog.segment_path(location.segment), "rb") as buffer:
+            data = os.pread(buffer.fileno(), location.length, location.offset)
+            catalog.verify(buffer, hash, location, data)
+            return data
+
+    def read_location(catalog, hash, location, lazy=False):
+        with open(catalog.segment_path(location.segment), "rb") as buffer:
+            if lazy:
+                mapping = mmap.mmap(buffer.fileno(), 0, access=mmap.ACCESS_READ)
+                view = memoryview(mapping)[location.offset:location.offset + location.length]
+                catalog.verify(buffer, hash, location, view)
+                return catalog.deserialize_lazy(view)
+        return catalog.deserialize(io.BytesIO(catalog.read_bytes(hash, location)))
+
+    def verify(catalog, buffer, hash, location, payload=None):
+        """raises ValueError if the record of location is torn (see check_record), once per location and process
+        (records never change)"""
+        index = catalog.index()
+        if location in index.verified:
+            return
+        if not check_record(buffer, hash, location, payload):
+            raise ValueError(f"record {hash.hex()} of {catalog.segment_path(location.segment)} is torn (crc mismatch), "
+                             f"see recover")
+        index.verified.add(location)
+
+    def recover(catalog) -> int:
+        """crash recovery: drop the index entries of torn records (see check_record), index complete records missing
+        from the index, truncate torn records. returns the number of records re-indexed"""
+        with catalog.lock():
+            return catalog.recover_locked(verify=True)
+
+    def recover_locked(catalog, verify=False) -> int:
+        """`verify`: check every indexed record (reads all segments), else only the records past the indexed ones
+        (e.g. before the first write of a process, torn indexed records are then detected when read, see verify)"""
+        index = catalog.index()
+        index.reload(truncate=True)
+        if verify:
+            by_segment, torn = {}, set()
+            for _hash, location in index.locations.items():
+                by_segment.setdefault(location.segment, []).append((_hash, location))
+            for segment, entries in by_segment.items():
+                try:
+                    buffer = open(catalog.segment_path(segment), "rb")
+                except FileNotFoundError:
+                    torn.update(_hash for _hash, _ in entries)
+                    continue
+                with buffer:
+                    torn.update(_hash for _hash, location in entries if not check_record(buffer, _hash, location))
+            if torn:
+                write_index(index.path, ((_hash, location) for _hash, location in index.locations.items() if _hash not in torn))
+                index.reload()
+        # only the part of segments past the last indexed record needs a scan
+        ends = {}
+        for location in index.locations.values():
+            ends[location.segment] = max(ends.get(location.segment, 0), location.offset + location.length)
+        recovered = 0
+        for segment in catalog.segments():
+            segment_path = catalog.segment_path(segment)
+            offset = ends.get(segment, 0)
+            entries = []
+            with open(segment_path, "rb") as buffer:
+                for _hash, location in scan_records(buffer, segment, offset):
+                    offset = location.offset + location.length
+                    if _hash not in index.locations:
+                        entries.append(pack_entry(_hash, location))
+            if offset != segment_path.stat().st_size:
+                os.truncate(segment_path, offset)
+            if entries:
+                with open(index.path, "ab") as buffer:
+                    buffer.write(b"".join(entries))
+                recovered += len(entries)
+        index.reload()
+        index.recovered = True
+        return recovered
+
+    def compact(catalog) -> int:
+        """rewrites indexed records into new segments and a new index (dropping duplicates and garbage).
+        returns the number of segments removed"""
+        with catalog.lock():
+            catalog.recover_locked()
+            index = catalog.index()
+            old_segments = catalog.segments()
+            segment = (old_segments[-1] + 1) if old_segments else 0
+            entries = []
+            for _hash, location in tuple(index.locations.items()):
+                segment_path = catalog.segment_path(segment)
+                if segment_path.exists() and segment_path.stat().st_size >= catalog.segment_size:
+                    segment += 1
+                    segment_path = catalog.segment_path(segment)
+                with open(catalog.segment_path(location.segment), "rb") as buffer:
+                    chunks = iter_range(buffer, location.offset, location.length)
+                    entries.append((_hash, write_record(segment_path, segment, _hash, chunks)))
+            for new_segment in dict.fromkeys(location.segment for _, location in entries):
+                durability.fsync_file(catalog.segment_path(new_segment))
+            write_index(index.path, entries)
+            for old_segment in old_segments:
+                catalog.segment_path(old_segment).unlink()
+            index.reload()
+            return len(old_segments) - len(catalog.segments())
+
+
+class ROPackCatalog(PackCatalog):
+    def ensure_exists(catalog):
+        path = pathlib.Path(catalog.path)
+        assert path.exists()
+    def add(catalog, item) -> "Hash":
+        raise Exception("ROPackCatalog is read only")
+
+
+class _Lock:
+    def __init__(lock, path):
+        lock.path = path
+    def __enter__(lock):
+        lock.buffer = open(lock.path, "ab")
+        fcntl.flock(lock.buffer, fcntl.LOCK_EX)
+        return lock
+    def __exit__(lock, *exc_info):
+        fcntl.flock(lock.buffer, fcntl.LOCK_UN)
+        lock.buffer.close()
+
+
+def write_record(segment_path, segment, _hash, chunks) -> Location:
+    """appends a record to a segment. the header (size, crc) is written last: a torn record never looks complete"""
+    fd = os.open(segment_path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        start = os.lseek(fd, 0, os.SEEK_END)
+        offset = start + record_header.size + len(_hash)
+        os.pwrite(fd, record_header.pack(b"\0" * 4, len(_hash), 0, 0) + _hash, start)
+        size, crc = 0, 0
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            view = memoryview(chunk)
+            while view:
+                written = os.pwrite(fd, view, offset + size)
+                view = view[written:]
+                size += written
+        os.pwrite(fd, record_header.pack(RECORD_MAGIC, len(_hash), size, crc), start)
+    finally:
+        os.close(fd)
+    return Location(segment, offset, size)
+
+def check_record(buffer, _hash, location, payload=None) -> bool:
+    """whether the record of location is complete: its header (magic, hash, size) and the crc32 of its payload
+    (`payload`: already read, else read from buffer, the segment file)"""
+    start = location.offset - len(_hash) - record_header.size
+    if start < 0:
+        return False
+    head = os.pread(buffer.fileno(), record_header.size + len(_hash), start)
+    if len(head) < record_header.size + len(_hash):
+        return False
+    magic, hash_size, size, crc = record_header.unpack_from(head)
+    if magic != RECORD_MAGIC or hash_size != len(_hash) or head[record_header.size:] != _hash or size != location.length:
+        return False
+    if payload is not None:
+        return len(payload) == size and zlib.crc32(payload) == crc
+    _crc = 0
+    try:
+        for chunk in iter_range(buffer, location.offset, location.length):
+            _crc = zlib.crc32(chunk, _crc)
+    except EOFError:
+        return False
+    return _crc == crc
+
+def write_index(index_path, entries):
+    """replaces the index file by entries (hash, Location), fsynced. note: readers notice the new index (inode) and
+    reload it"""
+    tmp_index_path = index_path + ".tmp"
+    with open(tmp_index_path, "wb") as index_buffer:
+        for _hash, location in entries:
+            index_buffer.write(pack_entry(_hash, location))
+        index_buffer.flush()
+        os.fsync(index_buffer.fileno())
+    os.rename(tmp_index_path, index_path)
+    durability.fsync_directory(os.path.dirname(os.path.abspath(index_path)))
+
+def scan_records(buffer, segment, offset) -> "(hash, Location)":
+    """complete records of a segment from offset (stops at the first torn or corrupted record)"""
+    end = os.fstat(buffer.fileno()).st_size
+    while offset + record_header.size <= end:
+        buffer.seek(offset)
+        magic, hash_size, size, crc = record_header.unpack(buffer.read(record_header.size))
+        payload_offset = offset + record_header.size + hash_size
+        if magic != RECORD_MAGIC or payload_offset + size > end:
+            return
+        _hash = buffer.read(hash_size)
+        _crc = 0
+        for chunk in iter_range(buffer, payload_offset, size):
+            _crc = zlib.crc32(chunk, _crc)
+        if _crc != crc:
+            return
+        yield _hash, Location(segment, payload_offset, size)
+        offset = payload_offset + size
+
+def iter_range(buffer, offset, length, chunk_size=deser.CHUNK_SIZE):
+    buffer.seek(offset)
+    while length > 0:
+        chunk = buffer.read(min(chunk_size, length))
+        if not chunk:
+            raise EOFError(f"{buffer.name}: expected {length} more bytes")
+        length -= len(chunk)
+        yield chunk
+
+
+#### tests
+def fixture_PackCatalog(name, segment_size=PackCatalog.segment_size):
+    import os
+    import shutil
+    import shared.hparams
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    path = SDEXPERIMENTS_PATH / name
+    shutil.rmtree(path, ignore_errors=True)
+    _indexes.pop(str(path / "pack.idx"), None)
+    _PackCatalog = type("_PackCatalog", (PackCatalog,), {"segment_size": segment_size})
+    return _PackCatalog(path=path, item_suffix=".hparams", Type=shared.hparams.fixture_node_HPARAMS)
+
+def fixture_node_hparams(n):
+    import shared.hparams
+    hparams, = shared.hparams.fixture_nested_hparams()
+    for seed in range(n):
+        yield hparams._replace(seed=seed, blob=os.urandom(seed % 7))
+
+def test_PackCatalog_round_trip():
+    import shutil
+    catalog = fixture_PackCatalog("testPackCatalog")
+    items = tuple(fixture_node_hparams(100))
+    hashes = [catalog.add(item) for item in items]
+    assert hashes == [hash.hash(b'', catalog.Type, item) for item in items]
+    assert catalog.add(items[0]) == hashes[0]
+    for _hash, item in zip(hashes, items):
+        assert catalog.contains(_hash)
+        assert catalog.get(_hash) == item
+        assert catalog.get(_hash, lazy=True).materialize() == item
+    assert set(catalog.iter()) == set(hashes)
+    assert not catalog.contains(b"\0" * 16)
+    try:
+        catalog.add_nosafe(items[0])
+    except catalog.E_ADD_NOSAFE:
+        pass
+    else:
+        assert False, "add_nosafe should fail if exists"
+    # another process (i.e. a fresh index) sees the same items
+    _indexes.clear()
+    assert set(catalog.iter()) == set(hashes)
+    shutil.rmtree(catalog.path)
+
+def test_PackCatalog_add_many():
+    import shutil
+    catalog = fixture_PackCatalog("testPackCatalogAddMany")
+    items = tuple(fixture_node_hparams(100)) * 2
+    catalog.add(items[3])
+    hashes = catalog.add_many(items, batch_size=16)
+    assert hashes == [hash.hash(b'', catalog.Type, item) for item in items]
+    assert len(tuple(catalog.iter())) == 100
+    for _hash, item in zip(hashes, items):
+        assert catalog.get(_hash) == item
+    results = list(catalog.get_many(hashes[:100] + [b"\0" * 16], max_workers=4))
+    assert [result.item for result in results[:-1]] == list(items[:100])
+    assert isinstance(results[-1].error, KeyError)
+    shutil.rmtree(catalog.path)
+
+def test_PackCatalog_recover():
+    import shutil
+    catalog = fixture_PackCatalog("testPackCatalogRecover")
+    items = tuple(fixture_node_hparams(10))
+    hashes = [catalog.add(item) for item in items[:5]]
+    # crash after writing a record, but before indexing it
+    unindexed = items[5]
+    buffer = io.BytesIO()
+    deser.serialize(catalog.Type, unindexed, buffer)
+    segment = catalog.segments()[-1]
+    write_record(catalog.segment_path(segment), segment, hash.hash(b'', catalog.Type, unindexed), (buffer.getvalue(),))
+    # crash in the middle of a record, and of an index entry
+    with open(catalog.segment_path(segment), "ab") as _buffer:
+        _buffer.write(record_header.pack(b"\0" * 4, 16, 1000, 0) + b"torn")
+    with open(catalog.index().path, "ab") as _buffer:
+        _buffer.write(b"\x10torn")
+    size = catalog.segment_path(segment).stat().st_size
+    _indexes.clear()
+    assert catalog.recover() == 1
+    assert catalog.get(hash.hash(b'', catalog.Type, unindexed)) == unindexed
+    assert catalog.segment_path(segment).stat().st_size < size
+    hashes += [catalog.add(item) for item in items[6:]]
+    for _hash in hashes:
+        assert catalog.contains(_hash)
+    shutil.rmtree(catalog.path)
+
+def test_PackCatalog_torn_indexed_record():
+    import shutil
+    catalog = fixture_PackCatalog("testPackCatalogTornIndexed")
+    items = tuple(fixture_node_hparams(10))
+    hashes = [catalog.add(item) for item in items]
+    # crash: the index entry reached the disk, not the whole record (e.g. durability none)
+    location = catalog.location(hashes[3])
+    with open(catalog.segment_path(location.segment), "r+b") as buffer:
+        buffer.seek(location.offset + location.length // 2)
+        byte = buffer.read(1)
+        buffer.seek(-1, io.SEEK_CUR)
+        buffer.write(bytes([byte[0] ^ 0xff]))
+    _indexes.clear()
+    for read in (catalog.get, catalog.read, lambda _hash: catalog.get(_hash, lazy=True)):
+        try:
+            read(hashes[3])
+            assert False, "expected ValueError"
+        except ValueError:
+            pass
+    # recover drops its entry, it can be added again
+    assert catalog.recover() == 0
+    assert not catalog.contains(hashes[3])
+    assert catalog.add(items[3]) == hashes[3]
+    _indexes.clear()
+    for _hash, item in zip(hashes, items):
+        assert catalog.get(_hash) == item
+    shutil.rmtree(catalog.path)
+
+def test_PackCatalog_compact():
+    import shutil
+    catalog = fixture_PackCatalog("testPackCatalogCompact", segment_size=1024)
+    items = tuple(fixture_node_hparams(50))
+    hashes = [catalog.add(item) for item in items]
+    segments = catalog.segments()
+    assert len(segments) > 1
+    # compacting into larger segments
+    catalog = type(catalog).__bases__[0](*catalog)
+    assert catalog.compact() == len(segments) - 1
+    assert set(catalog.iter()) == set(hashes)
+    for _hash, item in zip(hashes, items):
+        assert catalog.get(_hash) == item
+    shutil.rmtree(catalog.path)
+
+
+if __name__ == "__main__":
+    # CLI: python -m shared.packfile <HPARAMS qualname> [--recover] [--compact]
+    import sys, shared.utils, shared.packfile
+    argv = [arg for arg in sys.argv if not arg.startswith("--")]
+    catalog = shared.utils.catalog_from_qualname(argv[1], write=True)
+    assert isinstance(catalog, shared.packfile.PackCatalog), f"not a PackCatalog: {catalog} (hint: CATALOG_ENGINE=pack)"
+    if "--recover" in sys.argv:
+        print(f"recovered {catalog.recover()} records")
+    if "--compact" in sys.argv:
+        print(f"compacted {catalog.compact()} segments")
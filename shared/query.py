@@ -0,0 +1,248 @@
+"""field predicate queries over a catalog, e.g. the experiments with optimizer.lr < 1e-3 and model.layers == (10, 10):
+
+    catalog.where(("optimizer.lr", "<", 1e-3), ("model.layers", "==", (10, 10)))
+
+the items are flattened into a sqlite table (<catalog.path>/.query.sqlite), one row per item and one column per
+leaf path of the type (the steps of deser.plan, but bytes fields), attached as the schema named after the type
+(e.g. "EXPERIMENT_HPARAMS".items) to a db.session: queries can join other attached schemas.
+tuples are stored as json text (equality only), ints wider than 64 bits as text. the table reflects the catalog as of the last sync, an incremental
+pass on the hashes added or removed since (where syncs a table never synced). chosen paths are indexed (see index).
+
+    python -m shared.query experiment_model.EXPERIMENT_HPARAMS --sync --index=model.layers,optimizer.lr "optimizer.lr<0.001"
+"""
+import concurrent.futures, json, os, pathlib, re, threading, typing
+from shared import db, deser
+
+INDEX_NAME = ".query.sqlite"
+# note: int columns have no affinity, an int wider than 64 bits is stored as text (not converted to REAL)
+SQL_TYPES  = {int: "", float: "REAL", bool: "INTEGER", str: "TEXT"}
+SQL_LAYOUT = b"\x02"  # version of the table layout, with the plan fingerprint (see create)
+INT64_MIN, INT64_MAX = -2**63, 2**63 - 1
+OPERATORS  = {"==": "=", "!=": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">=", "in": "IN"}
+
+
+def schema(catalog) -> str:
+    return catalog.Type.__name__
+
+def column_steps(Type) -> ["PlanStep"]:
+    """the leaf steps stored as columns (bytes fields are not)"""
+    return [step for step in deser.plan(Type).steps if step.type is not bytes]
+
+def column(path) -> str:
+    return '"' + path.replace('"', '""') + '"'
+
+def sql_value(value):
+    if isinstance(value, tuple) or isinstance(value, deser.array_types):
+        # note: nested tuples of numbers are tuples of arrays (ragged)
+        return json.dumps(value, default=lambda array: array.tolist())
+    if type(value) is int and not INT64_MIN <= value <= INT64_MAX:
+        return str(value)
+    return value
+
+def fingerprint(catalog) -> bytes:
+    return deser.plan(catalog.Type).fingerprint + SQL_LAYOUT
+
+def uri(catalog) -> str:
+    return f"file:{pathlib.Path(catalog.path).absolute() / INDEX_NAME}"
+
+_connections = threading.local()  # note: sqlite3 connections are not shared between threads (nor forked processes)
+def connect(catalog, schemas=(), schema_to_uri=None) -> "sqlite3.Connection":
+    """db.session with the table of catalog attached as schema(catalog), and `schemas` (see db.session).
+    cached when no other schema is attached"""
+    connections = _connections.__dict__.setdefault("connections", {})
+    key = (os.getpid(), str(catalog.path))
+    if schemas or key not in connections:
+        catalog.ensure_exists()
+        connection = db.session((*schemas, schema(catalog)), {**(schema_to_uri or {}), schema(catalog): uri(catalog)})
+        if catalog.durability == "none":
+            # note: the table can be rebuilt from the catalog
+            connection.execute(f'PRAGMA "{schema(catalog)}".synchronous = OFF')
+        create(catalog, connection)
+        if schemas:
+            return connection
+        connections[key] = connection
+    return connections[key]
+
+def create(catalog, connection):
+    """creates the table, again if the type layout changed (see deser.Plan.fingerprint) or the table layout"""
+    name = schema(catalog)
+    connection.execute(f'CREATE TABLE IF NOT EXISTS "{name}".layout (fingerprint BLOB, synced INTEGER)')
+    row = connection.execute(f'SELECT fingerprint FROM "{name}".layout').fetchone()
+    if row is not None and row[0] == fingerprint(catalog):
+        return
+    columns = "".join(f", {column('.'.join(step.path))} {SQL_TYPES[step.type]}" for step in column_steps(catalog.Type))
+    with connection:
+        connection.execute(f'DROP TABLE IF EXISTS "{name}".items')
+        connection.execute(f'CREATE TABLE "{name}".items (hash BLOB PRIMARY KEY{columns}) WITHOUT ROWID')
+        connection.execute(f'DELETE FROM "{name}".layout')
+        connection.execute(f'INSERT INTO "{name}".layout VALUES (?, 0)', (fingerprint(catalog),))
+
+def row(catalog, _hash) -> tuple:
+    """(hash, *column values) of an item: v2 records are not deserialized, only the frames of the columns are unpacked"""
+    _plan = deser.plan(catalog.Type)
+    view  = memoryview(catalog.read(_hash))
+    if view[:len(deser.MAGIC)] != deser.MAGIC:
+        values = zip(_plan.steps, _plan.values(catalog.deserialize_view(view)))
+        return (_hash, *(sql_value(value) for step, value in values if step.type is not bytes))
+    return (_hash, *(sql_value(step.unpack(kind, data)) for step, kind, data in deser.iter_record_frames(_plan, view)
+                     if step.type is not bytes))
+
+def sync(catalog, max_workers=8, batch_size=4096) -> "(added, removed)":
+    """inserts the rows of the items added to catalog since the last sync, deletes those of the items removed"""
+    connection, name = connect(catalog), schema(catalog)
+    on_disk = set(catalog.iter())
+    synced  = {_hash for _hash, in connection.execute(f'SELECT hash FROM "{name}".items')}
+    added, removed = list(on_disk - synced), synced - on_disk
+    placeholders = ", ".join("?" * (1 + len(column_steps(catalog.Type))))
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        for start in range(0, len(added), batch_size):
+            rows = list(executor.map(lambda _hash: row(catalog, _hash), added[start:start + batch_size]))
+            with connection:
+                connection.executemany(f'INSERT OR REPLACE INTO "{name}".items VALUES ({placeholders})', rows)
+    with connection:
+        connection.executemany(f'DELETE FROM "{name}".items WHERE hash = ?', ((_hash,) for _hash in removed))
+        connection.execute(f'UPDATE "{name}".layout SET synced = 1')
+    return len(added), len(removed)
+
+def remove_many(catalog, hashes):
+    """deletes the rows of items removed from catalog (e.g. see shared.rekey), if the table exists"""
+    if not (pathlib.Path(catalog.path) / INDEX_NAME).exists():
+        return
+    connection, name = connect(catalog), schema(catalog)
+    with connection:
+        connection.executemany(f'DELETE FROM "{name}".items WHERE hash = ?', ((_hash,) for _hash in hashes))
+
+def index(catalog, *paths):
+    """creates the sqlite indexes of paths (e.g. the paths queried the most). a tuple of paths is a composite index,
+    e.g. ("model.layers", "optimizer.lr"): conditions on both are answered from the index only"""
+    connection, name = connect(catalog), schema(catalog)
+    with connection:
+        for path in paths:
+            path = (path,) if isinstance(path, str) else tuple(path)
+            for _path in path:
+                check_path(catalog, _path)
+            index_name = "index_" + re.sub(r"\W", "_", "__".join(path))
+            connection.execute(f'CREATE INDEX IF NOT EXISTS "{name}".{index_name} ON items ({", ".join(map(column, path))})')
+        # note: statistics for the query planner to choose among indexes
+        connection.execute(f'ANALYZE "{name}"')
+
+def check_path(catalog, path):
+    if path not in {".".join(step.path) for step in column_steps(catalog.Type)}:
+        raise KeyError(f"{path} is not a leaf path of {catalog.Type.__name__} (bytes fields are not queryable)")
+
+def sql_where(catalog, conditions) -> "(sql, params)":
+    """conditions: (path, operator, value), operator in OPERATORS ("in": value is a sequence)"""
+    clauses, params = [], []
+    for path, operator, value in conditions:
+        check_path(catalog, path)
+        if operator not in OPERATORS:
+            raise ValueError(f"unknown operator {operator!r}, expected one of {', '.join(OPERATORS)}")
+        if operator == "in":
+            clauses.append(f"{column(path)} IN ({', '.join('?' * len(value))})")
+            params += [sql_value(item) for item in value]
+        else:
+            clauses.append(f"{column(path)} {OPERATORS[operator]} ?")
+            params.append(sql_value(value))
+    return " AND ".join(clauses) or "1", params
+
+def where(catalog, *conditions, refresh=False) -> ["Hash"]:
+    """hashes of the items matching all the conditions (see sql_where). `refresh`: sync the table first"""
+    connection, name = connect(catalog), schema(catalog)
+    if refresh or not connection.execute(f'SELECT synced FROM "{name}".layout').fetchone()[0]:
+        sync(catalog)
+    sql, params = sql_where(catalog, conditions)
+    return [_hash for _hash, in connection.execute(f'SELECT hash FROM "{name}".items WHERE {sql}', params)]
+
+def parse_condition(text) -> "(path, operator, value)":
+    """e.g. "optimizer.lr<1e-3" or "model.layers==(10, 10)" (value: a python literal)"""
+    import ast
+    path, operator, value = re.fullmatch(r"\s*([\w.]+)\s*(==|!=|<=|>=|<|>|\sin\s)\s*(.+)", text).groups()
+    return path, operator.strip(), ast.literal_eval(value.strip())
+
+
+#### tests
+def test_where():
+    import shutil
+    import experiment_model
+    import shared.catalog, shared.packfile
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    EXPERIMENT_HPARAMS, MODEL_HPARAMS = experiment_model.EXPERIMENT_HPARAMS, experiment_model.MODEL_HPARAMS
+    base  = EXPERIMENT_HPARAMS()
+    items = [base._replace(seed=seed, optimizer=base.optimizer._replace(lr=10.0 ** -(seed % 5)),
+                           model=MODEL_HPARAMS(layers=(10,) * (1 + seed % 3)))
+             for seed in range(60)]
+    for Catalog in (shared.catalog.Catalog, shared.packfile.PackCatalog):
+        catalog = Catalog(
+            path = SDEXPERIMENTS_PATH / f"testQuery{Catalog.__name__}",
+            item_suffix = ".experiment",
+            Type = EXPERIMENT_HPARAMS,
+        )
+        shutil.rmtree(catalog.path, ignore_errors=True)
+        hashes = dict(zip([catalog.add(item) for item in items[:40]], items[:40]))
+        def expected(predicate):
+            return sorted(_hash for _hash, item in hashes.items() if predicate(item))
+        conditions = (("optimizer.lr", "<", 1e-3), ("model.layers", "==", (10, 10)))
+        assert sorted(catalog.where(*conditions)) == expected(lambda item: item.optimizer.lr < 1e-3 and item.model.layers == (10, 10))
+        # incremental sync: items added since
+        hashes.update(zip([catalog.add(item) for item in items[40:]], items[40:]))
+        assert len(catalog.where()) == 40
+        assert sync(catalog) == (20, 0)
+        assert sorted(catalog.where(("seed", "in", (3, 45, 1000)), ("train_dataset.split", "==", "train"))) == \
+               expected(lambda item: item.seed in (3, 45))
+        assert sorted(catalog.where(parse_condition("dataloader.shuffler.random != 'random.Uniform'"))) == []
+        # indexed paths
+        index(catalog, "seed", ("model.layers", "optimizer.lr"))
+        sql, params = sql_where(catalog, conditions)
+        plan = connect(catalog).execute(f'EXPLAIN QUERY PLAN SELECT hash FROM "{schema(catalog)}".items WHERE {sql}', params).fetchall()
+        assert "COVERING INDEX index_model_layers__optimizer_lr" in str(plan)
+        # joined with another schema of the session
+        connection = connect(catalog, ("DATA",), {"DATA": "file::memory:"})
+        connection.execute('CREATE TABLE "DATA".scores (hash BLOB, score REAL)')
+        connection.executemany('INSERT INTO "DATA".scores VALUES (?, ?)', ((_hash, item.seed / 10) for _hash, item in hashes.items()))
+        best, = connection.execute(f'''SELECT items.seed FROM "{schema(catalog)}".items JOIN "DATA".scores USING (hash)
+                                       ORDER BY score DESC LIMIT 1''').fetchone()
+        assert best == 59
+        try:
+            catalog.where(("checkpoint", "==", b""))
+            assert False, "expected KeyError"
+        except KeyError:
+            pass
+        shutil.rmtree(catalog.path)
+
+class RAGGED_HPARAMS(typing.NamedTuple):
+    name: str
+    shape: int
+    seed: int
+
+def test_where_nested_values():
+    import shutil
+    import shared.catalog
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    catalog = shared.catalog.Catalog(
+        path = SDEXPERIMENTS_PATH / "testQueryNestedValues",
+        item_suffix = ".ragged",
+        Type = RAGGED_HPARAMS,
+    )
+    shutil.rmtree(catalog.path, ignore_errors=True)
+    a, b, c = (catalog.add(item) for item in (RAGGED_HPARAMS("a", ((1, 2), (3,)), 2**70),
+                                              RAGGED_HPARAMS("b", (1, 2), -2**70),
+                                              RAGGED_HPARAMS("c", ((1,), (2, 3)), 5)))
+    assert catalog.where(("name", "==", "a")) == [a]
+    assert catalog.where(("shape", "==", ((1, 2), (3,)))) == [a]
+    assert catalog.where(("shape", "==", (1, 2))) == [b]
+    assert catalog.where(("seed", "==", 2**70)) == [a]
+    assert catalog.where(("seed", "==", -2**70)) == [b]
+    assert catalog.where(("seed", "<", 10), ("seed", ">", 0)) == [c]
+    shutil.rmtree(catalog.path)
+
+
+if __name__ == "__main__":
+    import sys, shared.utils
+    argv = [arg for arg in sys.argv if not arg.startswith("--")]
+    catalog = shared.utils.ro_catalog_from_qualname(argv[1])
+    if "--sync" in sys.argv:
+        added, removed = sync(catalog)
+        print(f"query table of {catalog.path}: added {added}, removed {removed}", file=sys.stderr)
+    index(catalog, *(arg[len("--index="):].split(",") for arg in sys.argv if arg.startswith("--index=")))
+    for _hash in where(catalog, *map(parse_condition, argv[2:])):
+        print(_hash.hex())
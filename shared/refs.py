@@ -0,0 +1,170 @@
+"""sqlite index of the reference fields of a catalog: the items referring to a given value, e.g. the run logs and
+checkpoints of an experiment (catalog.find_by(experiment=ExperimentRef_HPARAMS(hash_hex, "train"))).
+
+reference fields are the fields, at any depth, of a type named *Ref_HPARAMS (see ref_paths). the index
+(<catalog.path>/.refs.sqlite) maps (field path, hash of the reference value) -> item hash, a b-tree lookup.
+it is updated by Catalog.add (both engines), and built from the catalog by its first find_by when the catalog
+already had items. rebuild() resyncs it (e.g. items removed, or added by an older version).
+"""
+import functools, os, pathlib, threading
+from shared import db, deser, hash
+
+SCHEMA     = "CATALOG_REFS"
+INDEX_NAME = ".refs.sqlite"
+REF_SUFFIX = "Ref_HPARAMS"
+
+
+@functools.lru_cache(maxsize=None)
+def ref_paths(Type) -> "((path, RefType), ...)":
+    """the dotted paths of the reference fields of Type"""
+    paths = []
+    for name, annotation_type in Type.__annotations__.items():
+        if not deser.is_composite_type(annotation_type):
+            continue
+        if annotation_type.__name__.endswith(REF_SUFFIX):
+            paths.append((name, annotation_type))
+        else:
+            paths += [(f"{name}.{path}", RefType) for path, RefType in ref_paths(annotation_type)]
+    return tuple(paths)
+
+def ref_key(ref) -> bytes:
+    """the key of a reference value (note: md5 whatever the catalog hash algorithm, keys are never stored as items)"""
+    return hash.hash(b'', type(ref), ref)
+
+def ref_values(Type, item) -> "((path, ref), ...)":
+    values = []
+    for path, _ in ref_paths(Type):
+        value = item
+        for name in path.split("."):
+            value = getattr(value, name)
+        # note: of a lazy item (see rebuild)
+        values.append((path, value.materialize() if isinstance(value, deser.LazyRecord) else value))
+    return values
+
+def uri(catalog) -> str:
+    return f"file:{pathlib.Path(catalog.path).absolute() / INDEX_NAME}"
+
+_connections = threading.local()  # note: sqlite3 connections are not shared between threads (nor forked processes)
+def connect(catalog) -> "sqlite3.Connection":
+    """cached db.session with the refs index attached as SCHEMA"""
+    connections = _connections.__dict__.setdefault("connections", {})
+    key = (os.getpid(), str(catalog.path))
+    if key not in connections:
+        catalog.ensure_exists()
+        connection = db.session((SCHEMA,), {SCHEMA: uri(catalog)})
+        if catalog.durability == "none":
+            # note: the index can be rebuilt from the catalog, no fsync per add
+            connection.execute(f'PRAGMA "{SCHEMA}".synchronous = OFF')
+        connection.executescript(f'''
+            CREATE TABLE IF NOT EXISTS "{SCHEMA}".refs (
+                path TEXT, ref BLOB, hash BLOB, PRIMARY KEY (path, ref, hash)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS "{SCHEMA}".items (hash BLOB PRIMARY KEY) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS "{SCHEMA}".built (built INTEGER);
+        ''')
+        connections[key] = connection
+    return connections[key]
+
+def record_many(catalog, hashes_and_items):
+    """indexes the references of items just added (no-op for types without reference fields)"""
+    if not ref_paths(catalog.Type):
+        return
+    hashes_and_items = list(hashes_and_items)
+    connection = connect(catalog)
+    with connection:
+        connection.executemany(f'INSERT OR IGNORE INTO "{SCHEMA}".refs VALUES (?, ?, ?)',
+                               ((path, ref_key(ref), _hash) for _hash, item in hashes_and_items
+                                for path, ref in ref_values(catalog.Type, item)))
+        connection.executemany(f'INSERT OR IGNORE INTO "{SCHEMA}".items VALUES (?)',
+                               ((_hash,) for _hash, _ in hashes_and_items))
+
+def remove_many(catalog, hashes):
+    """unindexes items removed from catalog (e.g. see shared.rekey)"""
+    if not ref_paths(catalog.Type):
+        return
+    connection = connect(catalog)
+    with connection:
+        connection.executemany(f'DELETE FROM "{SCHEMA}".refs WHERE hash = ?', ((_hash,) for _hash in hashes))
+        connection.executemany(f'DELETE FROM "{SCHEMA}".items WHERE hash = ?', ((_hash,) for _hash in hashes))
+
+def rebuild(catalog) -> "(added, removed)":
+    """resync the index from the catalog items (note: lazy gets, bytes fields are not read)"""
+    connection = connect(catalog)
+    on_disk = set(catalog.iter())
+    indexed = {_hash for _hash, in connection.execute(f'SELECT hash FROM "{SCHEMA}".items')}
+    added, removed = on_disk - indexed, indexed - on_disk
+    record_many(catalog, ((_hash, catalog.get(_hash, lazy=True)) for _hash in added))
+    with connection:
+        connection.executemany(f'DELETE FROM "{SCHEMA}".refs WHERE hash = ?', ((_hash,) for _hash in removed))
+        connection.executemany(f'DELETE FROM "{SCHEMA}".items WHERE hash = ?', ((_hash,) for _hash in removed))
+        connection.execute(f'DELETE FROM "{SCHEMA}".built')
+        connection.execute(f'INSERT INTO "{SCHEMA}".built VALUES (1)')
+    return len(added), len(removed)
+
+def find_by(catalog, **refs) -> ["Hash"]:
+    """hashes of the items whose reference fields (dotted paths as keywords, e.g. **{"a.ref": ref}) equal refs"""
+    paths = dict(ref_paths(catalog.Type))
+    for path in refs:
+        if path not in paths:
+            raise KeyError(f"{path} is not a reference field of {catalog.Type.__name__} (see ref_paths)")
+    connection = connect(catalog)
+    if connection.execute(f'SELECT 1 FROM "{SCHEMA}".built').fetchone() is None:
+        rebuild(catalog)
+    matches = None
+    for path, ref in refs.items():
+        cursor = connection.execute(f'SELECT hash FROM "{SCHEMA}".refs WHERE path = ? AND ref = ?', (path, ref_key(ref)))
+        hashes = [_hash for _hash, in cursor]
+        if matches is None:
+            matches = hashes
+        else:
+            hashes  = set(hashes)
+            matches = [_hash for _hash in matches if _hash in hashes]
+    return matches if matches is not None else list(catalog.iter())
+
+
+#### tests
+def test_find_by():
+    import shutil
+    import experiment_model
+    import shared.catalog, shared.packfile
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    RunLog_HPARAMS, ExperimentRef_HPARAMS = experiment_model.RunLog_HPARAMS, experiment_model.ExperimentRef_HPARAMS
+    assert ref_paths(RunLog_HPARAMS) == (("experiment", ExperimentRef_HPARAMS),)
+    assert ref_paths(experiment_model.EXPERIMENT_HPARAMS) == ()
+    refs  = [ExperimentRef_HPARAMS(f"{i:032x}", "train") for i in range(5)]
+    items = [RunLog_HPARAMS(ref, experiment_model.IterationLog_HPARAMS((0, 1), (seed, 0.5))) for ref in refs for seed in (1., 2.)]
+    for Catalog in (shared.catalog.Catalog, shared.packfile.PackCatalog):
+        catalog = Catalog(
+            path = SDEXPERIMENTS_PATH / f"testRefs{Catalog.__name__}",
+            item_suffix = ".runlog",
+            Type = RunLog_HPARAMS,
+        )
+        shutil.rmtree(catalog.path, ignore_errors=True)
+        # items added before the index: built by the first find_by
+        unindexed = [catalog.add(item) for item in items[:4]]
+        connect(catalog).executescript(f'DELETE FROM "{SCHEMA}".refs; DELETE FROM "{SCHEMA}".items;')
+        hashes = unindexed + [catalog.add(item) for item in items[4:6]] + catalog.add_many(items[6:])
+        for i, ref in enumerate(refs):
+            assert sorted(catalog.find_by(experiment=ref)) == sorted(hashes[2 * i:2 * i + 2])
+        assert catalog.find_by(experiment=ExperimentRef_HPARAMS("0" * 32, "val")) == []
+        # items removed behind the index
+        if Catalog is shared.catalog.Catalog:
+            catalog.item_path(hashes[0]).unlink()
+            assert rebuild(catalog) == (0, 1)
+            assert catalog.find_by(experiment=refs[0]) == [hashes[1]]
+        try:
+            catalog.find_by(iteration=refs[0])
+            assert False, "expected KeyError"
+        except KeyError:
+            pass
+        shutil.rmtree(catalog.path)
+
+
+if __name__ == "__main__":
+    # CLI: python -m shared.refs <HPARAMS qualname> --rebuild
+    import sys, shared.utils
+    argv = [arg for arg in sys.argv if not arg.startswith("--")]
+    catalog = shared.utils.ro_catalog_from_qualname(argv[1])
+    if "--rebuild" in sys.argv:
+        added, removed = rebuild(catalog)
+        print(f"refs index of {catalog.path}: added {added}, removed {removed}")
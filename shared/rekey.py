@@ -0,0 +1,145 @@
+"""re-keys the items of a catalog to another hash algorithm (see shared.hash.ALGORITHMS).
+
+items are written again under their new hash, and the alias map (<catalog.path>/.aliases, lines "<old hex> <new hex>")
+records the new hash of each old hash: Catalog.get resolves old hashes (e.g. ExperimentRef_HPARAMS.experiment_hash_hex)
+through it, even once the old items are removed.
+
+    python -m shared.rekey <HPARAMS qualname> --algorithm=blake2b [--remove]
+"""
+import os, pathlib, threading
+from shared import catalog_index, hash, query, refs
+
+ALIASES_NAME = ".aliases"
+
+
+def aliases_path(catalog) -> pathlib.Path:
+    return pathlib.Path(catalog.path) / ALIASES_NAME
+
+_aliases = {}  # path -> (stat key, {old hash: new hash})
+_aliases_mutex = threading.Lock()
+def aliases(catalog) -> dict:
+    """the alias map of a catalog, reloaded when the file changed"""
+    path = aliases_path(catalog)
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return {}
+    key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    with _aliases_mutex:
+        cached = _aliases.get(str(path))
+        if cached is None or cached[0] != key:
+            mapping = {}
+            for line in path.read_text().splitlines():
+                old, new = line.split()
+                mapping[bytes.fromhex(old)] = bytes.fromhex(new)
+            cached = _aliases[str(path)] = (key, mapping)
+    return cached[1]
+
+def record_aliases(catalog, old_and_new_hashes):
+    lines = "".join(f"{old.hex()} {new.hex()}\n" for old, new in old_and_new_hashes)
+    # note: a single append write
+    fd = os.open(aliases_path(catalog), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(fd, lines.encode("ascii"))
+    finally:
+        os.close(fd)
+
+def rekey(catalog, algorithm, max_workers=8, batch_size=4096, remove=False) -> int:
+    """re-keys the items of catalog not hashed with `algorithm`: by batches, items are read in a thread pool
+    (see Catalog.get_many), hashed in a process pool (see shared.catalog.hash_many) and written under their new hash,
+    then aliased. `remove`: old item files are removed (files engine only), and from the indexes of the catalog
+    (see shared.catalog_index, shared.refs, shared.query). returns the number of items re-keyed"""
+    import shared.catalog, shared.packfile
+    if remove and isinstance(catalog, shared.packfile.PackCatalog):
+        raise ValueError("remove is not supported by the pack engine (records are never removed)")
+    target  = catalog._replace(hash_algorithm=algorithm)
+    aliased = aliases(catalog)
+    old_hashes = [_hash for _hash in catalog.iter() if hash.algorithm_of(_hash) != algorithm and _hash not in aliased]
+    for start in range(0, len(old_hashes), batch_size):
+        batch = old_hashes[start:start + batch_size]
+        items = []
+        for result in catalog.get_many(batch, max_workers):
+            if result.error is not None:
+                raise result.error
+            items.append(result.item)
+        new_hashes = shared.catalog.hash_many(target.salt, target.Type, items, max_workers,
+                                              chunk_size=max(1, len(items) // max_workers),
+                                              scheme=target.hash_scheme, algorithm=algorithm)
+        target.write_batch([(new_hash, item) for new_hash, item in zip(new_hashes, items) if not target.exists(new_hash)])
+        record_aliases(catalog, zip(batch, new_hashes))
+        if remove:
+            for old_hash in batch:
+                catalog.find_item_path(old_hash).unlink()
+            refs.remove_many(catalog, batch)
+            query.remove_many(catalog, batch)
+    if remove and catalog.indexed:
+        catalog_index.rebuild(catalog)
+    return len(old_hashes)
+
+
+#### tests
+def test_rekey():
+    import os
+    import shutil
+    import shared.catalog, shared.hparams, shared.packfile
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    hparams, = shared.hparams.fixture_nested_hparams()
+    for Catalog, remove in ((shared.catalog.Catalog, True), (shared.packfile.PackCatalog, False)):
+        catalog = Catalog(
+            path = SDEXPERIMENTS_PATH / f"testRekey{Catalog.__name__}",
+            item_suffix = ".hparams",
+            Type = type(hparams),
+            shard_depth = 1,
+        )
+        shutil.rmtree(catalog.path, ignore_errors=True)
+        items  = [hparams._replace(seed=seed) for seed in range(30)]
+        hashes = [catalog.add(item) for item in items]
+        assert rekey(catalog, "blake2b", max_workers=2, batch_size=8, remove=remove) == 30
+        target = catalog._replace(hash_algorithm="blake2b")
+        new_hashes = [target.add(item) for item in items]
+        assert {hash.algorithm_of(_hash) for _hash in new_hashes} == {"blake2b"}
+        assert aliases(catalog) == dict(zip(hashes, new_hashes))
+        # old hashes resolve, with both algorithms in the catalog
+        assert [catalog.get(_hash) for _hash in hashes] == items
+        assert [result.item for result in catalog.get_many(hashes)] == items
+        assert set(catalog.iter()) == (set(new_hashes) if remove else set(hashes) | set(new_hashes))
+        assert rekey(catalog, "blake2b") == 0
+        shutil.rmtree(catalog.path)
+
+def test_rekey_indexes():
+    import os
+    import shutil
+    import experiment_model
+    import shared.catalog, shared.packfile
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    RunLog_HPARAMS, ExperimentRef_HPARAMS = experiment_model.RunLog_HPARAMS, experiment_model.ExperimentRef_HPARAMS
+    ref   = ExperimentRef_HPARAMS("00" * 16, "train")
+    items = [RunLog_HPARAMS(ref, experiment_model.IterationLog_HPARAMS((seed,), (float(seed),))) for seed in range(10)]
+    for Catalog, remove in ((shared.catalog.Catalog, True), (shared.packfile.PackCatalog, False)):
+        catalog = Catalog(
+            path = SDEXPERIMENTS_PATH / f"testRekeyIndexes{Catalog.__name__}",
+            item_suffix = ".run_log",
+            Type = RunLog_HPARAMS,
+            indexed = True,
+        )
+        shutil.rmtree(catalog.path, ignore_errors=True)
+        hashes = [catalog.add(item) for item in items]
+        assert sorted(catalog.find_by(experiment=ref)) == sorted(hashes)
+        assert sorted(catalog.where(("experiment.split", "==", "train"))) == sorted(hashes)
+        assert rekey(catalog, "blake2b", remove=remove) == 10
+        new_hashes = [catalog._replace(hash_algorithm="blake2b").hash_item(item) for item in items]
+        expected = sorted(new_hashes if remove else hashes + new_hashes)
+        assert sorted(catalog.find_by(experiment=ref)) == expected
+        # note: the query table is synced on demand, removed items are gone from it already
+        assert not remove or not set(catalog.where(("experiment.split", "==", "train"))) & set(hashes)
+        assert sorted(catalog.where(("experiment.split", "==", "train"), refresh=True)) == expected
+        shutil.rmtree(catalog.path)
+
+
+if __name__ == "__main__":
+    import sys, shared.utils
+    argv = [arg for arg in sys.argv if not arg.startswith("--")]
+    catalog = shared.utils.catalog_from_qualname(argv[1], write=True)
+    algorithm = next(arg[len("--algorithm="):] for arg in sys.argv if arg.startswith("--algorithm="))
+    rekeyed = rekey(catalog, algorithm, remove="--remove" in sys.argv)
+    print(f"re-keyed {rekeyed} items of {catalog.path} to {algorithm}")
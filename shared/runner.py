@@ -0,0 +1,167 @@
+"""runs a task (e.g. train.train) for the items of a catalog in a pool of worker processes.
+
+    python -m shared.runner experiment_model.EXPERIMENT_HPARAMS train.train --is-done=train.is_done --workers=4
+
+replaces `python populate.py | xargs -I % python train.py %`: workers import the task module once (warm imports),
+a failing task (exception or dead worker) only fails its hash, hashes whose outputs exist are skipped (`is_done`).
+tasks write to content addressed catalogs: the results are those of running the tasks one after the other.
+"""
+import concurrent.futures, importlib, os, sys, time, traceback, typing
+
+
+class Outcome(typing.NamedTuple):
+    hash: "Hash"
+    error: str       # formatted exception, None if the task succeeded
+    seconds: float
+
+class RunReport(typing.NamedTuple):
+    succeeded: tuple  # hashes
+    failed: tuple     # Outcome
+    skipped: tuple    # hashes (is_done)
+    seconds: float
+
+def warm_up(modules):
+    """worker initializer: imports once per worker what tasks need"""
+    for module in modules:
+        importlib.import_module(module)
+
+def run_task(task, _hash) -> Outcome:
+    start = time.perf_counter()
+    try:
+        task(_hash)
+        return Outcome(_hash, None, time.perf_counter() - start)
+    except Exception:
+        return Outcome(_hash, traceback.format_exc(), time.perf_counter() - start)
+
+def report_progress(outcome, completed, total, started, file=sys.stderr):
+    elapsed = time.perf_counter() - started
+    status  = "ok" if outcome.error is None else "FAILED"
+    print(f"[{completed}/{total}] {outcome.hash.hex()} {status} in {outcome.seconds:.1f}s "
+          f"({completed / elapsed:.2f} tasks/s)", file=file)
+    if outcome.error is not None:
+        print(outcome.error, file=file)
+
+def run(catalog, task, hashes=None, is_done=None, max_workers=None, warm_imports=(), retries=1,
+        progress=report_progress) -> RunReport:
+    """task(hash) for hashes (default: catalog.iter()) but those is_done(hash), in max_workers processes.
+
+    `task`: picklable (e.g. a module level function), its module is imported by the workers with `warm_imports`
+    `retries`: a hash whose worker died (e.g. killed, segfault) is run again, as the others running at that time
+    `progress`: called with (Outcome, completed, total, start time) as tasks complete"""
+    started = time.perf_counter()
+    hashes  = list(catalog.iter() if hashes is None else hashes)
+    done_hashes = {_hash for _hash in hashes if is_done is not None and is_done(_hash)}
+    skipped = tuple(_hash for _hash in hashes if _hash in done_hashes)
+    pending = [_hash for _hash in reversed(hashes) if _hash not in done_hashes]  # note: popped from the end
+    total, attempts = len(pending), {}
+    max_workers = max_workers or os.cpu_count() or 1
+    modules = (*warm_imports, task.__module__)
+    def new_executor():
+        return concurrent.futures.ProcessPoolExecutor(max_workers, initializer=warm_up, initargs=(modules,))
+    executor = new_executor()
+    window   = 2 * max_workers
+    running, succeeded, failed = {}, [], []
+    try:
+        while pending or running:
+            while pending and len(running) < window:
+                _hash = pending.pop()
+                attempts[_hash] = attempts.get(_hash, 0) + 1
+                running[executor.submit(run_task, task, _hash)] = _hash
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                _hash = running.pop(future)
+                try:
+                    outcome = future.result()
+                except concurrent.futures.process.BrokenProcessPool:
+                    # note: all the running tasks fail with the pool, not only the one of the dead worker
+                    broken = True
+                    if attempts[_hash] <= retries:
+                        pending.append(_hash)
+                        continue
+                    outcome = Outcome(_hash, "worker process died", 0.)
+                if outcome.error is None:
+                    succeeded.append(_hash)
+                else:
+                    failed.append(outcome)
+                if progress is not None:
+                    progress(outcome, len(succeeded) + len(failed), total, started)
+            if broken:
+                executor.shutdown(wait=True)
+                executor = new_executor()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    return RunReport(tuple(succeeded), tuple(failed), skipped, time.perf_counter() - started)
+
+
+#### tests
+def fixture_paths():
+    import os
+    import pathlib
+    SDEXPERIMENTS_PATH = pathlib.Path(os.environ["SDEXPERIMENTS_PATH"])
+    return SDEXPERIMENTS_PATH / "testRunnerInputs", SDEXPERIMENTS_PATH / "testRunnerOutputs"
+
+def fixture_catalogs():
+    import shared.catalog, shared.hparams
+    inputs_path, outputs_path = fixture_paths()
+    Type = shared.hparams.fixture_node_HPARAMS
+    return (shared.catalog.Catalog(path=inputs_path, item_suffix=".hparams", Type=Type),
+            shared.catalog.Catalog(path=outputs_path, item_suffix=".hparams", Type=Type))
+
+def fixture_task(_hash):
+    """output: the input with its seed doubled. seed 3 raises, seed 5 kills its worker once"""
+    import os
+    inputs, outputs = fixture_catalogs()
+    item = inputs.get(_hash)
+    if item.seed == 3:
+        raise ValueError("seed 3 fails")
+    if item.seed == 5 and not (outputs.path / "seed5").exists():
+        outputs.ensure_exists()
+        (outputs.path / "seed5").touch()
+        os._exit(1)
+    outputs.add(item._replace(seed=item.seed * 2))
+
+def fixture_is_done(_hash):
+    inputs, outputs = fixture_catalogs()
+    return outputs.contains(outputs.hash_item(inputs.get(_hash)._replace(seed=inputs.get(_hash).seed * 2)))
+
+def test_run():
+    import shutil
+    import shared.hparams
+    inputs, outputs = fixture_catalogs()
+    for catalog in (inputs, outputs):
+        shutil.rmtree(catalog.path, ignore_errors=True)
+    hparams, = shared.hparams.fixture_nested_hparams()
+    items  = [hparams._replace(seed=seed) for seed in range(10)]
+    hashes = [inputs.add(item) for item in items]
+    outputs.add(items[0]._replace(seed=0))  # seed 0 is done already
+
+    report = run(inputs, fixture_task, is_done=fixture_is_done, max_workers=3, progress=None)
+    assert report.skipped == (hashes[0],)
+    assert [outcome.hash for outcome in report.failed] == [hashes[3]] and "seed 3 fails" in report.failed[0].error
+    # seed 5 killed its worker: run again (as the tasks running at that time)
+    assert set(report.succeeded) == set(hashes) - {hashes[0], hashes[3]}
+    # same outputs as the sequential tasks
+    expected = {outputs.hash_item(item._replace(seed=item.seed * 2)) for item in items if item.seed != 3}
+    assert set(outputs.iter()) == expected
+    # all done but the failing one
+    report = run(inputs, fixture_task, is_done=fixture_is_done, max_workers=2, progress=None)
+    assert len(report.skipped) == 9 and len(report.failed) == 1 and not report.succeeded
+
+    for catalog in (inputs, outputs):
+        shutil.rmtree(catalog.path)
+
+
+if __name__ == "__main__":
+    import shared.utils
+    argv = [arg for arg in sys.argv if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv if arg.startswith("--") and "=" in arg)
+    catalog = shared.utils.ro_catalog_from_qualname(argv[1])
+    task    = shared.utils.import_from_qualname(argv[2])
+    is_done = shared.utils.import_from_qualname(options["is-done"]) if "is-done" in options else None
+    report  = run(catalog, task, is_done=is_done, max_workers=int(options.get("workers", 0)) or None)
+    print(f"{len(report.succeeded)} succeeded, {len(report.failed)} failed, {len(report.skipped)} skipped "
+          f"in {report.seconds:.1f}s", file=sys.stderr)
+    for outcome in report.failed:
+        print(f"FAILED {outcome.hash.hex()}", file=sys.stderr)
+    sys.exit(1 if report.failed else 0)
@@ -0,0 +1,21 @@
+"""helpers for the command line utilities of the shared modules"""
+import importlib
+
+
+def import_from_qualname(qualname):
+    """e.g. "experiment_model.EXPERIMENT_HPARAMS" -> experiment_model.EXPERIMENT_HPARAMS"""
+    module_name, _, name = qualname.rpartition(".")
+    return getattr(importlib.import_module(module_name), name)
+
+def catalog_from_qualname(qualname, write=False):
+    """the catalog of *your* environment (see env.default_catalog) for a HPARAMS type given by its qualname"""
+    import env
+    return env.default_catalog(import_from_qualname(qualname), write=write)
+
+def ro_catalog_from_qualname(qualname):
+    return catalog_from_qualname(qualname, write=False)
+
+
+def test_import_from_qualname():
+    import shared.hparams
+    assert import_from_qualname("shared.hparams.fixture_node_HPARAMS") is shared.hparams.fixture_node_HPARAMS
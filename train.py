@@ -12,7 +12,7 @@ your option) any later version.
 import experiment_model          # *your* experiment
 from env import default_catalog  # access to catalog in *your* environment
 import dummydumb_framework       # *your* favorite ML framework :)
-import io
+import tempfile
 
 
 def train(experiment_hparams_hash):
@@ -77,18 +77,33 @@ def train(experiment_hparams_hash):
 
     # checkpoint
     checkpoint_catalog = default_catalog(experiment_model.Checkpoint_HPARAMS, write=True)
-    buffer = io.BytesIO()
-    model.save_checkpoint(buffer)
-    # note3: checkpoints are our metadata, and then just bytes that the framework knows how to handle 
-    checkpoint = experiment_model.Checkpoint_HPARAMS(
-        experiment_ref,
-        iteration,
-        checkpoint=buffer.getvalue()
-    )
-    checkpoint_hash = checkpoint_catalog.add(checkpoint)
+    with tempfile.TemporaryFile() as buffer:
+        model.save_checkpoint(buffer)
+        buffer.seek(0)
+        # note3: checkpoints are our metadata, and then just bytes that the framework knows how to handle 
+        # note4: the checkpoint is streamed from the file (never fully loaded in memory)
+        checkpoint = experiment_model.Checkpoint_HPARAMS(
+            experiment_ref,
+            iteration,
+            checkpoint=buffer
+        )
+        checkpoint_hash = checkpoint_catalog.add(checkpoint)
 
+    # note5: persisted before reporting success (see CATALOG_DURABILITY)
+    run_log_catalog.flush()
+    checkpoint_catalog.flush()
     print(f"training for experiment {experiment_hparams_hash.hex()} done. Wrote run_log {run_log_hash.hex()} and saved checkpoint {checkpoint_hash.hex()}")
-    
+
+
+def is_done(experiment_hparams_hash) -> bool:
+    """an experiment is done once its checkpoint is in the catalog (note: written last, see train)"""
+    checkpoint_catalog = default_catalog(experiment_model.Checkpoint_HPARAMS)
+    if not checkpoint_catalog.path.exists():
+        return False
+    # note: a lookup in the refs index of the catalog (see shared.refs), no scan
+    experiment_ref = experiment_model.ExperimentRef_HPARAMS(experiment_hparams_hash.hex(), "train")
+    return bool(checkpoint_catalog.find_by(experiment=experiment_ref))
+
 
 if __name__ == "__main__":
     # CLI utility